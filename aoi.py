@@ -0,0 +1,146 @@
+# aoi.py
+#
+# The area of interest: the part of the inputs worth reading. It is the
+# overlap of the LAZ header bounds and the GeoTIFF bounds, optionally
+# narrowed by a user bbox or polygon (--aoi), and is handed to both readers
+# so that points and pixels outside it are never decoded: as a PDAL
+# filters.crop (or a per-chunk mask when streaming) and as a rasterio window.
+#
+# An AOI is a dict {"bounds": [min_x, min_y, max_x, max_y], "polygon":
+# [[x, y], ...] or None} in one CRS; the polygon is the outer ring only.
+
+import json
+import os
+import re
+
+import numpy as np
+from pyproj import CRS, Transformer
+
+# Points per edge used when reprojecting bounds, so curved edges stay covered
+DENSIFY_POINTS = 21
+
+
+def _parse_wkt_polygon(text):
+    match = re.match(r"\s*POLYGON\s*\(\s*\((.*?)\)", text, re.IGNORECASE | re.DOTALL)
+    if not match:
+        raise ValueError("Only WKT POLYGON areas of interest are supported.")
+    return [[float(v) for v in pair.split()[:2]] for pair in match.group(1).split(",")]
+
+
+def _parse_geojson_polygon(data):
+    if data.get("type") == "FeatureCollection":
+        data = data["features"][0]
+    if data.get("type") == "Feature":
+        data = data["geometry"]
+    if data.get("type") != "Polygon":
+        raise ValueError("Only GeoJSON Polygon areas of interest are supported.")
+    return [[float(x), float(y)] for x, y, *_ in data["coordinates"][0]]
+
+
+def _from_polygon(polygon):
+    xy = np.asarray(polygon, dtype=np.float64)
+    if len(xy) < 3:
+        raise ValueError("An area of interest polygon needs at least three vertices.")
+    return {"bounds": [*map(float, xy.min(axis=0)), *map(float, xy.max(axis=0))], "polygon": xy.tolist()}
+
+
+def parse_aoi(spec):
+    """
+    Reads an --aoi value: "min_x,min_y,max_x,max_y", a WKT POLYGON, or the
+    path of a .wkt or GeoJSON file holding one polygon.
+    """
+    if os.path.isfile(spec):
+        with open(spec) as f:
+            text = f.read()
+        if text.lstrip().startswith("{"):
+            return _from_polygon(_parse_geojson_polygon(json.loads(text)))
+        return _from_polygon(_parse_wkt_polygon(text))
+    if spec.lstrip().upper().startswith("POLYGON"):
+        return _from_polygon(_parse_wkt_polygon(spec))
+
+    values = [float(v) for v in spec.split(",")]
+    if len(values) != 4 or values[0] >= values[2] or values[1] >= values[3]:
+        raise ValueError(f"--aoi must be min_x,min_y,max_x,max_y, a WKT polygon or a file, got {spec!r}")
+    return {"bounds": values, "polygon": None}
+
+
+def transform_aoi(aoi, source_crs, target_crs):
+    """
+    Reprojects an AOI with the transformer align_coordinates uses. The
+    bounds are densified so they still enclose the area; polygon vertices
+    are transformed one by one.
+    """
+    if source_crs is None or target_crs is None or CRS(source_crs) == CRS(target_crs):
+        return aoi
+    transformer = Transformer.from_crs(CRS(source_crs), CRS(target_crs), always_xy=True)
+    bounds = [float(v) for v in transformer.transform_bounds(*aoi["bounds"], densify_pts=DENSIFY_POINTS)]
+    polygon = None
+    if aoi["polygon"]:
+        xy = np.asarray(aoi["polygon"], dtype=np.float64)
+        x, y = transformer.transform(xy[:, 0], xy[:, 1])
+        polygon = np.column_stack([x, y]).tolist()
+    return {"bounds": bounds, "polygon": polygon}
+
+
+def _intersect(a, b):
+    return [max(a[0], b[0]), max(a[1], b[1]), min(a[2], b[2]), min(a[3], b[3])]
+
+
+def _area(bounds):
+    return max(0.0, bounds[2] - bounds[0]) * max(0.0, bounds[3] - bounds[1])
+
+
+def resolve_aoi(tif_crs, tif_bounds, laz_crs, laz_bounds, user_aoi=None, user_crs=None):
+    """
+    The AOI in the GeoTIFF's CRS: the raster bounds intersected with the
+    LAZ bounds and, when given, user_aoi (in user_crs, by default the
+    GeoTIFF's). Raises ValueError when nothing is left.
+    """
+    bounds = list(tif_bounds)
+    laz_in_tif = transform_aoi({"bounds": list(laz_bounds), "polygon": None}, laz_crs, tif_crs)["bounds"]
+    bounds = _intersect(bounds, laz_in_tif)
+    polygon = None
+    if user_aoi:
+        user_aoi = transform_aoi(user_aoi, user_crs or tif_crs, tif_crs)
+        bounds = _intersect(bounds, user_aoi["bounds"])
+        polygon = user_aoi["polygon"]
+    if bounds[0] >= bounds[2] or bounds[1] >= bounds[3]:
+        raise ValueError("The LAZ, the GeoTIFF and the area of interest do not overlap.")
+
+    print(f"Area of interest: {_area(bounds) / max(_area(tif_bounds), 1e-12):.0%} of the raster, "
+          f"{_area(bounds) / max(_area(laz_in_tif), 1e-12):.0%} of the LiDAR footprint")
+    return {"bounds": [float(b) for b in bounds], "polygon": polygon}
+
+
+def aoi_pdal_crops(aoi):
+    """
+    PDAL filters.crop stages for the AOI, in the CRS of the points they
+    crop: the bounds, then the polygon when there is one. The bounds are the
+    raster and LAZ overlap, which the user's polygon may reach past, so both
+    apply, as in points_in_aoi.
+    """
+    min_x, min_y, max_x, max_y = aoi["bounds"]
+    stages = [{"type": "filters.crop", "bounds": f"([{min_x!r}, {max_x!r}], [{min_y!r}, {max_y!r}])"}]
+    if aoi["polygon"]:
+        ring = aoi["polygon"] + ([aoi["polygon"][0]] if aoi["polygon"][0] != aoi["polygon"][-1] else [])
+        stages.append({"type": "filters.crop",
+                       "polygon": "POLYGON((" + ", ".join(f"{x!r} {y!r}" for x, y in ring) + "))"})
+    return stages
+
+
+def points_in_aoi(x, y, aoi):
+    """Boolean mask of the x, y coordinates inside the AOI's bounds and polygon (even-odd rule)."""
+    min_x, min_y, max_x, max_y = aoi["bounds"]
+    inside = (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+    if aoi["polygon"] and inside.any():
+        candidates = np.flatnonzero(inside)
+        px, py = x[candidates], y[candidates]
+        ring = np.asarray(aoi["polygon"], dtype=np.float64)
+        crossings = np.zeros(len(candidates), dtype=bool)
+        for (x0, y0), (x1, y1) in zip(ring, np.roll(ring, -1, axis=0)):
+            if y0 == y1:
+                continue
+            spans = (y0 > py) != (y1 > py)
+            crossings ^= spans & (px < x0 + (py - y0) * (x1 - x0) / (y1 - y0))
+        inside[candidates] = crossings
+    return inside
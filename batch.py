@@ -0,0 +1,293 @@
+# batch.py
+#
+# Converts many LAZ/TIF pairs in one run. The geospatial and mesh stages run
+# in a process pool; the Blender stages are fed to a few long-lived Blender
+# workers (blender_processor.py --serve) that reset their scene between jobs
+# instead of paying Blender's startup cost for every tile.
+#
+#   python batch.py manifest.csv --jobs 8 --blender-workers 2
+#
+# The manifest is a CSV with laz,tif,fbx columns, or a JSON list / JSON-lines
+# file of {"laz": ..., "tif": ..., "fbx": ...} objects. "laz" may also be a
+# directory or glob of LAZ tiles (see laz_index.py).
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import queue
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from main import add_pipeline_arguments, normalize_args, prepare_assets
+from profiling import RESULT_PREFIX
+from stage_cache import StageCache
+
+# Lines of Blender output kept for a failed job's report
+LOG_TAIL_LINES = 40
+
+# Seconds a Blender worker may spend on one job before it is killed and restarted
+DEFAULT_JOB_TIMEOUT = 3600.0
+
+# Pipeline options sizing a job's own worker pools; left unset, each job
+# gets its share of the CPUs instead of all of them
+JOB_WORKER_OPTIONS = ("laz_workers", "tile_workers", "texture_workers", "normals_workers")
+
+
+def read_manifest(manifest_path):
+    """Returns the manifest as a list of {"laz", "tif", "fbx"} dicts."""
+    path = Path(manifest_path)
+    with open(path, newline="") as f:
+        if path.suffix.lower() == ".csv":
+            jobs = [dict(row) for row in csv.DictReader(f)]
+        else:
+            text = f.read().strip()
+            if text.startswith("["):
+                jobs = json.loads(text)
+            else:
+                jobs = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    for i, job in enumerate(jobs):
+        missing = {"laz", "tif", "fbx"} - set(job)
+        if missing:
+            raise ValueError(f"Manifest entry {i} is missing {', '.join(sorted(missing))}")
+    return jobs
+
+
+class BlenderWorker:
+    """One long-lived Blender process running blender_processor.py --serve."""
+
+    def __init__(self, blender_path, script_path, timeout=DEFAULT_JOB_TIMEOUT):
+        self.command = [blender_path, "--background", "--enable-autoexec",
+                        "--python", str(script_path), "--", "--serve"]
+        self.timeout = timeout
+        self.process = None
+        self.lines = None
+        self.jobs_done = 0
+        self.start()
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            bufsize=1,
+        )
+        # A reader thread queues Blender's output so a hung job can time out;
+        # None marks the end of the output
+        self.lines = queue.Queue()
+        threading.Thread(target=self._read_output, args=(self.process.stdout, self.lines), daemon=True).start()
+
+    @staticmethod
+    def _read_output(stdout, lines):
+        for line in stdout:
+            lines.put(line)
+        lines.put(None)
+
+    def run(self, job):
+        """
+        Sends one job and waits for its result line. If Blender dies mid-job,
+        the job runs longer than the timeout or its result line is malformed,
+        the job is reported as failed and a fresh worker process is started.
+        """
+        log = []
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        try:
+            self.process.stdin.write(json.dumps(job) + "\n")
+            self.process.stdin.flush()
+            while True:
+                try:
+                    line = self.lines.get(timeout=None if deadline is None
+                                          else max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    self.process.kill()
+                    raise RuntimeError(f"no result after {self.timeout:.0f}s, killed")
+                if line is None:
+                    raise RuntimeError(f"Blender exited with code {self.process.wait()}")
+                if line.startswith(RESULT_PREFIX):
+                    result = json.loads(line[len(RESULT_PREFIX):])
+                    if not isinstance(result, dict) or "ok" not in result:
+                        raise ValueError(f"no \"ok\" in result line {line.strip()!r}")
+                    break
+                log.append(line.rstrip())
+        except (OSError, RuntimeError) as e:
+            self.close()
+            self.start()
+            result = {"ok": False, "error": f"Blender worker died: {e}"}
+        except (ValueError, KeyError) as e:
+            self.process.kill()
+            self.close()
+            self.start()
+            result = {"ok": False, "error": f"Blender worker sent a malformed result: {type(e).__name__}: {e}"}
+
+        self.jobs_done += 1
+        if not result["ok"]:
+            result["log"] = log[-LOG_TAIL_LINES:]
+        return result
+
+    def close(self):
+        if self.process.poll() is None:
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+                self.process.wait()
+
+
+def job_worker_budget(args, job_count):
+    """
+    Fills the unset JOB_WORKER_OPTIONS with each concurrent job's share of
+    the CPUs, so --jobs jobs with their own pools do not each use every core.
+    Returns (concurrent jobs, workers per job).
+    """
+    cpus = os.cpu_count() or 1
+    concurrent = max(1, min(args.jobs or cpus, job_count))
+    budget = max(1, cpus // concurrent)
+    for name in JOB_WORKER_OPTIONS:
+        if getattr(args, name) is None:
+            setattr(args, name, budget)
+    return concurrent, budget
+
+
+def _keep_temp(args):
+    return args.keep_temp or args.debug_obj
+
+
+def _prepare_job(job, args, temp_root):
+    """
+    Process-pool entry point: runs the geospatial and mesh stages for one
+    job. Returns (blender_job, temp_dir); the directory holds the Blender
+    job's inputs and is already gone when there is no Blender job.
+    """
+    temp_dir = Path(tempfile.mkdtemp(prefix="job-", dir=temp_root))
+    cache = StageCache(args.cache_dir, args.cache_size, enabled=not args.no_cache)
+    blender_job = None
+    try:
+        blender_job = prepare_assets(job["laz"], job["tif"], job["fbx"], args, temp_dir, cache)
+    finally:
+        if blender_job is None and not _keep_temp(args):
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    return blender_job, temp_dir
+
+
+def _run_on_worker(workers, blender_job):
+    """Thread-pool entry point: borrows an idle Blender worker for one job."""
+    worker = workers.get()
+    try:
+        return worker.run(blender_job)
+    finally:
+        workers.put(worker)
+
+
+def run_batch(jobs, args):
+    """Runs every job and returns one result dict per job, in manifest order."""
+    temp_root = Path("./temp_geo_processing")
+    temp_root.mkdir(exist_ok=True)
+    script_path = (Path(__file__).parent / "blender_processor.py").resolve()
+
+    results = [None] * len(jobs)
+    workers = queue.Queue()
+    blender_workers = []
+    if args.exporter == "blender":
+        for _ in range(args.blender_workers):
+            worker = BlenderWorker(args.blender_path, script_path, args.job_timeout)
+            blender_workers.append(worker)
+            workers.put(worker)
+
+    concurrent, budget = job_worker_budget(args, len(jobs))
+    print(f"[batch] {concurrent} jobs at a time, {budget} workers per job pool")
+    try:
+        # Spawned workers: the LAZ decoder's thread pool does not survive a fork
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=concurrent, mp_context=context) as prepare_pool, \
+                ThreadPoolExecutor(max_workers=max(1, len(blender_workers))) as blender_pool:
+            prepared = {prepare_pool.submit(_prepare_job, job, args, temp_root): i
+                        for i, job in enumerate(jobs)}
+            baking = {}
+            for future in as_completed(prepared):
+                i = prepared[future]
+                try:
+                    blender_job, temp_dir = future.result()
+                except Exception as e:
+                    results[i] = {"ok": False, "stage": "prepare", "error": f"{type(e).__name__}: {e}"}
+                    print(f"[batch] job {i} failed while preparing: {e}")
+                    continue
+                if blender_job is None:
+                    # Native exporter: the FBX is already written
+                    results[i] = {"ok": True}
+                    continue
+                blender_job["id"] = i
+                baking[blender_pool.submit(_run_on_worker, workers, blender_job)] = i, temp_dir
+
+            for future in as_completed(baking):
+                i, temp_dir = baking[future]
+                try:
+                    results[i] = {**future.result(), "stage": "blender"}
+                except Exception as e:
+                    results[i] = {"ok": False, "stage": "blender", "error": f"{type(e).__name__}: {e}"}
+                finally:
+                    # The job's meshes and textures are no longer needed once Blender reported
+                    if not _keep_temp(args):
+                        shutil.rmtree(temp_dir, ignore_errors=True)
+                status = "done" if results[i]["ok"] else f"failed: {results[i]['error']}"
+                print(f"[batch] job {i} {status}")
+    finally:
+        for worker in blender_workers:
+            worker.close()
+    return results
+
+
+def print_report(jobs, results, elapsed):
+    succeeded = sum(1 for r in results if r and r["ok"])
+    failed = len(jobs) - succeeded
+    print("\n--- BATCH REPORT ---")
+    print(f"Jobs: {len(jobs)}  succeeded: {succeeded}  failed: {failed}")
+    print(f"Wall time: {elapsed:.1f}s  throughput: {60.0 * len(jobs) / elapsed:.2f} jobs/minute")
+    for job, result in zip(jobs, results):
+        if result and result["ok"]:
+            continue
+        error = result["error"] if result else "not run"
+        stage = result.get("stage", "?") if result else "?"
+        print(f"  FAILED [{stage}] {job['laz']} -> {job['fbx']}: {error}")
+        for line in (result or {}).get("log", []):
+            print(f"      {line}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert a manifest of LAZ/TIF pairs to FBX files.")
+    parser.add_argument("manifest", type=str, help="CSV or JSON manifest of laz/tif/fbx jobs.")
+    parser.add_argument("--jobs", type=int, default=None,
+                        help="Jobs prepared at once in the geospatial and mesh stages (default: CPU count). "
+                             "Each job's --laz/--tile/--texture/--normals-workers default to its share "
+                             "of the CPUs.")
+    parser.add_argument("--blender-workers", type=int, default=2,
+                        help="Long-lived Blender processes for texturing and export.")
+    parser.add_argument("--job-timeout", type=float, default=DEFAULT_JOB_TIMEOUT,
+                        help="Seconds a Blender worker may spend on one job before it is killed and "
+                             "restarted (0 for no limit).")
+    add_pipeline_arguments(parser)
+    args = normalize_args(parser.parse_args())
+
+    jobs = read_manifest(args.manifest)
+    print(f"Running {len(jobs)} jobs")
+    start = time.perf_counter()
+    results = run_batch(jobs, args)
+    print_report(jobs, results, time.perf_counter() - start)
+    if not all(r and r["ok"] for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
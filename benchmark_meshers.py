@@ -0,0 +1,65 @@
+# benchmark_meshers.py
+#
+# Runs the Poisson and grid meshers on the same point cloud and reports
+# wall time, triangle count and height error against the input points.
+#
+#   python benchmark_meshers.py input.laz [--target-triangles 100000]
+
+import argparse
+import time
+
+import numpy as np
+
+from point_cloud_processor import process_point_cloud
+from mesh_generator import generate_mesh_from_points
+from grid_mesher import generate_grid_mesh
+
+
+def height_rmse(mesh, points, sample=200000):
+    """RMS vertical distance from a sample of the points to the nearest mesh vertex in XY."""
+    import open3d as o3d
+
+    vertices = np.asarray(mesh.vertices)
+    flat = o3d.geometry.PointCloud()
+    flat.points = o3d.utility.Vector3dVector(np.column_stack((vertices[:, :2], np.zeros(len(vertices)))))
+    tree = o3d.geometry.KDTreeFlann(flat)
+
+    rng = np.random.default_rng(0)
+    picks = points[rng.choice(len(points), min(sample, len(points)), replace=False)]
+    errors = np.empty(len(picks))
+    for i, p in enumerate(picks):
+        _, idx, _ = tree.search_knn_vector_3d((p[0], p[1], 0.0), 1)
+        errors[i] = vertices[idx[0], 2] - p[2]
+    return float(np.sqrt(np.mean(errors ** 2)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Poisson and grid meshers.")
+    parser.add_argument("laz_input", type=str, help="Path to the input.laz file.")
+    parser.add_argument("--target-triangles", type=int, default=100000)
+    parser.add_argument("--skip-poisson", action="store_true", help="Only time the grid mesher.")
+    args = parser.parse_args()
+
+    points, _ = process_point_cloud(args.laz_input)
+    print(f"\nBenchmarking on {len(points)} points")
+
+    meshers = [("grid", lambda: generate_grid_mesh(points, target_triangles=args.target_triangles))]
+    if not args.skip_poisson:
+        meshers.append(("poisson", lambda: generate_mesh_from_points(points, target_triangles=args.target_triangles)))
+
+    results = []
+    for name, build in meshers:
+        start = time.perf_counter()
+        mesh = build()
+        elapsed = time.perf_counter() - start
+        results.append((name, elapsed, len(mesh.triangles), height_rmse(mesh, points)))
+
+    print(f"\n{'mesher':<10}{'seconds':>10}{'triangles':>12}{'height RMSE':>14}")
+    for name, elapsed, triangles, rmse in results:
+        print(f"{name:<10}{elapsed:>10.2f}{triangles:>12}{rmse:>14.3f}")
+    if len(results) == 2:
+        print(f"\nGrid mesher speed-up: {results[1][1] / results[0][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
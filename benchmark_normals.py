@@ -0,0 +1,65 @@
+# benchmark_normals.py
+#
+# Compares the normal engines on one point cloud: time, agreement between
+# the normals, and the quality of the Poisson surface built from each set
+# (triangle count and height error against the input points).
+#
+#   python benchmark_normals.py input.laz [--skip-poisson]
+
+import argparse
+import time
+
+import numpy as np
+import open3d as o3d
+
+from point_cloud_processor import process_point_cloud
+from normals import NORMAL_ENGINES, estimate_normals
+from mesh_generator import generate_mesh_from_points
+from benchmark_meshers import height_rmse
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the normal engines.")
+    parser.add_argument("laz_input", type=str, help="Path to the input.laz file.")
+    parser.add_argument("--target-triangles", type=int, default=100000)
+    parser.add_argument("--skip-poisson", action="store_true",
+                        help="Only time normal estimation, without the Poisson quality check.")
+    args = parser.parse_args()
+
+    points, _ = process_point_cloud(args.laz_input)
+    print(f"\nBenchmarking on {len(points)} points")
+
+    normals = {}
+    timings = {}
+    for engine in NORMAL_ENGINES:
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(points)
+        start = time.perf_counter()
+        estimate_normals(pcd, points, engine)
+        timings[engine] = time.perf_counter() - start
+        normals[engine] = np.asarray(pcd.normals)
+
+    # Unsigned angle: the engines may legitimately disagree on orientation
+    cosine = np.abs(np.einsum("ij,ij->i", normals["terrain"], normals["open3d"]))
+    angles = np.degrees(np.arccos(np.clip(cosine, 0.0, 1.0)))
+
+    print(f"\n{'engine':<10}{'seconds':>10}{'pointing down':>16}")
+    for engine in NORMAL_ENGINES:
+        down = 100.0 * np.mean(normals[engine][:, 2] < 0)
+        print(f"{engine:<10}{timings[engine]:>10.2f}{down:>15.1f}%")
+    print(f"\nTerrain engine speed-up: {timings['open3d'] / timings['terrain']:.1f}x")
+    print(f"Angle between engines: median {np.median(angles):.2f}°, "
+          f"95th percentile {np.percentile(angles, 95):.2f}°")
+
+    if args.skip_poisson:
+        return
+    print(f"\n{'engine':<10}{'seconds':>10}{'triangles':>12}{'height RMSE':>14}")
+    for engine in NORMAL_ENGINES:
+        start = time.perf_counter()
+        mesh = generate_mesh_from_points(points, target_triangles=args.target_triangles, normals=engine)
+        elapsed = time.perf_counter() - start
+        print(f"{engine:<10}{elapsed:>10.2f}{len(mesh.triangles):>12}{height_rmse(mesh, points):>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
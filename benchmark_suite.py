@@ -0,0 +1,395 @@
+# benchmark_suite.py
+#
+# Offline benchmark of the pipeline stages on synthetic data. For each size
+# it writes a LAZ file (classes 2/5/6/7 over a rolling terrain) and matching
+# 1-band uint16 and 3-band uint8 GeoTIFFs, then times every stage in a fresh
+# process so peak memory is per stage. It prints time and memory against
+# point count with a fitted scaling exponent, and fails when a stage is
+# slower than a stored baseline.
+#
+#   python benchmark_suite.py --sizes 100000 300000 1000000
+#   python benchmark_suite.py --save-baseline benchmark_baseline.json
+#   python benchmark_suite.py --baseline benchmark_baseline.json --tolerance 0.25
+#
+# Every run also times a fixed NumPy reference workload. With --relative,
+# stage times are compared as multiples of it, so a baseline saved on one
+# machine (a developer's, say) still applies on another (a CI runner):
+#
+#   python benchmark_suite.py --sizes 20000 50000 --baseline ci_baseline.json --relative
+#
+# The Blender tier (UV projection, bake and FBX export) runs only when a
+# Blender binary is found, see --blender-path.
+
+import argparse
+import json
+import math
+import multiprocessing
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import laspy
+import numpy as np
+import rasterio
+from pyproj import CRS
+from rasterio.transform import from_origin
+
+from profiling import METRICS_PREFIX, cpu_seconds, peak_rss_mb
+
+DEFAULT_SIZES = (100_000, 300_000, 1_000_000)
+SOURCE_EPSG = 32633
+TARGET_EPSG = 3857
+
+# Share of each classification in the synthetic clouds; 7 (noise) is dropped by the pipeline
+CLASS_WEIGHTS = {2: 0.6, 5: 0.25, 6: 0.1, 7: 0.05}
+
+# Changes smaller than these are never reported as regressions
+MIN_REGRESSION_S = 0.05
+MIN_REGRESSION_MB = 16.0
+
+# Results key of the reference workload's timing; not a stage
+REFERENCE_KEY = "_reference"
+
+
+# --- Synthetic data ---
+
+def make_synthetic_laz(path, n_points, density=4.0, seed=0):
+    """
+    Writes n_points over a square extent sized for `density` points per m².
+    Returns the extent (min_x, min_y, max_x, max_y).
+    """
+    rng = np.random.default_rng(seed)
+    side = math.sqrt(n_points / density)
+    min_x, min_y = 500000.0, 4000000.0
+
+    header = laspy.LasHeader(point_format=6, version="1.4")
+    header.scales = [0.01, 0.01, 0.01]
+    header.offsets = [min_x, min_y, 0.0]
+    header.add_crs(CRS.from_epsg(SOURCE_EPSG))
+    las = laspy.LasData(header)
+
+    x = min_x + rng.uniform(0, side, n_points)
+    y = min_y + rng.uniform(0, side, n_points)
+    classes = rng.choice(list(CLASS_WEIGHTS), n_points, p=list(CLASS_WEIGHTS.values()))
+    z = 100 + 8 * np.sin(x / 60) + 6 * np.cos(y / 45) + rng.normal(0, 0.05, n_points)
+    z[classes == 5] += rng.uniform(2, 20, np.count_nonzero(classes == 5))
+    z[classes == 6] += 8
+    z[classes == 7] += rng.normal(0, 30, np.count_nonzero(classes == 7))
+
+    las.x, las.y, las.z = x, y, z
+    las.classification = classes.astype(np.uint8)
+    las.write(str(path))
+    return min_x, min_y, min_x + side, min_y + side
+
+
+def make_synthetic_geotiff(path, extent, resolution=0.5, bands=3, dtype="uint8", seed=1):
+    """Writes a GeoTIFF covering extent at `resolution` m per pixel with smooth noise."""
+    rng = np.random.default_rng(seed)
+    min_x, min_y, max_x, max_y = extent
+    width = max(1, round((max_x - min_x) / resolution))
+    height = max(1, round((max_y - min_y) / resolution))
+    peak = np.iinfo(dtype).max if dtype == "uint8" else 4000
+    with rasterio.open(path, "w", driver="GTiff", width=width, height=height, count=bands,
+                       dtype=dtype, crs=f"EPSG:{SOURCE_EPSG}", tiled=True,
+                       transform=from_origin(min_x, max_y, resolution, resolution)) as dataset:
+        ramp = np.linspace(0, 1, width, dtype=np.float32)
+        for row0 in range(0, height, 512):
+            rows = min(512, height - row0)
+            block = ramp[None, None, :] * np.linspace(row0, row0 + rows, rows)[None, :, None] / height
+            block = block + rng.random((bands, rows, width), dtype=np.float32) * 0.2
+            dataset.write((np.clip(block, 0, 1) * peak).astype(dtype),
+                          window=((row0, row0 + rows), (0, width)))
+
+
+def make_inputs(work_dir, n_points, density):
+    """Generates (or reuses) the synthetic inputs for one size."""
+    work_dir.mkdir(parents=True, exist_ok=True)
+    inputs = {"laz": work_dir / "cloud.laz", "rgb8": work_dir / "rgb8.tif",
+              "gray16": work_dir / "gray16.tif", "points": work_dir / "points.npy"}
+    if not all(p.exists() for p in inputs.values()):
+        print(f"Generating synthetic data for {n_points} points in {work_dir}")
+        extent = make_synthetic_laz(inputs["laz"], n_points, density)
+        make_synthetic_geotiff(inputs["rgb8"], extent, bands=3, dtype="uint8")
+        make_synthetic_geotiff(inputs["gray16"], extent, bands=1, dtype="uint16")
+        # Filtered points as the pipeline would hand them to the mesher
+        from point_cloud_processor import process_point_cloud
+        points, _ = process_point_cloud(str(inputs["laz"]), stream=True)
+        np.save(inputs["points"], points)
+    return {name: str(path) for name, path in inputs.items()}
+
+
+# --- Stages ---
+#
+# Each stage takes the inputs dict and returns a closure; only the closure
+# is timed. The closure returns the number of items it produced.
+
+def _stage_point_cloud(inputs, stream=False):
+    from point_cloud_processor import process_point_cloud
+    return lambda: len(process_point_cloud(inputs["laz"], stream=stream)[0])
+
+
+def _stage_geotiff(inputs, band_set):
+    from texture_processor import process_geotiff
+    output = str(Path(inputs[band_set]).with_suffix(".png"))
+
+    def run():
+        process_geotiff(inputs[band_set], output)
+        with rasterio.open(output) as dataset:
+            return dataset.width * dataset.height
+    return run
+
+
+def _stage_align(inputs):
+    from coordinate_transformer import align_coordinates
+    points = np.load(inputs["points"])
+    source, target = CRS.from_epsg(SOURCE_EPSG), CRS.from_epsg(TARGET_EPSG)
+    return lambda: len(align_coordinates(points, source, target))
+
+
+def _stage_poisson(inputs):
+    from mesh_generator import generate_mesh_from_points
+    points = np.load(inputs["points"])
+    return lambda: len(generate_mesh_from_points(points).triangles)
+
+
+def _stage_normals(inputs):
+    from normals import terrain_normals
+    points = np.load(inputs["points"])
+    return lambda: len(terrain_normals(points))
+
+
+def _stage_save_mesh(inputs):
+    from grid_mesher import generate_grid_mesh
+    from mesh_generator import save_intermediate_mesh
+    mesh = generate_grid_mesh(np.load(inputs["points"]))
+    output = str(Path(inputs["points"]).with_name("mesh.bin"))
+
+    def run():
+        save_intermediate_mesh(mesh, output)
+        return len(mesh.triangles)
+    return run
+
+
+def _stage_reference(inputs):
+    """A fixed workload independent of the inputs, timed to scale baselines between machines."""
+    def run():
+        rng = np.random.default_rng(0)
+        values = rng.random(2_000_000)
+        np.sort(values)
+        matrix = rng.random((400, 400))
+        for _ in range(5):
+            matrix = np.tanh(matrix @ matrix / 400)
+        return len(np.unique(np.round(values, 4)))
+    return run
+
+
+STAGES = {
+    "process_point_cloud": _stage_point_cloud,
+    "process_point_cloud_stream": lambda inputs: _stage_point_cloud(inputs, stream=True),
+    "process_geotiff_rgb8": lambda inputs: _stage_geotiff(inputs, "rgb8"),
+    "process_geotiff_gray16": lambda inputs: _stage_geotiff(inputs, "gray16"),
+    "align_coordinates": _stage_align,
+    "terrain_normals": _stage_normals,
+    "generate_mesh_from_points": _stage_poisson,
+    "save_intermediate_mesh": _stage_save_mesh,
+}
+
+
+def _measure(stage, inputs):
+    """
+    Process-pool entry point: sets a stage up and times one run of it.
+    rss_growth_mb is how far the stage pushed peak RSS past the setup's.
+    """
+    run = _stage_reference(inputs) if stage == REFERENCE_KEY else STAGES[stage](inputs)
+    rss_before = peak_rss_mb()
+    wall, cpu = time.perf_counter(), cpu_seconds()
+    items = run()
+    return {"seconds": time.perf_counter() - wall, "cpu_s": cpu_seconds() - cpu,
+            "peak_rss_mb": peak_rss_mb(), "rss_growth_mb": peak_rss_mb() - rss_before,
+            "items": items}
+
+
+def measure(stage, inputs, repeat):
+    """Best of `repeat` runs, each in a fresh process so peak RSS is the stage's own."""
+    best = None
+    context = multiprocessing.get_context("spawn")
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(_measure, stage, inputs).result()
+        if best is None or result["seconds"] < best["seconds"]:
+            best = result
+    return best
+
+
+# --- Blender tier ---
+
+def measure_blender(blender_path, inputs, texture_mode):
+    """Runs blender_processor.py on the size's mesh and texture and returns its step metrics."""
+    work_dir = Path(inputs["points"]).parent
+    with rasterio.open(inputs["rgb8"]) as dataset:
+        bounds = dataset.bounds
+    command = [
+        blender_path, "--background", "--enable-autoexec",
+        "--python", str(Path(__file__).with_name("blender_processor.py").resolve()), "--",
+        "--mesh", str(work_dir / "mesh.bin"),
+        "--texture", str(work_dir / "rgb8.png"),
+        "--baked-texture", str(work_dir / "baked.png"),
+        "--fbx", str(work_dir / f"{texture_mode}.fbx"),
+        "--bounds", *map(str, bounds),
+        "--texture-mode", texture_mode,
+    ]
+    start = time.perf_counter()
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(f"Blender failed (exit {result.returncode}):\n{result.stdout[-2000:]}")
+    steps = {}
+    for line in result.stdout.splitlines():
+        if line.startswith(METRICS_PREFIX):
+            for record in json.loads(line[len(METRICS_PREFIX):])["stages"]:
+                steps[record["stage"]] = record
+    return elapsed, steps
+
+
+# --- Reporting ---
+
+def scaling_exponent(sizes, seconds):
+    """Slope of log(time) against log(points): 1.0 is linear scaling."""
+    if len(sizes) < 2 or min(seconds) <= 0:
+        return float("nan")
+    return float(np.polyfit(np.log(sizes), np.log(seconds), 1)[0])
+
+
+def print_curves(results, sizes):
+    print("\n--- SCALING (seconds / memory growth in MiB by input points) ---")
+    print(f"{'stage':<30}" + "".join(f"{n:>20,}" for n in sizes) + f"{'exponent':>10}")
+    for stage, by_size in results.items():
+        if stage == REFERENCE_KEY:
+            continue
+        cells = []
+        for n in sizes:
+            r = by_size.get(str(n))
+            cells.append(f"{r['seconds']:>9.3f}s {r['rss_growth_mb']:>7.0f}M" if r else f"{'-':>20}")
+        measured = [n for n in sizes if str(n) in by_size]
+        exponent = scaling_exponent(measured, [by_size[str(n)]["seconds"] for n in measured])
+        print(f"{stage:<30}" + "".join(f"{c:>20}" for c in cells) + f"{exponent:>10.2f}")
+
+
+def machine_scale(results, baseline):
+    """
+    How much slower this machine is than the baseline's: the ratio of the
+    two runs' reference workload times. Raises ValueError when either run
+    has no reference timing.
+    """
+    if REFERENCE_KEY not in results or REFERENCE_KEY not in baseline:
+        raise ValueError("Relative comparison needs the reference workload in both runs; "
+                         "save the baseline again with this version.")
+    return results[REFERENCE_KEY]["seconds"] / baseline[REFERENCE_KEY]["seconds"]
+
+
+def check_regressions(results, baseline, tolerance, relative=False):
+    """
+    Returns a description of every stage/size that is slower than baseline
+    by more than tolerance. With relative, the baseline's times are first
+    scaled by machine_scale, so only slowdowns beyond the machines'
+    difference count. Memory growth is compared as is.
+    """
+    scale = machine_scale(results, baseline) if relative else 1.0
+    regressions = []
+    for stage, by_size in results.items():
+        if stage == REFERENCE_KEY:
+            continue
+        for size, result in by_size.items():
+            reference = baseline.get(stage, {}).get(size)
+            if not reference:
+                continue
+            expected = reference["seconds"] * scale
+            if result["seconds"] > expected * (1 + tolerance) and result["seconds"] - expected > MIN_REGRESSION_S:
+                scaled = f" ({reference['seconds']:.3f}s x {scale:.2f} machine scale)" if relative else ""
+                regressions.append(f"{stage} @ {int(size):,} points: {result['seconds']:.3f}s "
+                                   f"vs baseline {expected:.3f}s{scaled}")
+            growth, reference_growth = result["rss_growth_mb"], reference["rss_growth_mb"]
+            if growth > reference_growth * (1 + tolerance) and growth - reference_growth > MIN_REGRESSION_MB:
+                regressions.append(f"{stage} @ {int(size):,} points: +{growth:.0f} MiB "
+                                   f"vs baseline +{reference_growth:.0f} MiB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline stages on synthetic data.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                        help="Raw point counts of the synthetic LAZ files.")
+    parser.add_argument("--density", type=float, default=4.0, help="Synthetic points per m².")
+    parser.add_argument("--stages", nargs="+", choices=list(STAGES), default=list(STAGES))
+    parser.add_argument("--repeat", type=int, default=1, help="Runs per stage; the fastest is kept.")
+    parser.add_argument("--work-dir", type=str, default="./temp_geo_processing/benchmark")
+    parser.add_argument("--output", type=str, default=None, help="Write all results to this JSON file.")
+    parser.add_argument("--baseline", type=str, default=None,
+                        help="Fail if any stage is slower or larger than in this results file.")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed slowdown over the baseline as a fraction.")
+    parser.add_argument("--relative", action="store_true",
+                        help="Compare times as multiples of the reference workload, for baselines "
+                             "saved on another machine.")
+    parser.add_argument("--save-baseline", type=str, default=None,
+                        help="Store these results as the baseline for later runs.")
+    parser.add_argument("--blender-path", type=str, default="blender",
+                        help="Blender binary for the optional Blender tier.")
+    parser.add_argument("--no-blender", action="store_true", help="Skip the Blender tier.")
+    args = parser.parse_args()
+
+    sizes = sorted(args.sizes)
+    results = {stage: {} for stage in args.stages}
+    print("\n[bench] reference workload")
+    results[REFERENCE_KEY] = measure(REFERENCE_KEY, {}, args.repeat)
+    blender = None if args.no_blender else shutil.which(args.blender_path)
+    for n in sizes:
+        inputs = make_inputs(Path(args.work_dir) / f"{n}", n, args.density)
+        for stage in args.stages:
+            print(f"\n[bench] {stage} @ {n:,} points")
+            results[stage][str(n)] = measure(stage, inputs, args.repeat)
+
+        if blender:
+            if "save_intermediate_mesh" not in args.stages:
+                measure("save_intermediate_mesh", inputs, 1)
+            if "process_geotiff_rgb8" not in args.stages:
+                measure("process_geotiff_rgb8", inputs, 1)
+            for mode in ("direct", "bake"):
+                print(f"\n[bench] blender ({mode}) @ {n:,} points")
+                elapsed, steps = measure_blender(blender, inputs, mode)
+                results.setdefault(f"blender_{mode}", {})[str(n)] = {
+                    "seconds": elapsed,
+                    "peak_rss_mb": max((s.get("peak_rss_mb") or 0) for s in steps.values()),
+                    "rss_growth_mb": 0.0,  # Blender's own baseline is not comparable
+                    "steps": steps,
+                }
+    if not blender and not args.no_blender:
+        print(f"\nBlender not found ({args.blender_path}); skipping the Blender tier.")
+
+    print_curves(results, sizes)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.save_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = check_regressions(results, baseline, args.tolerance, args.relative)
+        if regressions:
+            print(f"\n--- {len(regressions)} REGRESSION(S) BEYOND {args.tolerance:.0%} ---")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions beyond {args.tolerance:.0%} of {args.baseline}.")
+
+
+if __name__ == "__main__":
+    main()
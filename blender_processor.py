@@ -13,10 +13,18 @@ sys.stdout.flush()
 #     bpy.data.objects.remove(ob)
 # print("Scene should now be empty")
 
-import bmesh
 from mathutils import Vector
 import os
 import argparse
+import json
+import time
+import traceback
+import numpy as np
+
+# Blender does not put the script's directory on sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from mesh_io import read_binary_mesh
+from profiling import StageProfiler, METRICS_PREFIX, RESULT_PREFIX
 
 
 # -------------------------------------------------------------------
@@ -46,7 +54,85 @@ def load_obj_manually(obj_path, texture_path):
     obj = bpy.data.objects.new("ImportedMesh", mesh)
     bpy.context.collection.objects.link(obj)
 
-    # assign a simple material so bake_texture has something to work with
+    img = attach_texture_material(obj, texture_path)
+    return obj, img
+
+
+def load_binary_mesh(mesh_path, texture_path=None, name="ImportedMesh"):
+    """
+    Loads a mesh written by mesh_io.write_binary_mesh. The vertex and index
+    buffers are handed to Blender in bulk with foreach_set, so no Python
+    work is done per vertex or per face. Without texture_path no material
+    is attached and the returned image is None.
+    """
+    vertices, triangles = read_binary_mesh(mesh_path)
+    triangle_count = len(triangles) // 3
+
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(len(vertices) // 3)
+    mesh.vertices.foreach_set("co", vertices)
+    mesh.loops.add(len(triangles))
+    mesh.loops.foreach_set("vertex_index", triangles.astype(np.int32))
+    mesh.polygons.add(triangle_count)
+    mesh.polygons.foreach_set("loop_start", np.arange(0, len(triangles), 3, dtype=np.int32))
+    # loop_total is derived from loop_start (and read-only) since Blender 4.0
+    if not mesh.polygons.bl_rna.properties["loop_total"].is_readonly:
+        mesh.polygons.foreach_set("loop_total", np.full(triangle_count, 3, dtype=np.int32))
+    mesh.update(calc_edges=True)
+    obj = bpy.data.objects.new(name, mesh)
+    bpy.context.collection.objects.link(obj)
+    print(f" Loaded {len(mesh.vertices)} vertices, {len(mesh.polygons)} triangles from {mesh_path}")
+    sys.stdout.flush()
+
+    img = attach_texture_material(obj, texture_path) if texture_path else None
+    return obj, img
+
+
+def load_lod_chain(mesh_paths, texture_path, name="ImportedMesh"):
+    """
+    Loads LOD0..LODn and parents them under an empty that the FBX exporter
+    writes as a LodGroup (via the fbx_type custom property), named the way
+    Unreal's importer expects. Only LOD0 gets a material of its own; the
+    other levels share it, so a bake on LOD0 textures every level.
+    Returns (group, [lod objects], img).
+    """
+    group = bpy.data.objects.new(name, None)
+    group["fbx_type"] = "LodGroup"
+    bpy.context.collection.objects.link(group)
+
+    lods = []
+    img = None
+    for level, mesh_path in enumerate(mesh_paths):
+        obj, level_img = load_binary_mesh(mesh_path, texture_path if level == 0 else None,
+                                          name=f"{name}_LOD{level}")
+        if level == 0:
+            img = level_img
+        elif lods[0].data.materials:
+            obj.data.materials.append(lods[0].data.materials[0])
+        obj.parent = group
+        lods.append(obj)
+    return group, lods, img
+
+
+def load_texture_tiles(tiles_path):
+    """
+    Loads the texture tiles listed in a JSON file written by main.py: one
+    mesh per tile, each with its own material and texture and projected
+    against its own texture bounds. Returns the tile objects.
+    """
+    with open(tiles_path) as f:
+        tiles = json.load(f)
+    objects = []
+    for tile in tiles:
+        obj, _ = load_binary_mesh(tile["mesh"], tile["texture"], name=tile["name"])
+        obj.data.materials[0].name = f"TextureMat_{tile['name']}"
+        planar_projection(obj, tile["bounds"])
+        objects.append(obj)
+    return objects
+
+
+def attach_texture_material(obj, texture_path):
+    """Assigns a simple material so bake_texture has something to work with."""
     img = bpy.data.images.load(texture_path)
     mat = bpy.data.materials.new("TextureMat")
     mat.use_nodes = True
@@ -55,8 +141,35 @@ def load_obj_manually(obj_path, texture_path):
     tex_node.image = img
     mat.node_tree.links.new(bsdf.inputs["Base Color"], tex_node.outputs["Color"])
     obj.data.materials.append(mat)
+    return img
 
-    return obj, img
+
+def attach_vertex_colors(objects, color_paths):
+    """
+    Sets each object's colours from a .npy of (N, 3) uint8 per-vertex sRGB
+    colours, as a byte colour attribute filled with one foreach_set, and
+    gives them one shared material that shows the attribute.
+    """
+    mat = bpy.data.materials.new("VertexColorMat")
+    mat.use_nodes = True
+    bsdf = mat.node_tree.nodes["Principled BSDF"]
+    color_node = mat.node_tree.nodes.new("ShaderNodeVertexColor")
+    color_node.layer_name = "Col"
+    mat.node_tree.links.new(bsdf.inputs["Base Color"], color_node.outputs["Color"])
+
+    # color_srgb takes the values as stored; color expects linear ones
+    srgb = "color_srgb" in bpy.types.ByteColorAttributeValue.bl_rna.properties
+    for obj, color_path in zip(objects, color_paths):
+        colors = np.load(color_path)
+        rgba = np.ones((len(colors), 4), dtype=np.float32)
+        rgba[:, :3] = colors / 255.0
+        if not srgb:
+            rgba[:, :3] = np.where(rgba[:, :3] <= 0.04045, rgba[:, :3] / 12.92,
+                                   ((rgba[:, :3] + 0.055) / 1.055) ** 2.4)
+        attribute = obj.data.color_attributes.new("Col", 'BYTE_COLOR', 'POINT')
+        attribute.data.foreach_set("color_srgb" if srgb else "color", rgba.ravel())
+        obj.data.materials.append(mat)
+        print(f" Set {len(colors)} vertex colours on {obj.name}")
 
 # -------------------------------------------------------------------
 
@@ -85,11 +198,31 @@ def load_obj_manually(obj_path, texture_path):
 
 
 
+def _world_xy(matrix_world, co):
+    """
+    Applies obj.matrix_world to float32 (N, 3) local coordinates and returns
+    world X and Y. Mirrors mathutils' Matrix @ Vector arithmetic exactly:
+    float32 products summed in double and rounded back to float32.
+    """
+    m = np.array(matrix_world, dtype=np.float32)
+    columns = (co[:, 0], co[:, 1], co[:, 2], np.float32(1.0))
+    result = []
+    for row in (0, 1):
+        dot = np.zeros(len(co), dtype=np.float64)
+        for col in range(4):
+            dot += (m[row, col] * columns[col]).astype(np.float64)
+        result.append(dot.astype(np.float32))
+    return result
+
+
 def planar_projection(obj, bounds):
     """
     Creates a new UV layer on obj.data and assigns UVs by
     linearly mapping the world-XY position of each vertex
     into the [0..1] range given the raster bounds.
+
+    Coordinates and loop indices are pulled with foreach_get and all UVs
+    are written with a single foreach_set; there is no per-loop Python work.
     """
     min_x, min_y, max_x, max_y = bounds
     span_x = max_x - min_x
@@ -101,25 +234,47 @@ def planar_projection(obj, bounds):
         mesh.uv_layers.new(name="UVMap")
     uv_layer = mesh.uv_layers.active.data
 
-    # Build a bmesh so we can access loops easily
-    bm = bmesh.new()
-    bm.from_mesh(mesh)
-
-    obj_matrix = obj.matrix_world
-    for face in bm.faces:
-        for loop in face.loops:
-            world_co = obj_matrix @ loop.vert.co
-            u = (world_co.x - min_x) / span_x
-            v = (world_co.y - min_y) / span_y
-            uv_layer[loop.index].uv = Vector((u, 1.0 - v))
-
-    bm.to_mesh(mesh)
-    bm.free()
+    co = np.empty(len(mesh.vertices) * 3, dtype=np.float32)
+    mesh.vertices.foreach_get("co", co)
+    loop_verts = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_verts)
+
+    # UVs only depend on the vertex, so project once per vertex and gather per loop.
+    # u and v are computed in double like the Python arithmetic they replace.
+    world_x, world_y = _world_xy(obj.matrix_world, co.reshape(-1, 3))
+    vert_uv = np.empty((len(mesh.vertices), 2), dtype=np.float32)
+    vert_uv[:, 0] = (world_x.astype(np.float64) - min_x) / span_x
+    vert_uv[:, 1] = 1.0 - (world_y.astype(np.float64) - min_y) / span_y
+    uv_layer.foreach_set("uv", vert_uv[loop_verts].ravel())
+    mesh.update()
 
     print(" Planar UV projection complete.")
     sys.stdout.flush()
 
 
+def planar_projection_reference(obj, bounds):
+    """
+    Per-loop Python implementation of planar_projection, kept to validate
+    and time the vectorized version (see benchmark_uv_projection.py).
+    """
+    min_x, min_y, max_x, max_y = bounds
+    span_x = max_x - min_x
+    span_y = max_y - min_y
+
+    mesh = obj.data
+    if not mesh.uv_layers:
+        mesh.uv_layers.new(name="UVMap")
+    uv_layer = mesh.uv_layers.active.data
+
+    obj_matrix = obj.matrix_world
+    vertices = mesh.vertices
+    for loop in mesh.loops:
+        world_co = obj_matrix @ vertices[loop.vertex_index].co
+        u = (world_co.x - min_x) / span_x
+        v = (world_co.y - min_y) / span_y
+        uv_layer[loop.index].uv = Vector((u, 1.0 - v))
+
+
 def bake_texture(obj, img, width, height, baked_texture_path):
 
     # Making sure only the terrian is selected ***********************************************************************************************************************************************************
@@ -228,7 +383,7 @@ def bake_texture(obj, img, width, height, baked_texture_path):
 
 
 
-def export_to_fbx(output_fbx_path):
+def export_to_fbx(output_fbx_path, object_types={'MESH'}):
     """Exports the current selection to an Unreal-ready FBX file."""
     print(f"Exporting to FBX: {output_fbx_path}")
     bpy.ops.export_scene.fbx(
@@ -241,7 +396,7 @@ def export_to_fbx(output_fbx_path):
         # Unreal Engine's coordinate system is -Y Forward, Z Up
         axis_forward='-Y',
         axis_up='Z',
-        object_types={'MESH'},
+        object_types=object_types,
         use_mesh_modifiers=True,
         path_mode='COPY',
         embed_textures=True
@@ -257,34 +412,83 @@ def parse_args():
         cli = sys.argv[1:]
 
     p = argparse.ArgumentParser(description="Texture + export FBX in Blender")
-    p.add_argument("--obj",           required=True, help="Path to the intermediate OBJ")
-    p.add_argument("--texture",       required=True, help="Path to the source texture PNG")
-    p.add_argument("--baked-texture", required=True, help="Where to save the baked PNG")
+    mesh_input = p.add_mutually_exclusive_group(required=True)
+    mesh_input.add_argument("--mesh",     nargs="+",
+                            help="Path to the intermediate binary mesh, or LOD0..LODn for a LOD group")
+    mesh_input.add_argument("--obj",      help="Path to an intermediate OBJ (debug)")
+    mesh_input.add_argument("--tiles",    help="JSON list of texture tiles (mesh, texture, bounds, name)")
+    p.add_argument("--colors",        nargs="+",
+                   help="Per-vertex colour .npy files, one per --mesh; exports vertex colours and no image")
+    p.add_argument("--texture",       help="Path to the source texture PNG")
+    p.add_argument("--baked-texture", help="Where to save the baked PNG (bake mode)")
     p.add_argument("--fbx",           required=True, help="Where to write the FBX")
-    p.add_argument("--bounds",        required=True, nargs=4, type=float,
+    p.add_argument("--bounds",        nargs=4, type=float,
                    metavar=("LEFT","BOTTOM","RIGHT","TOP"),
                    help="GeoTIFF bounds for UV projection")
-    return p.parse_args(cli)
-
-if __name__ == "__main__":
-    args = parse_args()
+    p.add_argument("--texture-mode",  choices=("bake", "direct"), default="bake",
+                   help="'direct' exports the texture as-is without a Cycles bake")
+    p.add_argument("--profile-dir",   help="Dump a cProfile .prof file per step here")
+    args = p.parse_args(cli)
+    if args.colors and (not args.mesh or len(args.colors) != len(args.mesh)):
+        p.error("--colors needs one file per --mesh")
+    if not args.tiles and not args.colors and (not args.texture or not args.bounds):
+        p.error("--texture and --bounds are required unless --tiles or --colors is given")
+    if args.tiles and args.texture_mode != "direct":
+        p.error("--tiles only supports --texture-mode direct")
+    if args.texture_mode == "bake" and not args.baked_texture:
+        p.error("--baked-texture is required in bake mode")
+    return args
+
+def process_job(args, profiler):
+    """
+    Imports one mesh, textures it and exports the FBX described by args,
+    recording each step on the StageProfiler.
+    """
+    if args.tiles:
+        process_tiles(args, profiler)
+        return
+    if args.colors:
+        process_vertex_colors(args, profiler)
+        return
 
     # 1) Import mesh + texture
     #obj, img = setup_scene(args.obj, args.texture)
-    print("1) Importing mesh via manual loader")
-    obj, img = load_obj_manually(args.obj, args.texture)
+    group, lods = None, []
+    with profiler.stage("blender.import") as record:
+        if args.mesh and len(args.mesh) > 1:
+            print(f"1) Importing {len(args.mesh)} LOD levels")
+            group, lods, img = load_lod_chain(args.mesh, args.texture)
+            obj = lods[0]
+            record["lod_triangles"] = [len(lod.data.polygons) for lod in lods]
+        elif args.mesh:
+            print("1) Importing binary mesh")
+            obj, img = load_binary_mesh(args.mesh[0], args.texture)
+        else:
+            print("1) Importing mesh via manual loader")
+            obj, img = load_obj_manually(args.obj, args.texture)
+        record.update(vertices=len(obj.data.vertices), triangles=len(obj.data.polygons),
+                      texture_pixels=img.size[0] * img.size[1])
 
     # 2) Planar UV projection
     print("2) Projecting UVs")
-    planar_projection(obj, args.bounds)
-
-    # 3) Bake into a new image, using the same resolution as the source:
-    max_res = 4096
-    w, h = img.size  # Blender image: .size → (width, height)
-    width = min(w, max_res)
-    height = min(h, max_res)
-    print(f"3) Baking to {args.baked_texture} at {width}×{height}")
-    bake_texture(obj, img, width, height, args.baked_texture)
+    # Every LOD level is projected against the same bounds: one shared UV layout
+    with profiler.stage("blender.uv_projection", loops=sum(len(o.data.loops) for o in lods or [obj])):
+        for lod in lods or [obj]:
+            planar_projection(lod, args.bounds)
+
+    if args.texture_mode == "direct":
+        # The texture was already cropped to the mesh footprint and is wired
+        # into the material, so there is nothing to bake
+        print("3) Direct texture mode: skipping bake")
+    else:
+        # 3) Bake into a new image, using the same resolution as the source:
+        max_res = 4096
+        w, h = img.size  # Blender image: .size → (width, height)
+        width = min(w, max_res)
+        height = min(h, max_res)
+        print(f"3) Baking to {args.baked_texture} at {width}×{height}")
+        with profiler.stage("blender.bake", pixels=width * height):
+            bake_texture(obj, img, width, height, args.baked_texture)
 
     #selecting only terrain for export
     # bpy.ops.object.select_all(action='DESELECT')
@@ -296,9 +500,122 @@ if __name__ == "__main__":
 
     obj.select_set(True)
     bpy.context.view_layer.objects.active = obj
+    if group:
+        group.select_set(True)
+        for lod in lods:
+            lod.select_set(True)
     print(f"Selected '{obj.name}' for baking/export")
     sys.stdout.flush()
 
     # 4) Export to FBX
     print(f"4) Exporting to FBX: {args.fbx}")
-    export_to_fbx(args.fbx)
\ No newline at end of file
+    with profiler.stage("blender.export") as record:
+        export_to_fbx(args.fbx, {'MESH', 'EMPTY'} if group else {'MESH'})
+        record["output_bytes"] = os.path.getsize(args.fbx)
+
+
+def process_tiles(args, profiler):
+    """Imports the texture tiles of a --tiles job and exports them together."""
+    with profiler.stage("blender.import") as record:
+        print("1) Importing texture tiles")
+        objects = load_texture_tiles(args.tiles)
+        record.update(tiles=len(objects), vertices=sum(len(o.data.vertices) for o in objects),
+                      triangles=sum(len(o.data.polygons) for o in objects))
+    print("2-3) Tiles are projected on import and use their textures directly")
+
+    for o in bpy.context.view_layer.objects:
+        o.select_set(False)
+    for obj in objects:
+        obj.select_set(True)
+    bpy.context.view_layer.objects.active = objects[0]
+
+    print(f"4) Exporting to FBX: {args.fbx}")
+    with profiler.stage("blender.export") as record:
+        export_to_fbx(args.fbx)
+        record["output_bytes"] = os.path.getsize(args.fbx)
+
+
+def process_vertex_colors(args, profiler):
+    """Imports the mesh or LOD chain of a --colors job, sets its vertex colours and exports it without images."""
+    group = None
+    with profiler.stage("blender.import") as record:
+        if len(args.mesh) > 1:
+            print(f"1) Importing {len(args.mesh)} LOD levels")
+            group, objects, _ = load_lod_chain(args.mesh, None)
+        else:
+            print("1) Importing binary mesh")
+            objects = [load_binary_mesh(args.mesh[0])[0]]
+        record.update(vertices=len(objects[0].data.vertices), triangles=len(objects[0].data.polygons))
+
+    print("2-3) Vertex colour mode: no UVs, no bake")
+    with profiler.stage("blender.vertex_colors", vertices=sum(len(o.data.vertices) for o in objects)):
+        attach_vertex_colors(objects, args.colors)
+
+    for o in bpy.context.view_layer.objects:
+        o.select_set(False)
+    for obj in objects:
+        obj.select_set(True)
+    if group:
+        group.select_set(True)
+    bpy.context.view_layer.objects.active = objects[0]
+
+    print(f"4) Exporting to FBX: {args.fbx}")
+    with profiler.stage("blender.export") as record:
+        export_to_fbx(args.fbx, {'MESH', 'EMPTY'} if group else {'MESH'})
+        record["output_bytes"] = os.path.getsize(args.fbx)
+
+
+# Job fields that may be omitted in --serve mode
+JOB_DEFAULTS = {"mesh": None, "obj": None, "tiles": None, "texture": None, "bounds": None,
+                "baked_texture": None, "texture_mode": "bake", "colors": None, "profile_dir": None}
+
+
+def reset_scene():
+    """Removes every object and data block so the next job starts from an empty scene."""
+    for collection in (bpy.data.objects, bpy.data.meshes, bpy.data.materials,
+                       bpy.data.images, bpy.data.textures):
+        for block in list(collection):
+            collection.remove(block)
+
+
+def serve():
+    """
+    Job loop for a long-lived worker: reads one JSON job per line on stdin
+    (the same fields as the command-line flags), resets the scene, runs it
+    and writes a RESULT_PREFIX line with the outcome and the job's stage
+    metrics. A failing job is reported and the loop carries on with the next one.
+    """
+    print("Blender worker ready")
+    sys.stdout.flush()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        start = time.perf_counter()
+        result = {}
+        try:
+            job = json.loads(line)
+            result["id"] = job.get("id")
+            reset_scene()
+            profiler = StageProfiler(job.get("profile_dir"))
+            result["metrics"] = profiler.stages
+            process_job(argparse.Namespace(**{**JOB_DEFAULTS, **job}), profiler)
+            result["ok"] = True
+        except Exception as e:
+            result["ok"] = False
+            result["error"] = f"{type(e).__name__}: {e}"
+            result["traceback"] = traceback.format_exc()
+        result["seconds"] = time.perf_counter() - start
+        sys.stdout.write(RESULT_PREFIX + json.dumps(result) + "\n")
+        sys.stdout.flush()
+
+
+if __name__ == "__main__":
+    if "--serve" in sys.argv:
+        serve()
+    else:
+        args = parse_args()
+        profiler = StageProfiler(args.profile_dir)
+        process_job(args, profiler)
+        # Structured metrics for main.py, which otherwise only sees the log
+        print(METRICS_PREFIX + json.dumps(profiler.to_dict()))
+        sys.stdout.flush()
@@ -3,9 +3,43 @@
 from pyproj import CRS, Transformer
 import numpy as np
 
-def align_coordinates(points, source_crs, target_crs):
+# Local origins are rounded to a multiple of this many CRS units so they stay readable
+ORIGIN_ROUNDING = 100.0
+
+# Points transformed per block when aligning
+ALIGN_CHUNK_SIZE = 1_000_000
+
+
+def local_origin(bounds):
+    """
+    Picks a local origin for (min_x, min_y, max_x, max_y) bounds: the centre,
+    rounded to ORIGIN_ROUNDING. Z stays absolute, so the origin's Z is 0.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    return (round((min_x + max_x) / 2 / ORIGIN_ROUNDING) * ORIGIN_ROUNDING,
+            round((min_y + max_y) / 2 / ORIGIN_ROUNDING) * ORIGIN_ROUNDING,
+            0.0)
+
+
+def transform_origin(origin, source_crs, target_crs):
+    """The local origin to use after transforming points from source_crs to target_crs."""
+    if source_crs == target_crs:
+        return origin
+    transformer = Transformer.from_crs(source_crs, target_crs, always_xy=True)
+    x, y, _ = transformer.transform(*origin)
+    return (round(x / ORIGIN_ROUNDING) * ORIGIN_ROUNDING,
+            round(y / ORIGIN_ROUNDING) * ORIGIN_ROUNDING,
+            0.0)
+
+
+def align_coordinates(points, source_crs, target_crs, origin=None, target_origin=None):
     """
     Transforms a NumPy array of points from a source CRS to a target CRS.
+
+    The array is overwritten in place and returned. With origin set, the points
+    are offsets from origin in the source CRS and come back as offsets from
+    target_origin (see transform_origin) in the target CRS; absolute
+    coordinates only ever exist for one block at a time, in float64.
     """
     if source_crs == target_crs:
         print("Source and target CRS are the same. No transformation needed.")
@@ -16,15 +50,23 @@ def align_coordinates(points, source_crs, target_crs):
     # Create a transformer for the conversion
     # always_xy=True helps avoid axis order confusion
     transformer = Transformer.from_crs(source_crs, target_crs, always_xy=True)
+    origin = np.asarray(origin if origin is not None else (0.0, 0.0, 0.0), dtype=np.float64)
+    target_origin = np.asarray(target_origin if target_origin is not None else (0.0, 0.0, 0.0),
+                               dtype=np.float64)
 
-    # Perform the transformation
-    # The transformer.transform method is highly optimized for NumPy arrays
-    transformed_x, transformed_y, transformed_z = transformer.transform(
-        points[:, 0], points[:, 1], points[:, 2]
-    )
-
-    # Reassemble the transformed points into an (N, 3) array
-    aligned_points = np.vstack((transformed_x, transformed_y, transformed_z)).transpose()
+    # Transform block by block through one preallocated float64 buffer; each
+    # row is a contiguous column that pyproj can transform in place
+    buffer = np.empty((3, min(ALIGN_CHUNK_SIZE, len(points))), dtype=np.float64)
+    for start in range(0, len(points), ALIGN_CHUNK_SIZE):
+        block = points[start:start + ALIGN_CHUNK_SIZE]
+        columns = buffer[:, :len(block)]
+        for axis in range(3):
+            columns[axis] = block[:, axis]
+            columns[axis] += origin[axis]
+        transformer.transform(columns[0], columns[1], columns[2], inplace=True)
+        for axis in range(3):
+            columns[axis] -= target_origin[axis]
+            block[:, axis] = columns[axis]
 
     print("Transformation complete.")
-    return aligned_points
\ No newline at end of file
+    return points
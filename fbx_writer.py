@@ -0,0 +1,424 @@
+# fbx_writer.py
+#
+# Minimal FBX 7.4 binary writer for a textured or vertex-coloured mesh, a LOD
+# group of meshes or a set of texture tiles with one material each,
+# so the pipeline can produce an Unreal-ready file without starting Blender. The scene matches
+# what export_to_fbx in blender_processor.py produces: -Y forward, Z up,
+# metre units and the texture embedded in the file.
+
+import datetime
+import itertools
+import os
+import struct
+import zlib
+
+import numpy as np
+
+FBX_VERSION = 7400
+
+_HEAD_MAGIC = b"Kaydara FBX Binary  \x00\x1a\x00"
+# Nested node lists end with a null record of this size (before FBX 7.5)
+_BLOCK_SENTINEL = b"\x00" * 13
+# FileId, CreationTime and the footer id are checksummed against each other by
+# the FBX SDK. These are the fixed values Blender's exporter writes.
+_FILE_ID = b"\x28\xb3\x2a\xeb\xb6\x24\xcc\xc2\xbf\xc8\xb0\x2a\xa9\x2b\xfc\xf1"
+_TIME_ID = "1970-01-01 10:00:00:000"
+_FOOT_ID = b"\xfa\xbc\xab\x09\xd0\xc8\xd4\x66\xb1\x76\xfb\x83\x1c\xf7\x26\x7e"
+_FOOT_MAGIC = b"\xf8\x5a\x8c\x6a\xde\xf5\xd9\x7e\xec\xe9\x0c\xe3\x75\x8f\x29\x0b"
+
+# Arrays smaller than this are stored uncompressed
+_COMPRESS_MIN_BYTES = 128
+
+# Array property type codes by NumPy dtype
+_ARRAY_TYPES = {
+    np.dtype(np.float64): b"d",
+    np.dtype(np.float32): b"f",
+    np.dtype(np.int64): b"l",
+    np.dtype(np.int32): b"i",
+    np.dtype(np.bool_): b"b",
+}
+
+CREATOR = "Lidar-To-FBX native writer"
+
+
+class _Node:
+    """One FBX node record: a name, a list of properties and child nodes."""
+
+    def __init__(self, name, *props):
+        self.name = name.encode("ascii")
+        self.props = list(props)
+        self.children = []
+
+    def add(self, name, *props):
+        child = _Node(name, *props)
+        self.children.append(child)
+        return child
+
+
+def _encode_property(value):
+    """
+    Encodes one property value. The FBX type follows the Python/NumPy type:
+    bool → C, int → I, float → D, str → S, bytes → R, np.int64 → L,
+    np.float32 → F, np.int16 → Y and ndarrays → typed (optionally zlib) arrays.
+    """
+    if isinstance(value, np.ndarray):
+        type_code = _ARRAY_TYPES[value.dtype]
+        data = np.ascontiguousarray(value, dtype=value.dtype.newbyteorder("<")).tobytes()
+        encoding = 0
+        if len(data) >= _COMPRESS_MIN_BYTES:
+            data = zlib.compress(data, 1)
+            encoding = 1
+        return type_code + struct.pack("<III", value.size, encoding, len(data)) + data
+    if isinstance(value, (bool, np.bool_)):
+        return b"C" + struct.pack("<?", bool(value))
+    if isinstance(value, np.int64):
+        return b"L" + struct.pack("<q", value)
+    if isinstance(value, np.int16):
+        return b"Y" + struct.pack("<h", value)
+    if isinstance(value, np.float32):
+        return b"F" + struct.pack("<f", value)
+    if isinstance(value, int):
+        return b"I" + struct.pack("<i", value)
+    if isinstance(value, float):
+        return b"D" + struct.pack("<d", value)
+    if isinstance(value, str):
+        data = value.encode("utf-8")
+        return b"S" + struct.pack("<I", len(data)) + data
+    if isinstance(value, bytes):
+        return b"R" + struct.pack("<I", len(value)) + value
+    raise TypeError(f"Cannot encode FBX property of type {type(value).__name__}")
+
+
+def _write_node(out, node):
+    """Appends a node record to the bytearray `out`; end offsets are absolute."""
+    start = len(out)
+    props = b"".join(_encode_property(p) for p in node.props)
+    # End offset is patched once the children are written
+    out += struct.pack("<IIIB", 0, len(node.props), len(props), len(node.name))
+    out += node.name
+    out += props
+    for child in node.children:
+        _write_node(out, child)
+    if node.children or not node.props:
+        out += _BLOCK_SENTINEL
+    struct.pack_into("<I", out, start, len(out))
+
+
+def _properties70(parent, *entries):
+    """Adds a Properties70 block; each entry is (name, type, label, flags, *values)."""
+    block = parent.add("Properties70")
+    for entry in entries:
+        block.add("P", *entry)
+    return block
+
+
+def _name_class(name, cls):
+    # FBX object names are stored as "name\x00\x01Class"
+    return f"{name}\x00\x01{cls}"
+
+
+def _header_extension(root):
+    now = datetime.datetime.now()
+    header = root.add("FBXHeaderExtension")
+    header.add("FBXHeaderVersion", 1003)
+    header.add("FBXVersion", FBX_VERSION)
+    header.add("EncryptionType", 0)
+    stamp = header.add("CreationTimeStamp")
+    stamp.add("Version", 1000)
+    for field, value in (("Year", now.year), ("Month", now.month), ("Day", now.day),
+                         ("Hour", now.hour), ("Minute", now.minute), ("Second", now.second),
+                         ("Millisecond", now.microsecond // 1000)):
+        stamp.add(field, value)
+    header.add("Creator", CREATOR)
+    scene_info = header.add("SceneInfo", _name_class("GlobalInfo", "SceneInfo"), "UserData")
+    scene_info.add("Type", "UserData")
+    scene_info.add("Version", 100)
+    meta = scene_info.add("MetaData")
+    meta.add("Version", 100)
+    for field in ("Title", "Subject", "Author", "Keywords", "Revision", "Comment"):
+        meta.add(field, "")
+    _properties70(scene_info)
+
+    root.add("FileId", _FILE_ID)
+    root.add("CreationTime", _TIME_ID)
+    root.add("Creator", CREATOR)
+
+
+def _global_settings(root):
+    settings = root.add("GlobalSettings")
+    settings.add("Version", 1000)
+    # Z up, -Y forward (front axis Y with odd parity), X right: Blender's and Unreal's system
+    _properties70(
+        settings,
+        ("UpAxis", "int", "Integer", "", 2),
+        ("UpAxisSign", "int", "Integer", "", 1),
+        ("FrontAxis", "int", "Integer", "", 1),
+        ("FrontAxisSign", "int", "Integer", "", -1),
+        ("CoordAxis", "int", "Integer", "", 0),
+        ("CoordAxisSign", "int", "Integer", "", 1),
+        ("OriginalUpAxis", "int", "Integer", "", 2),
+        ("OriginalUpAxisSign", "int", "Integer", "", 1),
+        # One unit is one metre (FBX unit scale is expressed in centimetres)
+        ("UnitScaleFactor", "double", "Number", "", 100.0),
+        ("OriginalUnitScaleFactor", "double", "Number", "", 100.0),
+        ("AmbientColor", "ColorRGB", "Color", "", 0.0, 0.0, 0.0),
+        ("DefaultCamera", "KString", "", "", "Producer Perspective"),
+        ("TimeMode", "enum", "", "", 11),
+        ("TimeSpanStart", "KTime", "Time", "", np.int64(0)),
+        ("TimeSpanStop", "KTime", "Time", "", np.int64(46186158000)),
+        ("CustomFrameRate", "double", "Number", "", 24.0),
+    )
+
+
+def _definitions(root, counts):
+    definitions = root.add("Definitions")
+    definitions.add("Version", 100)
+    definitions.add("Count", sum(counts.values()))
+    for object_type, count in counts.items():
+        definition = definitions.add("ObjectType", object_type)
+        definition.add("Count", count)
+
+
+def _geometry(objects, geometry_id, name, vertices, triangles, uvs, colors=None):
+    geometry = objects.add("Geometry", geometry_id, _name_class(name, "Geometry"), "Mesh")
+    _properties70(geometry)
+    geometry.add("GeometryVersion", 124)
+    geometry.add("Vertices", np.ascontiguousarray(vertices, dtype=np.float64))
+
+    # The last index of every polygon is stored as ~index (-index - 1)
+    polygon_vertex_index = np.array(triangles, dtype=np.int32)
+    polygon_vertex_index[:, 2] = ~polygon_vertex_index[:, 2]
+    geometry.add("PolygonVertexIndex", polygon_vertex_index)
+
+    layer_elements = []
+    if uvs is not None:
+        uv_layer = geometry.add("LayerElementUV", 0)
+        uv_layer.add("Version", 101)
+        uv_layer.add("Name", "UVMap")
+        uv_layer.add("MappingInformationType", "ByPolygonVertex")
+        uv_layer.add("ReferenceInformationType", "IndexToDirect")
+        # UVs are per vertex, so the polygon-vertex UV indices are the triangle indices
+        uv_layer.add("UV", np.ascontiguousarray(uvs, dtype=np.float64))
+        uv_layer.add("UVIndex", np.ascontiguousarray(triangles, dtype=np.int32))
+        layer_elements.append("LayerElementUV")
+
+    if colors is not None:
+        color_layer = geometry.add("LayerElementColor", 0)
+        color_layer.add("Version", 101)
+        color_layer.add("Name", "Col")
+        color_layer.add("MappingInformationType", "ByPolygonVertex")
+        color_layer.add("ReferenceInformationType", "IndexToDirect")
+        # RGBA doubles, one colour per vertex indexed like the UVs
+        rgba = np.ones((len(colors), 4), dtype=np.float64)
+        rgba[:, :3] = np.asarray(colors) / 255.0
+        color_layer.add("Colors", rgba)
+        color_layer.add("ColorIndex", np.ascontiguousarray(triangles, dtype=np.int32))
+        layer_elements.append("LayerElementColor")
+
+    material_layer = geometry.add("LayerElementMaterial", 0)
+    material_layer.add("Version", 101)
+    material_layer.add("Name", "")
+    material_layer.add("MappingInformationType", "AllSame")
+    material_layer.add("ReferenceInformationType", "IndexToDirect")
+    material_layer.add("Materials", np.zeros(1, dtype=np.int32))
+    layer_elements.append("LayerElementMaterial")
+
+    # Layer 0 ties the elements above together
+    layer = geometry.add("Layer", 0)
+    layer.add("Version", 100)
+    for element_type in layer_elements:
+        element = layer.add("LayerElement")
+        element.add("Type", element_type)
+        element.add("TypedIndex", 0)
+
+
+def write_fbx(output_fbx_path, vertices, triangles, uvs=None, texture_path=None, name="ImportedMesh",
+              colors=None):
+    """
+    Writes one mesh as an FBX 7.4 binary file.
+
+    vertices: (N, 3) float positions, triangles: (M, 3) vertex indices,
+    uvs: optional (N, 2) per-vertex UVs, texture_path: optional image that is
+    embedded in the file and wired into the material's diffuse colour, or a
+    (file_name, png_bytes) pair. colors: optional (N, 3) uint8 per-vertex
+    colours, written as the mesh's colour layer.
+    """
+    _write_scene(output_fbx_path, [(name, vertices, triangles, uvs, texture_path, colors)])
+
+
+def write_fbx_lods(output_fbx_path, levels, texture_path=None, name="ImportedMesh", colors=None):
+    """
+    Writes a LOD chain as an FBX LodGroup called name whose children are
+    name_LOD0 .. name_LODn, the naming Unreal's importer expects. levels is a
+    list of (vertices, triangles, uvs) from LOD0 down; all levels share one
+    material and texture. colors is an optional list with each level's
+    vertex colours.
+    """
+    colors = colors or [None] * len(levels)
+    meshes = [(f"{name}_LOD{i}", vertices, triangles, uvs, texture_path, level_colors)
+              for i, ((vertices, triangles, uvs), level_colors) in enumerate(zip(levels, colors))]
+    _write_scene(output_fbx_path, meshes, group_name=name)
+
+
+def write_fbx_tiles(output_fbx_path, tiles):
+    """
+    Writes texture tiles as separate meshes. tiles is a list of (name,
+    vertices, triangles, uvs, texture_path); every tile gets its own
+    material with its texture embedded.
+    """
+    _write_scene(output_fbx_path, [(*tile, None) for tile in tiles])
+
+
+def _material(objects, connections, next_id, material_id, name, texture_path):
+    """
+    Adds a material and, with texture_path, its embedded diffuse texture.
+    texture_path may also be a (file_name, png_bytes) pair for a texture
+    that only exists in memory.
+    """
+    material = objects.add("Material", material_id, _name_class(name, "Material"), "")
+    material.add("Version", 102)
+    material.add("ShadingModel", "Phong")
+    material.add("MultiLayer", 0)
+    _properties70(material, ("DiffuseColor", "Color", "", "A", 0.8, 0.8, 0.8))
+    if not texture_path:
+        return
+    texture_id, video_id = next(next_id), next(next_id)
+    if isinstance(texture_path, tuple):
+        file_name, content = texture_path
+        abs_path = file_name
+    else:
+        file_name = os.path.basename(texture_path)
+        abs_path = os.path.abspath(texture_path)
+        with open(texture_path, "rb") as f:
+            content = f.read()
+
+    texture = objects.add("Texture", texture_id, _name_class(file_name, "Texture"), "")
+    texture.add("Type", "TextureVideoClip")
+    texture.add("Version", 202)
+    texture.add("TextureName", _name_class(file_name, "Texture"))
+    _properties70(texture,
+                  ("UseMaterial", "bool", "", "", 1),
+                  ("UseMipMap", "bool", "", "", 0))
+    texture.add("Media", _name_class(file_name, "Video"))
+    texture.add("FileName", abs_path)
+    texture.add("RelativeFilename", file_name)
+    texture.add("ModelUVTranslation", 0.0, 0.0)
+    texture.add("ModelUVScaling", 1.0, 1.0)
+    texture.add("Texture_Alpha_Source", "None")
+    texture.add("Cropping", 0, 0, 0, 0)
+
+    video = objects.add("Video", video_id, _name_class(file_name, "Video"), "Clip")
+    video.add("Type", "Clip")
+    _properties70(video, ("Path", "KString", "XRefUrl", "", abs_path))
+    video.add("UseMipMap", 0)
+    video.add("Filename", abs_path)
+    video.add("RelativeFilename", file_name)
+    video.add("Content", content)
+
+    connections.add("C", "OP", texture_id, material_id, "DiffuseColor")
+    connections.add("C", "OO", video_id, texture_id)
+
+
+def _write_scene(output_fbx_path, meshes, group_name=None):
+    """
+    Writes (name, vertices, triangles, uvs, texture_path, colors) meshes,
+    optionally under a LodGroup. Meshes with the same texture_path share one
+    material.
+    """
+    meshes = [(name, np.asarray(vertices), np.asarray(triangles), uvs, texture_path, colors)
+              for name, vertices, triangles, uvs, texture_path, colors in meshes]
+    for name, vertices, triangles, _, _, _ in meshes:
+        print(f"Writing native FBX: {output_fbx_path} [{name}] "
+              f"({len(vertices)} vertices, {len(triangles)} triangles)")
+
+    # Object ids only need to be unique and non-zero (0 is the scene root)
+    next_id = (np.int64(i) for i in itertools.count(1000000))
+    document_id = next(next_id)
+    # One material per distinct texture, in first-use order
+    materials = {}
+    for _, _, _, _, texture_path, _ in meshes:
+        if texture_path not in materials:
+            materials[texture_path] = next(next_id)
+    textures = [path for path in materials if path]
+
+    root = _Node("")
+    _header_extension(root)
+    _global_settings(root)
+
+    documents = root.add("Documents")
+    documents.add("Count", 1)
+    document = documents.add("Document", document_id, "Scene", "Scene")
+    _properties70(document,
+                  ("SourceObject", "object", "", ""),
+                  ("ActiveAnimStackName", "KString", "", "", ""))
+    document.add("RootNode", np.int64(0))
+    root.add("References")
+
+    counts = {"GlobalSettings": 1, "Model": len(meshes) + bool(group_name),
+              "Geometry": len(meshes), "Material": len(materials)}
+    if group_name:
+        counts["NodeAttribute"] = 1
+    if textures:
+        counts.update({"Texture": len(textures), "Video": len(textures)})
+    _definitions(root, counts)
+
+    objects = root.add("Objects")
+    connections = root.add("Connections")
+
+    parent_id = np.int64(0)
+    if group_name:
+        # An empty model carrying a LodGroup attribute; its children are the levels
+        group_id, attribute_id = next(next_id), next(next_id)
+        attribute = objects.add("NodeAttribute", attribute_id,
+                                _name_class(group_name, "NodeAttribute"), "LodGroup")
+        _properties70(attribute)
+        attribute.add("TypeFlags", "LodGroup")
+        group = objects.add("Model", group_id, _name_class(group_name, "Model"), "LodGroup")
+        group.add("Version", 232)
+        _properties70(group)
+        group.add("Shading", True)
+        group.add("Culling", "CullingOff")
+        connections.add("C", "OO", group_id, parent_id)
+        connections.add("C", "OO", attribute_id, group_id)
+        parent_id = group_id
+
+    for name, vertices, triangles, uvs, texture_path, colors in meshes:
+        model_id, geometry_id = next(next_id), next(next_id)
+        _geometry(objects, geometry_id, name, vertices, triangles, uvs, colors)
+
+        model = objects.add("Model", model_id, _name_class(name, "Model"), "Mesh")
+        model.add("Version", 232)
+        _properties70(model, ("DefaultAttributeIndex", "int", "Integer", "", 0))
+        model.add("Shading", True)
+        model.add("Culling", "CullingOff")
+
+        connections.add("C", "OO", model_id, parent_id)
+        connections.add("C", "OO", geometry_id, model_id)
+        connections.add("C", "OO", materials[texture_path], model_id)
+
+    for index, (texture_path, material_id) in enumerate(materials.items()):
+        _material(objects, connections, next_id, material_id,
+                  "TextureMat" if len(materials) == 1 else f"TextureMat{index}", texture_path)
+
+    takes = root.add("Takes")
+    takes.add("Current", "")
+
+    out = bytearray(_HEAD_MAGIC)
+    out += struct.pack("<I", FBX_VERSION)
+    for node in root.children:
+        _write_node(out, node)
+    out += _BLOCK_SENTINEL
+
+    # Footer: id, padding to a 16-byte boundary (a full 16 if already aligned),
+    # version, 120 zero bytes and a fixed magic
+    out += _FOOT_ID
+    out += b"\x00" * 4
+    pad = ((len(out) + 15) & ~15) - len(out)
+    out += b"\x00" * (pad or 16)
+    out += struct.pack("<I", FBX_VERSION)
+    out += b"\x00" * 120
+    out += _FOOT_MAGIC
+
+    with open(output_fbx_path, "wb") as f:
+        f.write(out)
+    print("FBX export complete.")
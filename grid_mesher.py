@@ -0,0 +1,360 @@
+# grid_mesher.py
+#
+# 2.5D heightfield meshing for airborne LiDAR terrain. Points are binned into a
+# regular XY grid, holes are filled by interpolation and the grid is emitted as
+# triangles, optionally simplified with an RTIN (right-triangulated irregular
+# network) to a triangle budget. Every step is vectorized and linear in the
+# number of points or grid cells.
+
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import open3d as o3d
+import numpy as np
+
+Z_MODES = ("min", "mean", "max")
+
+
+def estimate_cell_size(points):
+    """Returns a cell size of roughly twice the mean point spacing in XY."""
+    span_x = np.ptp(points[:, 0])
+    span_y = np.ptp(points[:, 1])
+    spacing = math.sqrt(max(span_x * span_y, 1e-12) / len(points))
+    return 2.0 * spacing
+
+
+def bin_points(points, cell_size, z_mode="mean"):
+    """
+    Bins points into a grid of cell_size cells. Returns (heights, origin)
+    where heights is a (rows, cols) array with NaN for empty cells and
+    origin is the XY of the grid's lower-left corner.
+    """
+    if z_mode not in Z_MODES:
+        raise ValueError(f"Unknown z_mode {z_mode!r}, expected one of {Z_MODES}")
+
+    min_x, min_y = points[:, 0].min(), points[:, 1].min()
+    cols = int(np.ptp(points[:, 0]) // cell_size) + 1
+    rows = int(np.ptp(points[:, 1]) // cell_size) + 1
+    ix = ((points[:, 0] - min_x) / cell_size).astype(np.int64)
+    iy = ((points[:, 1] - min_y) / cell_size).astype(np.int64)
+    np.minimum(ix, cols - 1, out=ix)
+    np.minimum(iy, rows - 1, out=iy)
+    flat = iy * cols + ix
+
+    counts = np.bincount(flat, minlength=rows * cols)
+    if z_mode == "mean":
+        heights = np.bincount(flat, weights=points[:, 2], minlength=rows * cols)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            heights /= counts
+    elif z_mode == "min":
+        heights = np.full(rows * cols, np.inf)
+        np.minimum.at(heights, flat, points[:, 2])
+    else:
+        heights = np.full(rows * cols, -np.inf)
+        np.maximum.at(heights, flat, points[:, 2])
+    heights[counts == 0] = np.nan
+
+    print(f"Binned {len(points)} points into a {cols}x{rows} grid "
+          f"({np.count_nonzero(counts == 0)} empty cells)")
+    return heights.reshape(rows, cols), (min_x, min_y)
+
+
+def fill_holes(heights):
+    """
+    Fills NaN cells in place by repeatedly averaging their valid 4-neighbours,
+    growing inwards from the hole borders until no empty cell is left.
+    """
+    missing = np.isnan(heights)
+    if missing.all():
+        raise ValueError("Height grid has no valid cells to interpolate from.")
+
+    while missing.any():
+        padded = np.pad(heights, 1, constant_values=np.nan)
+        neighbours = np.stack((padded[:-2, 1:-1], padded[2:, 1:-1],
+                               padded[1:-1, :-2], padded[1:-1, 2:]))
+        valid = ~np.isnan(neighbours)
+        count = valid.sum(axis=0)
+        fillable = missing & (count > 0)
+        total = np.where(valid, neighbours, 0.0).sum(axis=0)
+        heights[fillable] = total[fillable] / count[fillable]
+        missing &= ~fillable
+    return heights
+
+
+def _grid_triangles(rows, cols):
+    """Two counter-clockwise triangles per grid cell, indexing row-major vertices."""
+    idx = np.arange(rows * cols, dtype=np.int32).reshape(rows, cols)
+    a, b = idx[:-1, :-1].ravel(), idx[:-1, 1:].ravel()
+    c, d = idx[1:, :-1].ravel(), idx[1:, 1:].ravel()
+    return np.concatenate((np.column_stack((a, b, d)), np.column_stack((a, d, c))))
+
+
+def _rtin_squares(width, height, square):
+    """
+    The (a, b, c) corner arrays of the triangles that split every square of
+    side square in a (width x height) cell grid along one diagonal, two per
+    square. Diagonals alternate in a checkerboard, the pattern every RTIN
+    level below the roots follows. a-b is the hypotenuse and c the
+    right-angle corner; all coordinates are (x, y) grid vertex indices.
+    """
+    gy, gx = np.mgrid[0:height:square, 0:width:square]
+    x, y = gx.ravel().astype(np.int32), gy.ravel().astype(np.int32)
+    rising = (x // square + y // square) % 2 == 0
+    lower_left, upper_right = np.column_stack((x, y)), np.column_stack((x + square, y + square))
+    lower_right, upper_left = np.column_stack((x + square, y)), np.column_stack((x, y + square))
+    a = np.where(rising[:, None], lower_left, lower_right)
+    b = np.where(rising[:, None], upper_right, upper_left)
+    c1 = np.where(rising[:, None], upper_left, lower_left)
+    c2 = np.where(rising[:, None], lower_right, upper_right)
+    return np.concatenate((a, a)), np.concatenate((b, b)), np.concatenate((c1, c2))
+
+
+def _rtin_levels(width, height, block):
+    """
+    Yields the (a, b, c) corner arrays of every internal RTIN triangle of a
+    (width x height) cell grid covered by square blocks of side block, level
+    by level from the finest up. Each level is built directly from its
+    square size, so only one level is held at a time.
+    """
+    square = 2
+    while square <= block:
+        # The four sides of every square are hypotenuses, right-angled at its centre
+        gy, gx = np.mgrid[0:height:square, 0:width:square]
+        x, y = gx.ravel().astype(np.int32), gy.ravel().astype(np.int32)
+        corners = [np.column_stack((x + dx, y + dy)) for dx, dy in
+                   ((0, 0), (square, 0), (square, square), (0, square))]
+        centre = np.column_stack((x + square // 2, y + square // 2))
+        yield (np.concatenate(corners), np.concatenate(corners[1:] + corners[:1]),
+               np.concatenate([centre] * 4))
+        # Their parents split the squares along the diagonals
+        yield _rtin_squares(width, height, square)
+        square *= 2
+
+
+def _rtin_errors(terrain, block):
+    """
+    Computes the RTIN error of every grid vertex: the largest height error
+    introduced by not splitting any triangle whose hypotenuse midpoint is
+    that vertex, propagated up from its children. Blocks share one error
+    map, so the triangles on either side of a block edge split alike.
+    """
+    rows, cols = terrain.shape
+    flat = terrain.ravel()
+    errors = np.zeros(rows * cols)
+    for level, (a, b, c) in enumerate(_rtin_levels(cols - 1, rows - 1, block)):
+        ai = a[:, 1] * cols + a[:, 0]
+        bi = b[:, 1] * cols + b[:, 0]
+        m = (a + b) // 2
+        mi = m[:, 1] * cols + m[:, 0]
+        error = np.abs((flat[ai] + flat[bi]) / 2 - flat[mi])
+        if level > 0:
+            # Children are internal triangles too: carry their errors up
+            left = (a + c) // 2
+            right = (b + c) // 2
+            error = np.maximum(error, np.maximum(errors[left[:, 1] * cols + left[:, 0]],
+                                                 errors[right[:, 1] * cols + right[:, 0]]))
+        np.maximum.at(errors, mi, error)
+    return errors
+
+
+def _rtin_extract(errors, shape, block, max_error, count_only=False):
+    """
+    Walks the RTIN from the roots of every block, splitting every triangle
+    whose hypotenuse midpoint error exceeds max_error. Returns the triangle
+    count, or the (a, b, c) corner arrays of the emitted triangles.
+    """
+    rows, cols = shape
+    a, b, c = _rtin_squares(cols - 1, rows - 1, block)
+    emitted = []
+    count = 0
+    while len(a):
+        m = (a + b) // 2
+        internal = ((a + b) % 2 == 0).all(axis=1)
+        split = internal & (errors[m[:, 1] * cols + m[:, 0]] > max_error)
+        keep = ~split
+        count += np.count_nonzero(keep)
+        if not count_only:
+            emitted.append((a[keep], b[keep], c[keep]))
+        a, b, c, m = a[split], b[split], c[split], m[split]
+        a, b, c = np.concatenate((c, b)), np.concatenate((a, c)), np.concatenate((m, m))
+    if count_only:
+        return count
+    return tuple(np.concatenate(parts) for parts in zip(*emitted))
+
+
+def _rtin_terrain(heights):
+    """
+    Bilinearly resamples the height grid for the RTIN: a row or column of
+    square blocks of 2^k cells, sharing their edge vertices, with 2^k the
+    first power of two that spans the grid's short side. Returns (terrain,
+    block).
+    """
+    rows, cols = heights.shape
+    block = 2 ** math.ceil(math.log2(max(min(rows, cols), 3) - 1))
+    size_y = math.ceil((rows - 1) / block) * block + 1
+    size_x = math.ceil((cols - 1) / block) * block + 1
+
+    # Cells may become non-square
+    ys = np.linspace(0, rows - 1, size_y)
+    xs = np.linspace(0, cols - 1, size_x)
+    y0 = np.minimum(ys.astype(np.int64), rows - 2) if rows > 1 else np.zeros(size_y, np.int64)
+    x0 = np.minimum(xs.astype(np.int64), cols - 2) if cols > 1 else np.zeros(size_x, np.int64)
+    fy = (ys - y0)[:, None]
+    fx = (xs - x0)[None, :]
+    y1 = np.minimum(y0 + 1, rows - 1)
+    x1 = np.minimum(x0 + 1, cols - 1)
+    terrain = ((heights[y0][:, x0] * (1 - fx) + heights[y0][:, x1] * fx) * (1 - fy) +
+               (heights[y1][:, x0] * (1 - fx) + heights[y1][:, x1] * fx) * fy)
+    return terrain, block
+
+
+def _rtin_level(errors, shape, block, target_triangles):
+    """
+    Extracts the RTIN with the smallest error threshold that stays within
+    target_triangles. Returns ((vx, vy), triangles) in resampled-grid units.
+    """
+    # Triangle count falls monotonically with the threshold: binary search
+    # the sorted vertex errors for the smallest one that fits the budget
+    candidates = np.unique(errors)
+    lo, hi = 0, len(candidates) - 1
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if _rtin_extract(errors, shape, block, candidates[mid], count_only=True) <= target_triangles:
+            hi = mid
+        else:
+            lo = mid + 1
+    max_error = candidates[lo]
+    a, b, c = _rtin_extract(errors, shape, block, max_error)
+    print(f"RTIN simplification: {len(a)} triangles at max error {max_error:.3f}")
+
+    # Index only the grid vertices that are actually used
+    corners = np.stack((a, b, c), axis=1).reshape(-1, 2)
+    flat = corners[:, 1].astype(np.int64) * shape[1] + corners[:, 0]
+    used, triangles = np.unique(flat, return_inverse=True)
+    triangles = triangles.reshape(-1, 3).astype(np.int32)
+
+    # RTIN winding alternates between levels; make every triangle face +Z
+    vy, vx = np.divmod(used, shape[1])
+    p = np.column_stack((vx, vy)).astype(np.float64)[triangles]
+    cross = ((p[:, 1, 0] - p[:, 0, 0]) * (p[:, 2, 1] - p[:, 0, 1]) -
+             (p[:, 1, 1] - p[:, 0, 1]) * (p[:, 2, 0] - p[:, 0, 0]))
+    triangles[cross < 0] = triangles[cross < 0][:, ::-1]
+    return (vx, vy), triangles
+
+
+def simplify_rtin(heights, target_triangles):
+    """
+    Resamples the height grid onto a row or column of square (2^k + 1)
+    blocks and extracts the RTIN with the smallest error threshold that stays
+    within target_triangles. Returns (vertices_xy_index, triangles, terrain)
+    where vertex positions are in resampled-grid units.
+    """
+    terrain, block = _rtin_terrain(heights)
+    errors = _rtin_errors(terrain, block)
+    (vx, vy), triangles = _rtin_level(errors, terrain.shape, block, target_triangles)
+    return (vx, vy), triangles, terrain
+
+
+def simplify_rtin_levels(heights, budgets, workers=None):
+    """
+    Like simplify_rtin for several triangle budgets at once. The error map is
+    computed once and the levels are extracted in parallel threads. RTIN
+    levels are nested: a coarser level only merges triangles of a finer one.
+    Returns ([(vertices_xy_index, triangles), ...], terrain).
+    """
+    terrain, block = _rtin_terrain(heights)
+    errors = _rtin_errors(terrain, block)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        levels = list(pool.map(lambda budget: _rtin_level(errors, terrain.shape, block, budget), budgets))
+    return levels, terrain
+
+
+def _prepare_heights(points, cell_size, z_mode):
+    cell_size = cell_size or estimate_cell_size(points)
+    print(f"Grid meshing with {cell_size:.3f} m cells ({z_mode} Z)...")
+    heights, origin = bin_points(points, cell_size, z_mode)
+    fill_holes(heights)
+    return heights, origin, cell_size
+
+
+def _full_grid(heights, origin, cell_size):
+    """Vertices at every cell centre and two triangles per cell."""
+    rows, cols = heights.shape
+    gy, gx = np.mgrid[0:rows, 0:cols]
+    vertices = np.column_stack((origin[0] + (gx.ravel() + 0.5) * cell_size,
+                                origin[1] + (gy.ravel() + 0.5) * cell_size,
+                                heights.ravel()))
+    return vertices, _grid_triangles(rows, cols)
+
+
+def _rtin_vertices(vx, vy, terrain, heights, origin, cell_size):
+    """Maps resampled-grid vertex indices back onto the cell centres' extent."""
+    rows, cols = heights.shape
+    step_x = (cols - 1) * cell_size / (terrain.shape[1] - 1)
+    step_y = (rows - 1) * cell_size / (terrain.shape[0] - 1)
+    return np.column_stack((origin[0] + cell_size / 2 + vx * step_x,
+                            origin[1] + cell_size / 2 + vy * step_y,
+                            terrain[vy, vx]))
+
+
+def _to_mesh(vertices, triangles):
+    mesh = o3d.geometry.TriangleMesh()
+    mesh.vertices = o3d.utility.Vector3dVector(vertices)
+    mesh.triangles = o3d.utility.Vector3iVector(triangles)
+    return mesh
+
+
+def generate_grid_mesh(points, cell_size=None, z_mode="mean", target_triangles=None):
+    """
+    Generates a terrain mesh from a NumPy array of points by treating it as
+    a heightfield: bin into XY cells (min/mean/max Z), fill empty cells and
+    triangulate the grid. With target_triangles set, the grid is simplified
+    with an RTIN to at most that many triangles.
+    """
+    heights, origin, cell_size = _prepare_heights(points, cell_size, z_mode)
+    rows, cols = heights.shape
+
+    # Vertices sit at cell centres
+    if target_triangles and 2 * (rows - 1) * (cols - 1) > target_triangles:
+        (vx, vy), triangles, terrain = simplify_rtin(heights, target_triangles)
+        vertices = _rtin_vertices(vx, vy, terrain, heights, origin, cell_size)
+    else:
+        vertices, triangles = _full_grid(heights, origin, cell_size)
+
+    mesh = _to_mesh(vertices, triangles)
+    print(f"Grid mesh complete: {len(vertices)} vertices, {len(triangles)} triangles.")
+    return mesh
+
+
+def generate_grid_lods(points, ratios, cell_size=None, z_mode="mean", target_triangles=None, workers=None):
+    """
+    Generates a chain of grid meshes, one per ratio of the LOD0 triangle
+    count (the full grid, or target_triangles when set). The height grid is
+    built once; all RTIN levels share one error map and are extracted in
+    parallel. Returns a list of (mesh, seconds) from LOD0 down.
+    """
+    heights, origin, cell_size = _prepare_heights(points, cell_size, z_mode)
+    rows, cols = heights.shape
+    full = 2 * (rows - 1) * (cols - 1)
+    base = min(full, target_triangles) if target_triangles else full
+    budgets = [max(2, round(base * ratio)) for ratio in ratios]
+
+    start = time.perf_counter()
+    rtin_budgets = [b for b in budgets if b < full]
+    levels, terrain = simplify_rtin_levels(heights, rtin_budgets, workers) if rtin_budgets else ([], None)
+    rtin_seconds = (time.perf_counter() - start) / max(1, len(rtin_budgets))
+
+    lods = []
+    rtin = iter(levels)
+    for budget in budgets:
+        if budget >= full:
+            level_start = time.perf_counter()
+            mesh = _to_mesh(*_full_grid(heights, origin, cell_size))
+            lods.append((mesh, time.perf_counter() - level_start))
+        else:
+            (vx, vy), triangles = next(rtin)
+            vertices = _rtin_vertices(vx, vy, terrain, heights, origin, cell_size)
+            # Levels are extracted concurrently; report the average share
+            lods.append((_to_mesh(vertices, triangles), rtin_seconds))
+    return lods
@@ -0,0 +1,193 @@
+# laz_index.py
+#
+# Multi-file LAZ input. A delivery is a directory (or glob) of LAZ tiles; a
+# small JSON index of each tile's header (bounds, point count, CRS) is kept
+# next to the tiles so later runs only open headers of new or modified files.
+# Only tiles intersecting the requested area are read, in parallel worker
+# processes, and merged into one point array.
+
+import glob
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import laspy
+import numpy as np
+from pyproj import CRS
+from pyproj.transformer import Transformer
+
+from point_cloud_processor import (process_point_cloud, voxel_keys, sample_points,
+                                   DEFAULT_CHUNK_SIZE, DEFAULT_SPACING_FACTOR)
+
+# Written into the tile directory; a glob's index goes into its directory
+INDEX_NAME = ".laz_index.json"
+
+LAZ_SUFFIXES = (".laz", ".las")
+
+
+def resolve_laz_inputs(spec):
+    """
+    Expands a LAZ input into a sorted list of absolute paths: every .laz/.las
+    file in a directory, every match of a glob, or the single file given.
+    """
+    if os.path.isdir(spec):
+        paths = [os.path.join(spec, name) for name in os.listdir(spec)
+                 if name.lower().endswith(LAZ_SUFFIXES)]
+    elif glob.has_magic(spec):
+        paths = glob.glob(spec)
+    else:
+        paths = [spec]
+    if not paths:
+        raise ValueError(f"No LAZ files found for {spec!r}")
+    return sorted(os.path.abspath(p) for p in paths)
+
+
+def _index_path(spec, paths):
+    directory = spec if os.path.isdir(spec) else os.path.commonpath([os.path.dirname(p) for p in paths])
+    return os.path.join(directory, INDEX_NAME)
+
+
+def _read_header(path):
+    with laspy.open(path) as f:
+        header = f.header
+        crs = header.parse_crs()
+        return {"bounds": [float(header.mins[0]), float(header.mins[1]),
+                           float(header.maxs[0]), float(header.maxs[1])],
+                "min_z": float(header.mins[2]),
+                "point_count": int(header.point_count),
+                "crs": crs.to_wkt() if crs else None}
+
+
+def build_index(spec):
+    """
+    Returns {path: entry} for the tiles of spec, reading the headers of files
+    that are new or whose size or mtime changed since the saved index, and
+    saving the index back when anything changed. A single file is indexed
+    in memory only.
+    """
+    paths = resolve_laz_inputs(spec)
+    index_path = _index_path(spec, paths) if os.path.isdir(spec) or glob.has_magic(spec) else None
+    saved = {}
+    if index_path:
+        try:
+            with open(index_path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    index, read = {}, 0
+    for path in paths:
+        stat = os.stat(path)
+        entry = saved.get(path)
+        if not entry or entry["size"] != stat.st_size or entry["mtime_ns"] != stat.st_mtime_ns:
+            entry = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, **_read_header(path)}
+            read += 1
+        index[path] = entry
+    if not index_path:
+        return index
+    print(f"LAZ index: {len(index)} tiles, {read} headers read")
+
+    if read or set(saved) != set(index):
+        try:
+            with open(index_path, "w") as f:
+                json.dump(index, f, indent=1)
+        except OSError as e:
+            print(f"Warning: could not save the LAZ index to {index_path}: {e}")
+    return index
+
+
+def _intersects(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def select_tiles(spec, area_crs=None, area_bounds=None):
+    """
+    Returns [(path, entry)] for the tiles of spec whose header bounds
+    intersect area_bounds (min_x, min_y, max_x, max_y in area_crs). A single
+    file is always returned; with no area every tile is.
+    """
+    index = build_index(spec)
+    tiles = sorted(index.items())
+    if len(tiles) == 1 or area_bounds is None:
+        return tiles
+
+    selected = []
+    for path, entry in tiles:
+        bounds = area_bounds
+        if entry["crs"] and area_crs is not None and CRS.from_wkt(entry["crs"]) != CRS(area_crs):
+            transformer = Transformer.from_crs(CRS(area_crs), CRS.from_wkt(entry["crs"]), always_xy=True)
+            bounds = transformer.transform_bounds(*area_bounds)
+        if _intersects(entry["bounds"], bounds):
+            selected.append((path, entry))
+    print(f"{len(selected)} of {len(tiles)} LAZ tiles intersect the requested area")
+    if not selected:
+        raise ValueError("No LAZ tiles intersect the requested area.")
+    return selected
+
+
+def tiles_metadata(tiles):
+    """The shared CRS and the combined (min_x, min_y, max_x, max_y) bounds of tiles."""
+    crs_wkts = {entry["crs"] for _, entry in tiles}
+    if len(crs_wkts) > 1:
+        raise ValueError("The selected LAZ tiles use different CRSs.")
+    wkt = crs_wkts.pop()
+    bounds = np.array([entry["bounds"] for _, entry in tiles])
+    return (CRS.from_wkt(wkt) if wkt else None,
+            (bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max()))
+
+
+def tiles_spacing(tiles, spacing=None, point_budget=None):
+    """
+    The sampling voxel size for a set of tiles, chosen as
+    point_cloud_processor.sampling_spacing does for one file but from the
+    combined point count and footprint, so every tile samples alike.
+    """
+    if spacing:
+        return float(spacing)
+    area = sum((b[2] - b[0]) * (b[3] - b[1]) for b in (entry["bounds"] for _, entry in tiles))
+    count = sum(entry["point_count"] for _, entry in tiles)
+    if count == 0 or area <= 0:
+        raise ValueError(f"Cannot derive a sampling spacing from tiles with {count} points "
+                         f"over {area} square units; pass an explicit spacing.")
+    if point_budget:
+        return float(np.sqrt(area / point_budget))
+    return DEFAULT_SPACING_FACTOR * float(np.sqrt(area / count))
+
+
+def read_laz_tiles(tiles, stream=False, chunk_size=DEFAULT_CHUNK_SIZE, origin=None,
+                   spacing=None, point_budget=None, workers=None, crop=None, store_dir=None):
+    """
+    Reads tiles with process_point_cloud, one worker process per tile, and
+    merges them. crop and store_dir are passed on to every tile. All tiles
+    sample on one voxel grid anchored at the combined minimum corner; voxels
+    split across tile seams are deduplicated and the merged points come back
+    in Morton order. Returns (points, crs).
+    """
+    if len(tiles) == 1:
+        return process_point_cloud(tiles[0][0], stream=stream, chunk_size=chunk_size, origin=origin,
+                                   spacing=spacing, point_budget=point_budget, crop=crop,
+                                   store_dir=store_dir)
+
+    crs, bounds = tiles_metadata(tiles)
+    spacing = tiles_spacing(tiles, spacing, point_budget)
+    grid_origin = (bounds[0], bounds[1], min(entry["min_z"] for _, entry in tiles))
+
+    parts = []
+    # Spawned workers: the LAZ decoder's thread pool does not survive a fork
+    context = multiprocessing.get_context("spawn")
+    workers = min(workers or os.cpu_count() or 1, len(tiles))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(process_point_cloud, path, stream, chunk_size, origin, spacing, None, grid_origin,
+                               crop, store_dir)
+                   for path, _ in tiles]
+        for future in futures:
+            parts.append(future.result()[0])
+    points = np.concatenate(parts)
+
+    # Merge the tiles into one Morton order on the shared grid
+    shift = np.zeros(3) if origin is None else np.asarray(origin, dtype=np.float64)
+    keys = voxel_keys(points.T, np.asarray(grid_origin) - shift, spacing)
+    points = points[sample_points(keys)]
+    print(f"Merged {len(tiles)} LAZ tiles into {len(points)} points")
+    return points, crs
@@ -1,53 +1,203 @@
 # main.py
 
 import argparse
+import json
 import subprocess
 import os
+import shutil
+import tempfile
 from pathlib import Path
-import open3d as o3d
 
 # Import our custom processing modules
-from point_cloud_processor import process_point_cloud
-from texture_processor import process_geotiff
-from coordinate_transformer import align_coordinates
-from mesh_generator import generate_mesh_from_points, save_intermediate_mesh
+from grid_mesher import Z_MODES
+from normals import NORMAL_ENGINES
+from reconstruction_planner import DEFAULT_PLANNER_LOG
+from stage_cache import StageCache, DEFAULT_CACHE_SIZE_GB
+from profiling import StageProfiler, METRICS_PREFIX, stage
+from pipeline import Pipeline, PIPELINE_DEFAULTS, normalize_options
+
+
+def add_pipeline_arguments(parser):
+    """Adds the pipeline options shared by main.py and batch.py."""
+    parser.add_argument("--blender-path", type=str, default="blender", help="Path to the Blender executable.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Decode the LAZ in fixed-size chunks to bound peak memory.")
+    parser.add_argument("--chunk-size", type=int, default=PIPELINE_DEFAULTS["chunk_size"],
+                        help="Points decoded per chunk when --stream is set.")
+    parser.add_argument("--laz-workers", type=int, default=None,
+                        help="Worker processes reading LAZ tiles when the input has several (default: CPU count).")
+    parser.add_argument("--point-store", type=str, default=None, metavar="DIR",
+                        help="Read LAZ files through columnar point stores in DIR, ingesting each file once "
+                             "and again whenever it changes (see point_store.py).")
+    parser.add_argument("--sample-spacing", type=float, default=None,
+                        help="Keep one point per voxel of this size in CRS units (default: twice the "
+                             "mean point spacing from the LAZ header).")
+    parser.add_argument("--point-budget", type=int, default=None,
+                        help="Pick the sampling voxel size so that roughly this many points remain "
+                             "on flat ground; ignored when --sample-spacing is set.")
+    parser.add_argument("--mesher", choices=("poisson", "grid"), default=PIPELINE_DEFAULTS["mesher"],
+                        help="'poisson' reconstructs a 3D surface; 'grid' meshes the terrain as a 2.5D heightfield.")
+    parser.add_argument("--normals", choices=NORMAL_ENGINES, default=PIPELINE_DEFAULTS["normals"],
+                        help="Poisson normal engine: 'terrain' orients PCA normals up (+Z) with an "
+                             "auto-scaled radius; 'open3d' uses consistent tangent plane orientation.")
+    parser.add_argument("--normals-workers", type=int, default=None,
+                        help="Threads for 'terrain' normal estimation (default: CPU count, at most 8), "
+                             "shared out between tile workers when --tile-size is set.")
+    parser.add_argument("--target-triangles", type=int, default=PIPELINE_DEFAULTS["target_triangles"],
+                        help="Triangle budget for decimation (Poisson) or RTIN simplification (grid).")
+    parser.add_argument("--grid-cell", type=float, default=None,
+                        help="Grid mesher cell size in CRS units (default: twice the mean point spacing).")
+    parser.add_argument("--grid-z", choices=Z_MODES, default=PIPELINE_DEFAULTS["grid_z"],
+                        help="Per-cell height statistic for the grid mesher.")
+    parser.add_argument("--lod-ratios", type=float, nargs="+", default=None, metavar="RATIO",
+                        help="Export a LOD chain, e.g. 1.0 0.25 0.06: each level keeps this share of "
+                             "LOD0's triangles and is simplified from the level before it.")
+    parser.add_argument("--tile-size", type=float, default=None,
+                        help="Reconstruct the mesh in XY tiles of this size (CRS units) in parallel.")
+    parser.add_argument("--tile-overlap", type=float, default=PIPELINE_DEFAULTS["tile_overlap"],
+                        help="Overlap between neighbouring tiles when --tile-size is set.")
+    parser.add_argument("--tile-workers", type=int, default=None,
+                        help="Worker processes for tiled reconstruction (default: CPU count).")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="GB",
+                        help="Plan Poisson reconstruction to fit this much memory: the highest octree depth "
+                             "that fits, else tiling, else the grid mesher (see reconstruction_planner.py).")
+    parser.add_argument("--planner-log", type=str, default=DEFAULT_PLANNER_LOG,
+                        help="JSON-lines log of planner predictions and measurements, used for calibration.")
+    parser.add_argument("--no-rebase", action="store_true",
+                        help="Keep absolute float64 coordinates instead of float32 offsets from a local origin.")
+    parser.add_argument("--debug-obj", action="store_true",
+                        help="Also write the intermediate mesh as an ASCII OBJ for inspection; "
+                             "keeps the run's temporary directory.")
+    parser.add_argument("--keep-temp", action="store_true",
+                        help="Keep the run's intermediate files under ./temp_geo_processing instead of "
+                             "deleting them at the end.")
+    parser.add_argument("--color-mode", choices=("texture", "vertex"), default=PIPELINE_DEFAULTS["color_mode"],
+                        help="'vertex' samples the GeoTIFF bilinearly at every mesh vertex and exports vertex "
+                             "colours with no texture image, UVs or bake; meant for distant context meshes.")
+    parser.add_argument("--texture-mode", choices=("bake", "direct"), default=PIPELINE_DEFAULTS["texture_mode"],
+                        help="'bake' renders the texture with a Cycles bake; 'direct' crops and "
+                             "resamples the GeoTIFF to the mesh footprint and skips Cycles.")
+    parser.add_argument("--texture-res", type=int, default=PIPELINE_DEFAULTS["texture_res"],
+                        help="Maximum texture size in pixels; the GeoTIFF is resampled while reading.")
+    parser.add_argument("--texture-tile-res", type=int, default=None,
+                        help="Split the texture into tiles of at most this many pixels per side, so the "
+                             "GeoTIFF keeps --texture-scale of its native resolution. The mesh is split "
+                             "along the same lines, one material per tile (implies --texture-mode direct).")
+    parser.add_argument("--texture-scale", type=float, default=PIPELINE_DEFAULTS["texture_scale"],
+                        help="Texture tile resolution relative to the GeoTIFF's native resolution.")
+    parser.add_argument("--texture-workers", type=int, default=None,
+                        help="Worker processes writing texture tiles (default: CPU count).")
+    parser.add_argument("--texture-percentile", type=float, nargs=2, default=None, metavar=("LOW", "HIGH"),
+                        help="Stretch non-8-bit rasters between these percentiles instead of 0..max.")
+    parser.add_argument("--compare-baked", type=str, default=None,
+                        help="With --texture-mode direct, report pixel differences against this "
+                             "previously baked PNG.")
+    parser.add_argument("--exporter", choices=("blender", "native"), default="blender",
+                        help="'native' writes the FBX directly without starting Blender "
+                             "(implies --texture-mode direct).")
+    parser.add_argument("--aoi", type=str, default=None,
+                        help="Only process this area: min_x,min_y,max_x,max_y, a WKT POLYGON, or a .wkt or "
+                             "GeoJSON polygon file. The LAZ/GeoTIFF overlap is always applied.")
+    parser.add_argument("--aoi-crs", type=str, default=None,
+                        help="CRS of --aoi, e.g. EPSG:4326 (default: the GeoTIFF's CRS).")
+    parser.add_argument("--cache-dir", type=str, default="./temp_geo_processing/cache",
+                        help="Directory of the stage cache.")
+    parser.add_argument("--cache-size", type=float, default=DEFAULT_CACHE_SIZE_GB,
+                        help="Stage cache size cap in GB; least recently used entries are evicted.")
+    parser.add_argument("--cache-hash", action="store_true",
+                        help="Key cached stages on input file contents rather than path/size/mtime.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Recompute every stage and leave the cache untouched.")
+
+
+def normalize_args(args):
+    normalize_options(args)
+    if args.exporter == "native" and args.texture_mode != "direct":
+        print("Native exporter cannot bake; using --texture-mode direct.")
+        args.texture_mode = "direct"
+    return args
+
+
+def prepare_assets(laz_input, tif_input, fbx_output, args, temp_dir, cache, profiler=None):
+    """
+    Runs the pipeline (see pipeline.Pipeline) for one LAZ/TIF pair. With
+    the native exporter the FBX is written here too and None is returned;
+    otherwise the meshes and textures are written to temp_dir and the job
+    description for blender_processor.py is returned. Stages are recorded
+    on profiler when one is given.
+    """
+    pipeline = Pipeline.from_args(args, cache, profiler)
+    result = pipeline.run(laz=laz_input, tif=tif_input, work_dir=temp_dir)
+    if args.debug_obj:
+        pipeline.write_debug_obj(result, temp_dir / "mesh.obj")
+    if args.exporter == "native":
+        pipeline.write_fbx(result, fbx_output)
+        return None
+    return pipeline.write_blender_job(result, temp_dir, fbx_output)
+
+
+def blender_job_arguments(job):
+    """Command-line flags for blender_processor.py describing one job."""
+    if job.get("tiles"):
+        arguments = ["--tiles", job["tiles"], "--fbx", job["fbx"], "--texture-mode", job["texture_mode"]]
+    elif job.get("colors"):
+        arguments = ["--mesh", *job["mesh"], "--colors", *job["colors"], "--fbx", job["fbx"]]
+    else:
+        arguments = [
+            "--mesh", *job["mesh"],
+            "--texture", job["texture"],
+            "--baked-texture", job["baked_texture"],
+            "--fbx", job["fbx"],
+            "--bounds", *map(str, job["bounds"]),
+            "--texture-mode", job["texture_mode"],
+        ]
+    if job.get("profile_dir"):
+        arguments += ["--profile-dir", job["profile_dir"]]
+    return arguments
+
+
+def parse_blender_metrics(stdout):
+    """Returns the stage records blender_processor.py reported on its METRICS_PREFIX line."""
+    for line in stdout.splitlines():
+        if line.startswith(METRICS_PREFIX):
+            return json.loads(line[len(METRICS_PREFIX):])["stages"]
+    return []
+
 
 def main():
     parser = argparse.ArgumentParser(
         description="Automated pipeline to convert LAZ and TIF to a textured FBX."
     )
-    parser.add_argument("laz_input", type=str, help="Path to the input.laz file.")
+    parser.add_argument("laz_input", type=str,
+                        help="Path to the input.laz file, a directory of LAZ tiles or a glob such as 'tiles/*.laz'.")
     parser.add_argument("tif_input", type=str, help="Path to the input.tif file.")
     parser.add_argument("fbx_output", type=str, help="Path for the output.fbx file.")
-    parser.add_argument("--blender-path", type=str, default="blender", help="Path to the Blender executable.")
-    args = parser.parse_args()
-
-    # Create a temporary directory for intermediate files
-    temp_dir = Path("./temp_geo_processing")
-    temp_dir.mkdir(exist_ok=True)
-    
-    intermediate_obj = (temp_dir / "mesh.obj").resolve()
-    intermediate_png = (temp_dir / "texture.png").resolve()
-    baked_texture_png = (temp_dir / "baked_texture.png").resolve()
+    add_pipeline_arguments(parser)
+    parser.add_argument("--profile", action="store_true",
+                        help="Print wall time, CPU time, peak memory and sizes for every stage.")
+    parser.add_argument("--metrics-json", type=str, default=None,
+                        help="Write the per-stage metrics, including Blender's, to this JSON file.")
+    parser.add_argument("--profile-dir", type=str, default=None,
+                        help="Also run each stage under cProfile and dump <stage>.prof files here.")
+    args = normalize_args(parser.parse_args())
+
+    # Create a per-run directory for intermediate files so concurrent runs
+    # do not overwrite each other's mesh and textures
+    temp_root = Path("./temp_geo_processing")
+    temp_root.mkdir(exist_ok=True)
+    temp_dir = Path(tempfile.mkdtemp(prefix="run-", dir=temp_root))
+    cache = StageCache(args.cache_dir, args.cache_size, enabled=not args.no_cache)
+    profile_dir = str(Path(args.profile_dir).resolve()) if args.profile_dir else None
+    profiler = StageProfiler(profile_dir)
     blender_script_path = (Path(__file__).parent / "./blender_processor.py").resolve()
-    output_fbx = Path(args.fbx_output).resolve() 
 
     try:
-        # --- STAGE 1: DATA INGESTION AND ALIGNMENT ---
-        print("--- STAGE 1: PROCESSING GEOSPATIAL DATA ---")
-        points, laz_crs = process_point_cloud(args.laz_input)
-        tif_input_path = Path(args.tif_input).resolve()
-        tif_crs, tif_bounds = process_geotiff(str(tif_input_path), str(intermediate_png))
-        aligned_points = align_coordinates(points, laz_crs, tif_crs)
-
-        # --- STAGE 2: MESH GENERATION ---
-        print("\n--- STAGE 2: GENERATING 3D MESH ---")
-        mesh = generate_mesh_from_points(aligned_points)
-        save_intermediate_mesh(mesh, str(intermediate_obj))
-
-        # Small check to see that stage two actually produced a mesh
-        mesh = o3d.io.read_triangle_mesh(str(intermediate_obj))
-        print(f"DEBUG: mesh.obj → {len(mesh.vertices)} verts, {len(mesh.triangles)} tris")
+        job = prepare_assets(args.laz_input, args.tif_input, args.fbx_output, args, temp_dir, cache,
+                             profiler)
+        if job is None:
+            print("\n--- PIPELINE COMPLETED SUCCESSFULLY ---")
+            print(f"Final output saved to: {args.fbx_output}")
+            return
 
         # --- STAGE 3: BLENDER PROCESSING ---
         print("\n--- STAGE 3: RUNNING BLENDER FOR TEXTURING AND EXPORT ---")
@@ -57,28 +207,18 @@ def main():
             "--enable-autoexec",
             "--python", str(blender_script_path),
             "--", # Argument separator
-            "--obj", str(intermediate_obj),
-            "--texture", str(intermediate_png),
-            "--baked-texture", str(baked_texture_png),
-            #"--fbx", args.fbx_output,
-            "--fbx", str(output_fbx),
-            #"--bounds", *[str(b) for b in tif_bounds]
-            "--bounds", *map(str, tif_bounds),
+            *blender_job_arguments({**job, "profile_dir": profile_dir}),
         ]
 
-        # The blender_processor.py script needs to be modified to accept these arguments
-        # using Python's argparse or by parsing sys.argv
-        
-        print("Running Blender commands:", blender_command) # delete this later 
-
-        #subprocess.run(blender_command, check=True)
-
-        result = subprocess.run(
-            blender_command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+        with stage(profiler, "blender") as record:
+            result = subprocess.run(
+                blender_command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                text=True
+            )
+            record["output_bytes"] = os.path.getsize(job["fbx"]) if os.path.exists(job["fbx"]) else 0
+        profiler.extend(parse_blender_metrics(result.stdout))
 
         print("→ Blender exit code:", result.returncode)
         print("→ Blender stdout:\n", result.stdout)
@@ -94,10 +234,14 @@ def main():
         print(f"\n--- PIPELINE FAILED ---")
         print(f"An error occurred: {e}")
     finally:
-        # Optional: Clean up temporary files
-        # import shutil
-        # shutil.rmtree(temp_dir)
-        pass
+        if args.profile:
+            profiler.report()
+        if args.metrics_json:
+            profiler.write_json(args.metrics_json)
+        if args.keep_temp or args.debug_obj:
+            print(f"Intermediate files kept in: {temp_dir}")
+        else:
+            shutil.rmtree(temp_dir, ignore_errors=True)
 
 if __name__ == "__main__":
     # The blender_processor.py script also needs its own __main__ block
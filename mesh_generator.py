@@ -1,11 +1,42 @@
 # mesh_generator.py
 
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
 import open3d as o3d
 import numpy as np
 
-def generate_mesh_from_points(points):
+from mesh_io import write_binary_mesh
+from profiling import stage, RssSampler
+from normals import estimate_normals
+
+# Tiles with fewer points than this are skipped; Poisson cannot fit a surface to them
+MIN_TILE_POINTS = 100
+
+# Smallest per-tile decimation target, so thinly populated tiles keep some detail
+MIN_TILE_TRIANGLES = 1000
+
+# Poisson octree depth used unless the reconstruction planner picks one
+POISSON_DEPTH = 9
+
+# Poisson bounding cube size relative to the points' bounding box
+POISSON_SCALE = 1.1
+
+# Share of lowest-density Poisson vertices removed after reconstruction
+DENSITY_QUANTILE = 0.05
+
+def generate_mesh_from_points(points, depth=POISSON_DEPTH, target_triangles=100000, profiler=None,
+                              normals="terrain", scale=POISSON_SCALE, density_quantile=DENSITY_QUANTILE,
+                              normals_workers=None):
     """
     Generates a 3D mesh from a NumPy array of points using Open3D.
+    With a profiling.StageProfiler, each step is recorded as its own stage.
+    normals selects the normal engine and normals_workers its thread count
+    (see normals.estimate_normals).
+    target_triangles=None keeps Poisson's full resolution and only cleans
+    the mesh up.
     """
     # Step 1: Create an Open3D PointCloud object
     pcd = o3d.geometry.PointCloud()
@@ -13,29 +44,27 @@ def generate_mesh_from_points(points):
 
     # Step 2: Estimate normals
     # The algorithm analyzes neighboring points to determine the surface orientation
-    print("Estimating normals...")
-    pcd.estimate_normals(
-        search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.5, max_nn=30)
-    )
-
-    # Orient the normals consistently
-    # This ensures all normals point "outward" from the surface
-    pcd.orient_normals_consistent_tangent_plane(100)
+    print(f"Estimating normals ({normals})...")
+    with stage(profiler, "mesh.normals", points=len(points), engine=normals):
+        estimate_normals(pcd, points, normals, workers=normals_workers)
     print("Normals estimated and oriented.")
 
     # In mesh_generator.py, inside generate_mesh_from_points()
 
     # Option A: Poisson Surface Reconstruction
     print("Performing Poisson surface reconstruction...")
-    with o3d.utility.VerbosityContextManager(o3d.utility.VerbosityLevel.Debug) as cm:
+    with stage(profiler, "mesh.poisson", depth=depth) as record, \
+            o3d.utility.VerbosityContextManager(o3d.utility.VerbosityLevel.Debug) as cm:
        mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
-           pcd, depth=9, width=0, scale=1.1, linear_fit=False
+           pcd, depth=depth, width=0, scale=scale, linear_fit=False
        )
+       record["triangles"] = len(mesh.triangles)
 
     # Post-processing: remove low-density vertices
     print("Filtering low-density vertices...")
-    vertices_to_remove = densities < np.quantile(densities, 0.05)
-    mesh.remove_vertices_by_mask(vertices_to_remove)
+    with stage(profiler, "mesh.density_filter"):
+        vertices_to_remove = densities < np.quantile(densities, density_quantile)
+        mesh.remove_vertices_by_mask(vertices_to_remove)
 
     # # Option B: Ball Pivoting Algorithm
     # print("Performing Ball Pivoting reconstruction...")
@@ -53,20 +82,471 @@ def generate_mesh_from_points(points):
     # Step 4: Post-process the mesh
     print("Simplifying mesh...")
     # Decimate the mesh to reduce polygon count for better performance
-    # Target 100,000 triangles for this example
-    mesh = mesh.simplify_quadric_decimation(target_number_of_triangles=100000)
+    # Target 100,000 triangles by default
+    with stage(profiler, "mesh.decimate", input_triangles=len(mesh.triangles)) as record:
+        if target_triangles is not None:
+            mesh = mesh.simplify_quadric_decimation(target_number_of_triangles=target_triangles)
+
+        # Remove small, disconnected pieces of geometry
+        mesh.remove_degenerate_triangles()
+        mesh.remove_duplicated_triangles()
+        mesh.remove_duplicated_vertices()
+        mesh.remove_non_manifold_edges()
+        record["triangles"] = len(mesh.triangles)
+
+
+    print("Mesh generation and processing complete.")
+    return mesh
+
+def _reconstruct_tile(tile_points, core_bounds, depth, normals, target_triangles, normals_workers):
+    """
+    Worker entry point for generate_tiled_mesh. Reconstructs one overlapping
+    tile, decimates it to target_triangles (None keeps full resolution) and
+    only then clips it exactly to its core area. Decimation never sees the
+    tile lines, so the border vertices the clip creates lie exactly on them
+    and stitch_tiles can weld them. Returns plain (vertices, triangles)
+    arrays so the result pickles cheaply back to the parent, with the
+    seconds and peak MiB the reconstruction took.
+    """
+    start = time.perf_counter()
+    with RssSampler() as memory:
+        mesh = generate_mesh_from_points(tile_points, depth=depth, target_triangles=target_triangles,
+                                         normals=normals, normals_workers=normals_workers)
+    vertices = np.asarray(mesh.vertices)
+    triangles = np.asarray(mesh.triangles)
+
+    min_x, min_y, max_x, max_y = core_bounds
+    for axis, value, keep_below in ((0, min_x, False), (0, max_x, True), (1, min_y, False), (1, max_y, True)):
+        if np.isfinite(value):
+            vertices, triangles = clip_mesh(vertices, triangles, axis, value, keep_below)
+    vertices, triangles = _compact(vertices, triangles)
+    return vertices, triangles, time.perf_counter() - start, memory.peak_mb
+
+
+def _compact(vertices, triangles):
+    """Drops degenerate triangles and the vertices no triangle uses."""
+    triangles = triangles[(triangles[:, 0] != triangles[:, 1]) & (triangles[:, 1] != triangles[:, 2]) &
+                          (triangles[:, 0] != triangles[:, 2])]
+    used, triangles = np.unique(triangles, return_inverse=True)
+    return vertices[used], triangles.reshape(-1, 3)
+
+
+def clip_mesh(vertices, triangles, axis, value, keep_below):
+    """
+    Cuts a mesh at the plane vertices[:, axis] == value and keeps the part
+    below it (keep_below) or above it. Triangles crossing the plane are
+    split; each cut edge gets one new vertex lying exactly on the plane,
+    shared by the triangles on both sides of the edge, so the clipped mesh
+    stays connected. Returns (vertices, triangles) with the unused vertices
+    still in place.
+    """
+    side = vertices[:, axis] - value
+    if not keep_below:
+        side = -side
+    inside = side <= 0
+    inside_count = inside[triangles].sum(axis=1)
+    whole = triangles[inside_count == 3]
+    is_cut = (inside_count == 1) | (inside_count == 2)
+    cut_tris = triangles[is_cut]
+    if not len(cut_tris):
+        return vertices, whole
+
+    # Rotate each cut triangle so that its lone vertex, the only one inside
+    # or the only one outside, comes first; the winding is kept
+    lone_inside = inside_count[is_cut] == 1
+    lone = np.where(lone_inside, np.argmax(inside[cut_tris], axis=1), np.argmin(inside[cut_tris], axis=1))
+    rows = np.arange(len(cut_tris))
+    a, b, c = (cut_tris[rows, (lone + k) % 3] for k in range(3))
+
+    # One cut point per crossing edge; an inside end already on the plane is its own cut point
+    edges = np.concatenate([np.stack([a, b], axis=1), np.stack([a, c], axis=1)])
+    low, high = np.minimum(edges[:, 0], edges[:, 1]), np.maximum(edges[:, 0], edges[:, 1])
+    keys = low.astype(np.int64) * len(vertices) + high
+    _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+    p, q = edges[first, 0], edges[first, 1]
+    inside_end = np.where(inside[p], p, q)
+    on_plane = side[inside_end] == 0
+    t = side[p] / (side[p] - side[q])
+    points = vertices[p] + t[:, None] * (vertices[q] - vertices[p])
+    points[:, axis] = value
+    ids = inside_end.copy()
+    ids[~on_plane] = len(vertices) + np.arange(np.count_nonzero(~on_plane))
+    vertices = np.concatenate([vertices, points[~on_plane]])
+    ab, ac = ids[inverse[:len(rows)]], ids[inverse[len(rows):]]
+
+    # A lone inside vertex keeps one triangle, a lone outside one leaves a quad
+    kept = [whole,
+            np.stack([a, ab, ac], axis=1)[lone_inside],
+            np.stack([ab, b, c], axis=1)[~lone_inside],
+            np.stack([ab, c, ac], axis=1)[~lone_inside]]
+    return vertices, np.concatenate(kept).astype(triangles.dtype)
+
+
+def _seam_edges(vertices, triangles, axis, value):
+    """
+    The border edges of a clipped tile lying on the plane vertices[:, axis]
+    == value, as (triangle rows, edge positions); edge k of a triangle runs
+    from its corner k to corner k + 1. Edges used by two triangles are folds
+    in the plane, not border, and are left out.
+    """
+    on = vertices[:, axis] == value
+    ends = np.roll(triangles, -1, axis=1)
+    rows, pos = np.nonzero(on[triangles] & on[ends])
+    u, v = triangles[rows, pos], ends[rows, pos]
+    keys = np.minimum(u, v).astype(np.int64) * len(vertices) + np.maximum(u, v)
+    _, inverse, counts = np.unique(keys, return_inverse=True, return_counts=True)
+    single = counts[inverse] == 1
+    return rows[single], pos[single]
+
+
+def _seam_profile(vertices, triangles, axis, value):
+    """
+    A tile's border along a seam as a profile over the seam's other
+    horizontal axis t: the border edges sorted by their t interval, with
+    the z of both ends, plus the tile's border vertices.
+    """
+    t_axis = 1 - axis
+    rows, pos = _seam_edges(vertices, triangles, axis, value)
+    u, v = triangles[rows, pos], triangles[rows, (pos + 1) % 3]
+    tu, tv = vertices[u, t_axis], vertices[v, t_axis]
+    keep = tu != tv
+    rows, pos, u, v, tu, tv = rows[keep], pos[keep], u[keep], v[keep], tu[keep], tv[keep]
+    order = np.argsort(np.minimum(tu, tv), kind="stable")
+    rows, pos, u, v, tu, tv = rows[order], pos[order], u[order], v[order], tu[order], tv[order]
+    ids = np.unique(np.concatenate([u, v]))
+    return {"rows": rows, "pos": pos, "tu": tu, "tv": tv, "zu": vertices[u, 2], "zv": vertices[v, 2],
+            "lo": np.minimum(tu, tv), "hi": np.maximum(tu, tv), "ids": ids, "t": vertices[ids, t_axis]}
+
+
+def _profile_lookup(profile, t):
+    """For positions t along the seam: the covering border edge (-1 if none) and the tile's z there."""
+    edge = np.searchsorted(profile["lo"], t, side="right") - 1
+    covered = edge >= 0
+    covered[covered] = t[covered] <= profile["hi"][edge[covered]]
+    edge = np.where(covered, edge, -1)
+    safe = np.maximum(edge, 0)
+    tu, tv = profile["tu"][safe], profile["tv"][safe]
+    weight = (t - tu) / np.where(tv != tu, tv - tu, 1.0)
+    return edge, profile["zu"][safe] * (1 - weight) + profile["zv"][safe] * weight
+
+
+def _insert_seam_points(vertices, triangles, profile, axis, value, t, z):
+    """
+    Moves a tile's border onto the shared seam profile (t, z): border
+    vertices at one of the positions t take its z, and the other positions
+    that fall inside a border edge become new vertices splitting that edge,
+    its triangle turned into a fan. Returns the updated (vertices, triangles).
+    """
+    t_axis = 1 - axis
+    order = np.argsort(profile["t"], kind="stable")
+    border_t, border_ids = profile["t"][order], profile["ids"][order]
+    vertices = vertices.copy()
+    existing = np.zeros(len(t), dtype=bool)
+    if len(border_t):
+        index = np.minimum(np.searchsorted(border_t, t), len(border_t) - 1)
+        existing = border_t[index] == t
+        vertices[border_ids[index[existing]], 2] = z[existing]
+
+    edge, _ = _profile_lookup(profile, t)
+    new = ~existing & (edge >= 0)
+    # A triangle is only split along one of its border edges
+    split_edges = np.unique(edge[new])
+    _, first = np.unique(profile["rows"][split_edges], return_index=True)
+    new &= np.isin(edge, split_edges[first])
+    if not new.any():
+        return vertices, triangles
+
+    point_edge, point_t, point_z = edge[new], t[new], z[new]
+    points = np.empty((len(point_t), 3))
+    points[:, axis] = value
+    points[:, t_axis] = point_t
+    points[:, 2] = point_z
+    point_ids = len(vertices) + np.arange(len(points))
+    vertices = np.concatenate([vertices, points])
+
+    # Order the points along each edge from its start u to its end v
+    direction = np.sign(profile["tv"][point_edge] - profile["tu"][point_edge])
+    order = np.lexsort((point_t * direction, point_edge))
+    point_edge, point_ids = point_edge[order], point_ids[order]
+    split, first, counts = np.unique(point_edge, return_index=True, return_counts=True)
+
+    # Each split edge becomes a chain u, p1 .. pk, v fanned out to the opposite corner w
+    rows, pos = profile["rows"][split], profile["pos"][split]
+    u, v, w = (triangles[rows, (pos + k) % 3] for k in range(3))
+    block = counts + 2
+    starts = np.concatenate([[0], np.cumsum(block)[:-1]])
+    chain = np.empty(block.sum(), dtype=np.int64)
+    chain[starts] = u
+    chain[starts + counts + 1] = v
+    rank = np.arange(len(point_ids)) - np.repeat(first, counts)
+    chain[np.repeat(starts, counts) + 1 + rank] = point_ids
+    links = np.ones(len(chain) - 1, dtype=bool)
+    links[(starts + block - 1)[:-1]] = False
+    fans = np.stack([chain[:-1][links], chain[1:][links], np.repeat(w, counts + 1)], axis=1)
+
+    keep = np.ones(len(triangles), dtype=bool)
+    keep[rows] = False
+    return vertices, np.concatenate([triangles[keep], fans.astype(triangles.dtype)])
+
+
+def stitch_seam(tile_a, tile_b, axis, value):
+    """
+    Makes two tiles clipped at the same plane vertices[:, axis] == value
+    meet exactly. Wherever both borders run along the seam, their vertex
+    positions are merged into one shared profile whose z is the mean of the
+    two surfaces; both borders are snapped to it, gaining vertices where
+    the other tile had them, so they end up with identical seam vertices.
+    Returns the two updated (vertices, triangles) pairs.
+    """
+    profiles = [_seam_profile(vertices, triangles, axis, value) for vertices, triangles in (tile_a, tile_b)]
+    positions = []
+    for own, other in ((profiles[0], profiles[1]), (profiles[1], profiles[0])):
+        edge, _ = _profile_lookup(other, own["t"])
+        positions.append(own["t"][edge >= 0])
+    t = np.unique(np.concatenate(positions))
+    if not len(t):
+        return tile_a, tile_b
+    z = 0.5 * (_profile_lookup(profiles[0], t)[1] + _profile_lookup(profiles[1], t)[1])
+    return tuple(_insert_seam_points(vertices, triangles, profile, axis, value, t, z)
+                 for (vertices, triangles), profile in zip((tile_a, tile_b), profiles))
+
+
+def merge_seam_vertices(vertices, triangles, seams_x, seams_y):
+    """Merges vertices on the seam lines that share exact coordinates, joining the stitched tiles into one mesh."""
+    on_seam = np.flatnonzero(np.isin(vertices[:, 0], seams_x) | np.isin(vertices[:, 1], seams_y))
+    remap = np.arange(len(vertices))
+    if len(on_seam):
+        _, first, inverse = np.unique(vertices[on_seam], axis=0, return_index=True, return_inverse=True)
+        remap[on_seam] = on_seam[first][inverse.ravel()]
+    return _compact(vertices, remap[triangles])
+
+
+def seam_edge_report(vertices, triangles, seams_x, seams_y):
+    """
+    Counts the open (single-triangle) and non-manifold (three or more
+    triangles) edges lying on the seam lines. After stitching, open seam
+    edges are left only where a neighbouring tile has a hole.
+    """
+    edges = np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])
+    edges = np.sort(edges, axis=1)
+    unique, counts = np.unique(edges, axis=0, return_counts=True)
+    start, end = vertices[unique[:, 0]], vertices[unique[:, 1]]
+    on_seam = np.zeros(len(unique), dtype=bool)
+    for axis, seams in ((0, seams_x), (1, seams_y)):
+        on_seam |= np.isin(start[:, axis], seams) & (start[:, axis] == end[:, axis])
+    return {"open": int(np.count_nonzero(on_seam & (counts == 1))),
+            "non_manifold": int(np.count_nonzero(counts > 2))}
+
+
+def stitch_tiles(tiles, edges_x, edges_y):
+    """
+    Joins clipped tiles {(i, j): (vertices, triangles)} on the grid whose
+    tile lines are edges_x and edges_y into one mesh. The seams between
+    columns are stitched first and those between rows second, so the four
+    tiles at a corner settle on one shared corner vertex.
+    """
+    tiles = dict(tiles)
+    for axis, edges in ((0, edges_x), (1, edges_y)):
+        for (i, j) in sorted(tiles):
+            neighbour = (i + 1, j) if axis == 0 else (i, j + 1)
+            if neighbour in tiles:
+                seam = edges[i + 1] if axis == 0 else edges[j + 1]
+                tiles[(i, j)], tiles[neighbour] = stitch_seam(tiles[(i, j)], tiles[neighbour], axis, seam)
+
+    pieces = [tiles[key] for key in sorted(tiles)]
+    offsets = np.cumsum([0] + [len(v) for v, _ in pieces[:-1]])
+    vertices = np.concatenate([v for v, _ in pieces])
+    triangles = np.concatenate([t + off for (_, t), off in zip(pieces, offsets)])
+    return merge_seam_vertices(vertices, triangles, edges_x[1:-1], edges_y[1:-1])
+
+
+def generate_tiled_mesh(points, tile_size, overlap, workers=None, depth=POISSON_DEPTH,
+                        target_triangles=100000, normals="terrain", stats=None, normals_workers=None):
+    """
+    Reconstructs a large extent as a grid of overlapping XY tiles, each built
+    by generate_mesh_from_points in its own worker process and decimated
+    there to its share of target_triangles (by its share of the points).
+    Every tile is then clipped exactly to its core area and the tiles are
+    stitched along the tile lines into one watertight surface (see
+    stitch_tiles).
+
+    At most two tiles per worker are in flight at any time, so worker memory
+    stays bounded by the tile size, and the parent only ever holds decimated
+    tiles, about target_triangles in all. With a stats dict, each tile's
+    seconds and peak MiB are appended to its "tile_seconds" and
+    "tile_peak_mb" lists and the parent's peak MiB while stitching is
+    stored as "stitch_peak_mb".
+
+    normals_workers (default: CPU count) normal estimation threads are
+    shared out between the tile workers, at least one each.
+    """
+    workers = workers or multiprocessing.cpu_count()
+    tile_normals_workers = max(1, (normals_workers or multiprocessing.cpu_count()) // workers)
+    min_x, min_y = points[:, 0].min(), points[:, 1].min()
+    max_x, max_y = points[:, 0].max(), points[:, 1].max()
+    nx = max(1, math.ceil((max_x - min_x) / tile_size))
+    ny = max(1, math.ceil((max_y - min_y) / tile_size))
+    # Tile lines computed once, so the clip planes and the seams match exactly;
+    # the last row/column is open so the extent's max edge is kept
+    edges_x = np.concatenate([min_x + tile_size * np.arange(nx), [np.inf]])
+    edges_y = np.concatenate([min_y + tile_size * np.arange(ny), [np.inf]])
+    print(f"Tiled reconstruction: {nx}x{ny} tiles of {tile_size} m "
+          f"(overlap {overlap} m) on {workers} workers")
+
+    def tile_jobs():
+        for j in range(ny):
+            for i in range(nx):
+                x0, x1, y0, y1 = edges_x[i], edges_x[i + 1], edges_y[j], edges_y[j + 1]
+                in_tile = ((points[:, 0] >= x0 - overlap) & (points[:, 0] < x1 + overlap) &
+                           (points[:, 1] >= y0 - overlap) & (points[:, 1] < y1 + overlap))
+                tile_points = points[in_tile]
+                if len(tile_points) < MIN_TILE_POINTS:
+                    print(f"Skipping tile ({i}, {j}): only {len(tile_points)} points")
+                    continue
+                yield (i, j), tile_points, (x0, y0, x1, y1)
+
+    start = time.perf_counter()
+    tiles = {}
+    if stats is not None:
+        stats.setdefault("tile_seconds", [])
+        stats.setdefault("tile_peak_mb", [])
+    # Spawned workers avoid forking Open3D's OpenMP state
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        pending = {}
+        jobs = tile_jobs()
+        while True:
+            while len(pending) < 2 * workers:
+                job = next(jobs, None)
+                if job is None:
+                    break
+                key, tile_points, core = job
+                tile_target = (None if target_triangles is None else
+                               max(MIN_TILE_TRIANGLES, round(target_triangles * len(tile_points) / len(points))))
+                pending[executor.submit(_reconstruct_tile, tile_points, core, depth, normals, tile_target,
+                                        tile_normals_workers)] = key
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                vertices, triangles, elapsed, peak_mb = future.result()
+                print(f"Tile {key}: {len(triangles)} triangles in {elapsed:.1f}s")
+                if len(triangles):
+                    tiles[key] = (vertices, triangles)
+                if stats is not None:
+                    stats["tile_seconds"].append(elapsed)
+                    stats["tile_peak_mb"].append(peak_mb)
+
+    if not tiles:
+        raise ValueError("Tiled reconstruction did not produce any triangles.")
+
+    tile_count = len(tiles)
+    with RssSampler() as memory:
+        vertices, triangles = stitch_tiles(tiles, edges_x, edges_y)
+        del tiles
+        report = seam_edge_report(vertices, triangles, edges_x[1:-1], edges_y[1:-1])
+        mesh = mesh_from_arrays(vertices, triangles)
+    stitch_mb = f"{memory.peak_mb:.0f} MiB" if memory.peak_mb is not None else "unknown memory"
+    print(f"Stitched {tile_count} tiles: {len(triangles)} triangles, {report['open']} open seam edges "
+          f"(holes in a neighbouring tile), {report['non_manifold']} non-manifold edges; "
+          f"{stitch_mb} in the parent")
+    if stats is not None:
+        stats["stitch_peak_mb"] = memory.peak_mb
 
-    # Remove small, disconnected pieces of geometry
     mesh.remove_degenerate_triangles()
     mesh.remove_duplicated_triangles()
     mesh.remove_duplicated_vertices()
+    mesh.remove_unreferenced_vertices()
     mesh.remove_non_manifold_edges()
 
+    print(f"Tiled reconstruction complete: {len(mesh.triangles)} triangles "
+          f"in {time.perf_counter() - start:.1f}s")
+    return mesh
 
-    print("Mesh generation and processing complete.")
+def check_lod_ratios(ratios):
+    """LOD ratios must start at or below 1.0 and strictly decrease."""
+    if not ratios or ratios[0] > 1.0 or min(ratios) <= 0 or any(
+            b >= a for a, b in zip(ratios, ratios[1:])):
+        raise ValueError(f"LOD ratios must be decreasing values in (0, 1], got {ratios}")
+
+def simplify_lod_chain(mesh, ratios):
+    """
+    Builds a LOD chain from a mesh, one level per ratio of its triangle count
+    (e.g. 1.0, 0.25, 0.06). Each level is decimated from the previous level
+    rather than from the full mesh, so every step works on a smaller input.
+    Returns a list of (mesh, seconds) from LOD0 down.
+    """
+    check_lod_ratios(ratios)
+    base = len(mesh.triangles)
+    lods = []
+    previous = mesh
+    for ratio in ratios:
+        start = time.perf_counter()
+        target = max(1, round(base * ratio))
+        if target < len(previous.triangles):
+            previous = previous.simplify_quadric_decimation(target_number_of_triangles=target)
+            previous.remove_degenerate_triangles()
+            previous.remove_unreferenced_vertices()
+        lods.append((previous, time.perf_counter() - start))
+    return lods
+
+def print_lod_report(lods, ratios):
+    print(f"{'LOD':<6}{'ratio':>8}{'triangles':>12}{'vertices':>12}{'seconds':>10}")
+    for level, ((mesh, seconds), ratio) in enumerate(zip(lods, ratios)):
+        print(f"LOD{level:<3}{ratio:>8.0%}{len(mesh.triangles):>12}{len(mesh.vertices):>12}{seconds:>10.2f}")
+
+def mesh_from_arrays(vertices, triangles):
+    """Builds an Open3D triangle mesh from (N, 3) vertex and (M, 3) index arrays."""
+    mesh = o3d.geometry.TriangleMesh()
+    mesh.vertices = o3d.utility.Vector3dVector(np.asarray(vertices, dtype=np.float64))
+    mesh.triangles = o3d.utility.Vector3iVector(np.asarray(triangles, dtype=np.int32))
     return mesh
 
-def save_intermediate_mesh(mesh, output_obj_path):
-    """Saves the Open3D mesh to an OBJ file."""
-    o3d.io.write_triangle_mesh(output_obj_path, mesh, write_ascii=True)
-    print(f"Intermediate mesh saved to {output_obj_path}")
\ No newline at end of file
+def compute_planar_uvs(vertices, bounds):
+    """
+    Maps the XY position of each vertex linearly into [0..1] over the raster
+    bounds, the same projection blender_processor.planar_projection applies.
+    Returns an (N, 2) array of per-vertex UVs.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    uvs = np.empty((len(vertices), 2), dtype=np.float64)
+    uvs[:, 0] = (vertices[:, 0] - min_x) / (max_x - min_x)
+    uvs[:, 1] = 1.0 - (vertices[:, 1] - min_y) / (max_y - min_y)
+    return uvs
+
+def partition_mesh(vertices, triangles, bounds, rows, cols):
+    """
+    Splits a mesh along a rows x cols grid over bounds (min_x, min_y, max_x,
+    max_y), assigning each triangle to the cell holding its centroid; edge
+    triangles fall into the nearest cell. Row 0 is the top (max Y) row, like
+    raster rows. Returns [(row, col, vertices, triangles)] for the non-empty
+    cells, each with its own compact vertex array.
+    """
+    min_x, min_y, max_x, max_y = bounds
+    centroids = vertices[triangles].mean(axis=1)
+    col = np.clip(((centroids[:, 0] - min_x) / (max_x - min_x) * cols).astype(np.int64), 0, cols - 1)
+    row = np.clip(((max_y - centroids[:, 1]) / (max_y - min_y) * rows).astype(np.int64), 0, rows - 1)
+    cell = row * cols + col
+
+    order = np.argsort(cell, kind="stable")
+    cells, starts = np.unique(cell[order], return_index=True)
+    parts = []
+    for cell_id, group in zip(cells, np.split(order, starts[1:])):
+        used, local = np.unique(triangles[group], return_inverse=True)
+        parts.append((int(cell_id // cols), int(cell_id % cols), vertices[used],
+                      local.reshape(-1, 3).astype(triangles.dtype)))
+    return parts
+
+def save_intermediate_mesh(mesh, output_mesh_path, debug_obj_path=None):
+    """
+    Saves the Open3D mesh in the binary intermediate format read by
+    blender_processor.py. An ASCII OBJ copy is written only when
+    debug_obj_path is given.
+    """
+    write_binary_mesh(output_mesh_path, np.asarray(mesh.vertices), np.asarray(mesh.triangles))
+    print(f"Intermediate mesh saved to {output_mesh_path}")
+
+    if debug_obj_path:
+        o3d.io.write_triangle_mesh(debug_obj_path, mesh, write_ascii=True)
+        print(f"Debug OBJ saved to {debug_obj_path}")
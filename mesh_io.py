@@ -0,0 +1,49 @@
+# mesh_io.py
+#
+# Binary intermediate mesh format used to hand meshes from the pipeline to
+# blender_processor.py. Only depends on NumPy so it also imports inside
+# Blender's bundled Python.
+#
+# Layout (little-endian):
+#   header    : magic b"LTFMESH\0", uint32 version, uint32 vertex count, uint32 triangle count
+#   vertices  : float32[vertex_count * 3]
+#   triangles : uint32[triangle_count * 3]
+
+import struct
+
+import numpy as np
+
+MESH_MAGIC = b"LTFMESH\0"
+MESH_VERSION = 1
+MESH_HEADER = struct.Struct("<8sIII")
+
+
+def write_binary_mesh(output_path, vertices, triangles):
+    """Writes (N, 3) vertices and (M, 3) triangle indices in the binary mesh format."""
+    vertices = np.ascontiguousarray(vertices, dtype="<f4")
+    triangles = np.ascontiguousarray(triangles, dtype="<u4")
+    with open(output_path, "wb") as f:
+        f.write(MESH_HEADER.pack(MESH_MAGIC, MESH_VERSION, len(vertices), len(triangles)))
+        f.write(vertices.tobytes())
+        f.write(triangles.tobytes())
+
+
+def read_binary_mesh(mesh_path):
+    """
+    Reads a binary mesh file. Returns (vertices, triangles) as flat float32
+    and uint32 arrays viewing the file contents, ready for foreach_set.
+    """
+    with open(mesh_path, "rb") as f:
+        data = f.read()
+
+    magic, version, vertex_count, triangle_count = MESH_HEADER.unpack_from(data)
+    if magic != MESH_MAGIC:
+        raise ValueError(f"{mesh_path} is not a binary mesh file")
+    if version != MESH_VERSION:
+        raise ValueError(f"Unsupported binary mesh version {version} in {mesh_path}")
+
+    offset = MESH_HEADER.size
+    vertices = np.frombuffer(data, dtype="<f4", count=vertex_count * 3, offset=offset)
+    offset += vertices.nbytes
+    triangles = np.frombuffer(data, dtype="<u4", count=triangle_count * 3, offset=offset)
+    return vertices, triangles
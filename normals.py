@@ -0,0 +1,165 @@
+# normals.py
+#
+# Normal estimation for airborne LiDAR terrain. Open3D's
+# orient_normals_consistent_tangent_plane builds a k-NN graph and a spanning
+# tree to propagate orientation, which takes minutes on dense clouds. A
+# scanner looking down from above never sees a surface from below, so here
+# every normal is simply flipped to point up (+Z).
+#
+# Neighbours are found with an XY grid hash (cells half a radius wide, so
+# every neighbour lies in the 5x5 block of cells around a point) and the
+# normals come from a batched PCA of each neighbourhood.
+
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+NORMAL_ENGINES = ("terrain", "open3d")
+
+# Neighbourhood radius in multiples of the mean point spacing
+RADIUS_SPACINGS = 3.0
+
+# Neighbour pairs examined per batch; bounds each thread's temporary memory
+# to roughly 100 MB
+PAIRS_PER_BATCH = 1_000_000
+
+# Default cap on normal estimation threads
+MAX_WORKERS = 8
+
+# Grid cells per radius; smaller cells mean fewer candidates outside the radius
+CELLS_PER_RADIUS = 2
+
+# Points with fewer neighbours than this get a straight-up normal
+MIN_NEIGHBOURS = 3
+
+
+def mean_spacing(points):
+    """Mean XY distance between points, assuming they cover their bounding box evenly."""
+    area = max(np.ptp(points[:, 0]) * np.ptp(points[:, 1]), 1e-12)
+    return math.sqrt(area / len(points))
+
+
+def _cell_index(points, cell_size):
+    """
+    Sorts points into XY cells of cell_size. Returns (order, keys,
+    cell_keys, cell_starts, cell_counts, cols): order sorts points by cell,
+    keys are the sorted points' cell keys and the cell_* arrays describe the
+    occupied cells.
+    """
+    min_x, min_y = points[:, 0].min(), points[:, 1].min()
+    ix = ((points[:, 0] - min_x) / cell_size).astype(np.int64)
+    iy = ((points[:, 1] - min_y) / cell_size).astype(np.int64)
+    # Spare columns on each side so neighbour keys never wrap into another row
+    pad = CELLS_PER_RADIUS
+    cols = int(ix.max()) + 1 + 2 * pad
+    keys = (iy + pad) * cols + (ix + pad)
+    order = np.argsort(keys, kind="stable")
+    keys = keys[order]
+    cell_keys, cell_starts, cell_counts = np.unique(keys, return_index=True, return_counts=True)
+    return order, keys, cell_keys, cell_starts, cell_counts, cols
+
+
+def _neighbour_pairs(batch_keys, cell_keys, cell_starts, cell_counts, cols):
+    """
+    All (query, candidate) pairs between a batch of points and the points in
+    the block of cells within CELLS_PER_RADIUS of each of them. Indices are positions in the
+    cell-sorted order; query indices are offsets into the batch.
+    """
+    queries, candidates = [], []
+    reach = range(-CELLS_PER_RADIUS, CELLS_PER_RADIUS + 1)
+    for dy in reach:
+        for dx in reach:
+            neighbour = batch_keys + dy * cols + dx
+            slot = np.searchsorted(cell_keys, neighbour)
+            slot = np.minimum(slot, len(cell_keys) - 1)
+            found = cell_keys[slot] == neighbour
+            counts = np.where(found, cell_counts[slot], 0)
+            starts = cell_starts[slot]
+
+            # Expand each query into `count` consecutive candidate indices
+            query = np.repeat(np.arange(len(batch_keys)), counts)
+            offsets = np.arange(len(query)) - np.repeat(np.cumsum(counts) - counts, counts)
+            queries.append(query)
+            candidates.append(np.repeat(starts, counts) + offsets)
+    return np.concatenate(queries), np.concatenate(candidates)
+
+
+def terrain_normals(points, radius=None, workers=None):
+    """
+    Estimates unit normals for an (N, 3) array of points: the smallest
+    principal axis of the points within `radius` (3D distance) of each
+    point, flipped to point towards +Z. radius defaults to RADIUS_SPACINGS
+    times the mean point spacing. Batches run on `workers` threads.
+    Returns an (N, 3) float64 array.
+    """
+    radius = radius or RADIUS_SPACINGS * mean_spacing(points)
+    order, keys, cell_keys, cell_starts, cell_counts, cols = _cell_index(points, radius / CELLS_PER_RADIUS)
+    # One contiguous float64 column per axis, in cell order
+    columns = [np.asarray(points[:, axis], dtype=np.float64)[order] for axis in range(3)]
+    normals = np.empty((len(points), 3), dtype=np.float64)
+
+    # Size batches so the expected number of neighbour pairs stays bounded
+    mean_candidates = (2 * CELLS_PER_RADIUS + 1) ** 2 * len(points) / len(cell_keys)
+    batch = max(1024, int(PAIRS_PER_BATCH / mean_candidates))
+    radius_sq = radius * radius
+
+    def solve(first):
+        last = min(first + batch, len(points))
+        size = last - first
+        query, candidate = _neighbour_pairs(keys[first:last], cell_keys, cell_starts, cell_counts, cols)
+
+        # Offsets from the query point keep the moments well conditioned even
+        # for absolute projected coordinates
+        d = [column.take(candidate) - column[first:last].take(query) for column in columns]
+        near = d[0] * d[0] + d[1] * d[1] + d[2] * d[2] <= radius_sq
+        query = query[near]
+        d = [component[near] for component in d]
+
+        count = np.bincount(query, minlength=size).astype(np.float64)
+        safe = np.maximum(count, 1.0)
+        mean = [np.bincount(query, weights=component, minlength=size) / safe for component in d]
+        cov = np.empty((size, 3, 3))
+        for a in range(3):
+            for b in range(a, 3):
+                cov[:, a, b] = np.bincount(query, weights=d[a] * d[b], minlength=size) / safe
+                cov[:, a, b] -= mean[a] * mean[b]
+                cov[:, b, a] = cov[:, a, b]
+
+        # eigh sorts eigenvalues ascending: column 0 is the surface normal
+        _, vectors = np.linalg.eigh(cov)
+        batch_normals = vectors[:, :, 0]
+        batch_normals[count < MIN_NEIGHBOURS] = (0.0, 0.0, 1.0)
+        batch_normals[batch_normals[:, 2] < 0] *= -1
+        normals[order[first:last]] = batch_normals
+
+    # Batches write disjoint rows; NumPy releases the GIL for most of the work
+    with ThreadPoolExecutor(max_workers=workers or min(MAX_WORKERS, os.cpu_count() or 1)) as pool:
+        list(pool.map(solve, range(0, len(points), batch)))
+
+    print(f"Terrain normals: {len(points)} points, radius {radius:.3f}, "
+          f"{mean_candidates:.1f} candidates per point")
+    return normals
+
+
+def estimate_normals(pcd, points, engine="terrain", workers=None):
+    """
+    Fills in pcd.normals with the selected engine: "terrain" (grid-hashed
+    PCA oriented to +Z, on `workers` threads) or "open3d" (Open3D's hybrid
+    search with the consistent tangent plane orientation).
+    """
+    import open3d as o3d
+
+    if engine == "terrain":
+        pcd.normals = o3d.utility.Vector3dVector(terrain_normals(points, workers=workers))
+    elif engine == "open3d":
+        pcd.estimate_normals(
+            search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.5, max_nn=30)
+        )
+
+        # Orient the normals consistently
+        # This ensures all normals point "outward" from the surface
+        pcd.orient_normals_consistent_tangent_plane(100)
+    else:
+        raise ValueError(f"Unknown normal engine {engine!r}, expected one of {NORMAL_ENGINES}")
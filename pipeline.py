@@ -0,0 +1,746 @@
+# pipeline.py
+#
+# The LAZ + GeoTIFF -> textured terrain pipeline as an importable API. Point
+# ingestion, alignment, meshing and texture preparation hand NumPy arrays and
+# Open3D meshes to each other in memory through a StageGraph; files are only
+# written by the sinks a caller asks for (a native FBX, a Blender job, a
+# debug OBJ) and by the stage cache when one is given. main.py and batch.py
+# are thin wrappers around it.
+#
+#   from pipeline import Pipeline
+#   pipeline = Pipeline(mesher="grid", texture_mode="direct")
+#   result = pipeline.run(laz="tile.laz", tif="ortho.tif")
+#   result.mesh, result.texture, result.uvs()
+#   pipeline.write_fbx(result, "tile.fbx")
+#
+# Pre-loaded inputs skip the readers: run(points=xyz, points_crs="EPSG:32633",
+# image=rgb, image_bounds=(...), image_crs="EPSG:32633").
+
+import io
+import json
+import os
+import shutil
+import time
+from functools import partial
+from pathlib import Path
+from types import SimpleNamespace
+
+import numpy as np
+import open3d as o3d
+from PIL import Image
+from pyproj import CRS
+
+from point_cloud_processor import DEFAULT_CHUNK_SIZE
+from laz_index import select_tiles, tiles_metadata, read_laz_tiles
+from point_store import ensure_store
+from texture_processor import (read_geotiff_texture, read_geotiff_metadata, read_direct_texture, snapped_bounds,
+                               crop_texture, texture_difference_report, plan_texture_tiles, write_texture_tiles,
+                               sample_vertex_colors, MAX_TEXTURE_RES)
+from aoi import parse_aoi, transform_aoi, resolve_aoi, points_in_aoi
+from coordinate_transformer import align_coordinates, local_origin, transform_origin
+from mesh_generator import (generate_mesh_from_points, generate_tiled_mesh, save_intermediate_mesh,
+                            compute_planar_uvs, mesh_from_arrays, simplify_lod_chain, check_lod_ratios,
+                            print_lod_report, partition_mesh, POISSON_DEPTH)
+from reconstruction_planner import plan_reconstruction, log_outcome
+from mesh_io import write_binary_mesh
+from grid_mesher import generate_grid_mesh, generate_grid_lods
+from fbx_writer import write_fbx, write_fbx_lods, write_fbx_tiles
+from stage_cache import file_identity, save_arrays, load_arrays, save_json, load_json
+from profiling import stage, RssSampler
+from stage_graph import StageGraph
+
+# Pipeline options and their defaults; main.py's flags of the same names map onto these
+PIPELINE_DEFAULTS = {
+    "stream": False,
+    "chunk_size": DEFAULT_CHUNK_SIZE,
+    "laz_workers": None,
+    "point_store": None,
+    "sample_spacing": None,
+    "point_budget": None,
+    "mesher": "poisson",
+    "normals": "terrain",
+    "normals_workers": None,
+    "target_triangles": 100000,
+    "grid_cell": None,
+    "grid_z": "mean",
+    "lod_ratios": None,
+    "tile_size": None,
+    "tile_overlap": 10.0,
+    "tile_workers": None,
+    "memory_budget": None,
+    "planner_log": None,
+    "no_rebase": False,
+    "color_mode": "texture",
+    "texture_mode": "bake",
+    "texture_res": MAX_TEXTURE_RES,
+    "texture_tile_res": None,
+    "texture_scale": 1.0,
+    "texture_workers": None,
+    "texture_percentile": None,
+    "compare_baked": None,
+    "aoi": None,
+    "aoi_crs": None,
+    "cache_hash": False,
+}
+
+
+# --- Stage cache (de)serialisers ---
+
+def _save_points(result, entry_dir):
+    points, crs = result
+    save_arrays(entry_dir, points=points)
+    save_json(entry_dir, "crs", {"wkt": crs.to_wkt()})
+
+def _load_points(entry_dir):
+    points, = load_arrays(entry_dir, "points")
+    return points, CRS.from_wkt(load_json(entry_dir, "crs")["wkt"])
+
+def _save_image(image, entry_dir):
+    Image.fromarray(image).save(os.path.join(entry_dir, "texture.png"))
+
+def _load_image(entry_dir):
+    with Image.open(os.path.join(entry_dir, "texture.png")) as img:
+        return np.asarray(img)
+
+def _save_texture(result, entry_dir):
+    image, bounds = result
+    _save_image(image, entry_dir)
+    save_json(entry_dir, "texture", {"bounds": list(bounds)})
+
+def _load_texture(entry_dir):
+    return _load_image(entry_dir), tuple(load_json(entry_dir, "texture")["bounds"])
+
+def _save_texture_tiles(tiles, entry_dir):
+    for tile in tiles:
+        shutil.copyfile(tile["texture"], os.path.join(entry_dir, f"{tile['name']}.png"))
+    save_json(entry_dir, "tiles", tiles)
+
+def _load_texture_tiles(work_dir, entry_dir):
+    tiles = load_json(entry_dir, "tiles")
+    for tile in tiles:
+        tile["texture"] = str((work_dir / f"{tile['name']}.png").resolve())
+        shutil.copyfile(os.path.join(entry_dir, f"{tile['name']}.png"), tile["texture"])
+    return tiles
+
+def _save_lods(lods, entry_dir):
+    for level, mesh in enumerate(lods):
+        save_arrays(entry_dir, **{f"vertices{level}": np.asarray(mesh.vertices),
+                                  f"triangles{level}": np.asarray(mesh.triangles)})
+    save_json(entry_dir, "lods", {"count": len(lods)})
+
+def _load_lods(entry_dir):
+    count = load_json(entry_dir, "lods")["count"]
+    return [mesh_from_arrays(*load_arrays(entry_dir, f"vertices{level}", f"triangles{level}"))
+            for level in range(count)]
+
+def _save_colors(result, entry_dir):
+    colors, bounds = result
+    save_arrays(entry_dir, **{f"colors{level}": level_colors for level, level_colors in enumerate(colors)})
+    save_json(entry_dir, "colors", {"count": len(colors), "bounds": list(bounds)})
+
+def _load_colors(entry_dir):
+    meta = load_json(entry_dir, "colors")
+    return load_arrays(entry_dir, *(f"colors{level}" for level in range(meta["count"]))), tuple(meta["bounds"])
+
+
+def normalize_options(options):
+    """Validates option combinations and applies the ones implied by others; options is updated in place."""
+    if options.lod_ratios:
+        check_lod_ratios(options.lod_ratios)
+    if options.color_mode == "vertex" and (options.texture_tile_res or options.compare_baked):
+        raise ValueError("--color-mode vertex writes no texture; drop --texture-tile-res and --compare-baked.")
+    if options.texture_tile_res:
+        if options.lod_ratios:
+            raise ValueError("--texture-tile-res cannot be combined with --lod-ratios.")
+        if options.texture_mode != "direct":
+            print("Texture tiles are cut straight from the GeoTIFF; using --texture-mode direct.")
+            options.texture_mode = "direct"
+    return options
+
+
+def _image_pixels(path):
+    with Image.open(path) as img:
+        return img.width * img.height
+
+
+def _png_bytes(image):
+    buffer = io.BytesIO()
+    Image.fromarray(image).save(buffer, format="PNG")
+    return buffer.getvalue()
+
+
+def _shift_bounds(bounds, origin):
+    """Expresses (min_x, min_y, max_x, max_y) bounds relative to a local origin."""
+    return (bounds[0] - origin[0], bounds[1] - origin[1], bounds[2] - origin[0], bounds[3] - origin[1])
+
+
+def write_geo_metadata(fbx_path, origin, crs, texture_bounds):
+    """
+    Writes <fbx>.geo.json next to the FBX: the local origin the geometry is
+    relative to, its CRS and the texture's world bounds, so the tile can be
+    placed back in world coordinates.
+    """
+    path = Path(fbx_path).with_suffix(".geo.json")
+    with open(path, "w") as f:
+        json.dump({"origin": [float(v) for v in origin], "crs": crs.to_wkt(),
+                   "texture_bounds": [float(b) for b in texture_bounds]}, f, indent=2)
+    print(f"Georeferencing metadata saved to {path}")
+
+
+def _footprint(lods, origin):
+    """World (min_x, min_y, max_x, max_y) of LOD0, whose vertices are relative to origin."""
+    box = lods[0].get_axis_aligned_bounding_box()
+    low, high = box.get_min_bound() + origin, box.get_max_bound() + origin
+    return low[0], low[1], high[0], high[1]
+
+
+def run_stage_graph(graph):
+    """Runs the stage graph and prints its timeline, also when a stage fails."""
+    try:
+        return graph.run()
+    finally:
+        graph.print_timeline()
+
+
+class PipelineResult:
+    """
+    What Pipeline.run produced. Geometry is in the orthophoto's crs, as
+    offsets from origin ((0, 0, 0) with no_rebase).
+
+    points: the aligned (N, 3) points, or None when the mesh came from the cache
+    lods: Open3D meshes, LOD0 first; a single mesh without LOD ratios
+    texture: (H, W, 3) or (H, W) uint8 image; None with texture tiles or
+        vertex colours
+    texture_bounds: world (min_x, min_y, max_x, max_y) covered by the texture
+        (or the tile grid), which the UVs are projected against
+    tiles: with texture tiles, dicts of name, vertices, triangles, texture
+        (the PNG path) and texture_bounds, one per tile
+    colors: with color_mode "vertex", (N, 3) uint8 vertex colours per LOD level
+    """
+
+    def __init__(self, points, lods, texture, texture_bounds, origin, crs, tiles=None, colors=None):
+        self.points = points
+        self.lods = lods
+        self.texture = texture
+        self.texture_bounds = texture_bounds
+        self.origin = origin
+        self.crs = crs
+        self.tiles = tiles
+        self.colors = colors
+
+    @property
+    def mesh(self):
+        return self.lods[0]
+
+    @property
+    def local_texture_bounds(self):
+        """texture_bounds relative to origin, the frame the geometry is in."""
+        return _shift_bounds(self.texture_bounds, self.origin)
+
+    def uvs(self, level=0):
+        """Planar (N, 2) UVs of one LOD level against the texture."""
+        return compute_planar_uvs(np.asarray(self.lods[level].vertices), self.local_texture_bounds)
+
+
+class Pipeline:
+    """
+    Runs the pipeline stages in memory. Options are the PIPELINE_DEFAULTS
+    keys. cache is an optional StageCache for the stage outputs and
+    profiler an optional StageProfiler recording every stage.
+    """
+
+    def __init__(self, cache=None, profiler=None, **options):
+        unknown = set(options) - set(PIPELINE_DEFAULTS)
+        if unknown:
+            raise TypeError(f"Unknown pipeline options: {', '.join(sorted(unknown))}")
+        self.options = normalize_options(SimpleNamespace(**{**PIPELINE_DEFAULTS, **options}))
+        self.cache = cache if cache is not None and cache.enabled else None
+        self.profiler = profiler
+
+    @classmethod
+    def from_args(cls, args, cache=None, profiler=None):
+        """A pipeline configured from parsed command-line arguments (see main.add_pipeline_arguments)."""
+        return cls(cache, profiler, **{name: getattr(args, name) for name in PIPELINE_DEFAULTS})
+
+    def _key(self, stage_name, inputs, **params):
+        """The cache key of a stage, or None (not cached) without a cache or when an input has no identity."""
+        if self.cache is None or any(value is None for value in inputs.values()):
+            return None
+        return self.cache.key(stage_name, **inputs, **params)
+
+    def _cached(self, stage_name, key, compute, save, load):
+        if key is None:
+            return compute()
+        return self.cache.run(stage_name, key, compute, save, load)
+
+    def _contains(self, key):
+        return key is not None and self.cache.contains(key)
+
+    def run(self, laz=None, tif=None, points=None, points_crs=None, image=None, image_bounds=None,
+            image_crs=None, work_dir=None):
+        """
+        Runs every stage and returns a PipelineResult.
+
+        The points come from laz (a LAZ file, or a directory or glob of
+        tiles) or from points, an (N, 3) array of absolute coordinates in
+        points_crs that is meshed as given. The texture comes from tif or
+        from image, an (H, W[, 3]) uint8 array covering image_bounds in
+        image_crs with row 0 at max Y. Texture tiles are cut from tif into
+        work_dir and need both. Stages fed by arrays are not cached.
+        """
+        opts = self.options
+        if (laz is None) == (points is None):
+            raise ValueError("Pass either laz or points.")
+        if (tif is None) == (image is None):
+            raise ValueError("Pass either tif or image.")
+        if points is not None and points_crs is None:
+            raise ValueError("points need a points_crs.")
+        if image is not None and (image_bounds is None or image_crs is None):
+            raise ValueError("image needs image_bounds and image_crs.")
+        if opts.texture_tile_res and (tif is None or work_dir is None):
+            raise ValueError("Texture tiles are cut from a GeoTIFF file into work_dir; pass tif and work_dir.")
+
+        # --- STAGE 1: DATA INGESTION AND ALIGNMENT ---
+        print("--- STAGE 1: PROCESSING GEOSPATIAL DATA ---")
+        inputs = self._resolve_inputs(laz, tif, points, points_crs, image, image_bounds, image_crs, work_dir)
+        keys = self._stage_keys(inputs)
+        results = run_stage_graph(self._stage_graph(inputs, keys))
+        return self._result(inputs, results)
+
+    def _resolve_inputs(self, laz, tif, points, points_crs, image, image_bounds, image_crs, work_dir):
+        """
+        Reads the input headers and settles what every stage shares, as a
+        namespace: the sources (laz_tiles or points, tif or image) with
+        their cache identities, CRSs and bounds, the AOI in the raster's CRS
+        and laz_crop in the LAZ's, the origins and work_dir.
+        """
+        opts = self.options
+        if tif is not None:
+            tif = str(Path(tif).resolve())
+            tif_id = file_identity(tif, opts.cache_hash) if self.cache else None
+            # Only the metadata is read up front; the texture itself is a stage
+            # of its own that overlaps with the point and mesh stages
+            tif_crs, tif_bounds = read_geotiff_metadata(tif)
+        else:
+            tif_id = None
+            tif_crs, tif_bounds = CRS(image_crs), tuple(image_bounds)
+            image = np.asarray(image, dtype=np.uint8)
+
+        user_aoi = parse_aoi(opts.aoi) if isinstance(opts.aoi, str) else opts.aoi
+        laz_tiles = None
+        if laz is not None:
+            # laz may be a directory or glob of tiles; only those overlapping
+            # the orthophoto and the user's area of interest are read
+            area = list(tif_bounds)
+            if user_aoi:
+                user_bounds = transform_aoi(user_aoi, opts.aoi_crs or tif_crs, tif_crs)["bounds"]
+                area = [max(area[0], user_bounds[0]), max(area[1], user_bounds[1]),
+                        min(area[2], user_bounds[2]), min(area[3], user_bounds[3])]
+            laz_tiles = select_tiles(laz, tif_crs, area)
+            laz_id = [file_identity(path, opts.cache_hash) for path, _ in laz_tiles] if self.cache else None
+            laz_crs, laz_bounds = tiles_metadata(laz_tiles)
+        else:
+            laz_id = None
+            laz_crs = CRS(points_crs)
+            points = np.asarray(points, dtype=np.float64)
+            laz_bounds = (*points[:, :2].min(axis=0), *points[:, :2].max(axis=0))
+
+        # Both readers only decode the area of interest: the overlap of the
+        # LAZ and the raster, narrowed by the user's AOI. aoi is in the
+        # raster's CRS, laz_crop in the LAZ's.
+        with stage(self.profiler, "aoi"):
+            aoi = resolve_aoi(tif_crs, tif_bounds, laz_crs, laz_bounds, user_aoi, opts.aoi_crs)
+            laz_crop = transform_aoi(aoi, tif_crs, laz_crs)
+
+        # The origins only depend on the LAZ headers and the AOI, so they are
+        # known even when every point stage is served from the cache
+        if opts.no_rebase:
+            source_origin = target_origin = None
+        else:
+            source_origin = local_origin(laz_crop["bounds"])
+            target_origin = transform_origin(source_origin, laz_crs, tif_crs)
+            print(f"Local origin: {target_origin}")
+
+        return SimpleNamespace(laz_tiles=laz_tiles, laz_id=laz_id, laz_crs=laz_crs, points=points,
+                               tif=tif, tif_id=tif_id, tif_crs=tif_crs, tif_bounds=tif_bounds, image=image,
+                               aoi=aoi, laz_crop=laz_crop, source_origin=source_origin,
+                               target_origin=target_origin, origin=target_origin or (0.0, 0.0, 0.0),
+                               work_dir=work_dir)
+
+    def _stage_keys(self, inputs):
+        """The cache keys of the point, alignment and mesh stages ({"points", "aligned", "mesh"})."""
+        opts = self.options
+        # Points are only ingested and aligned when the mesh is not cached
+        points_params = {"stream": opts.stream, "origin": inputs.source_origin, "spacing": opts.sample_spacing,
+                         "budget": opts.point_budget, "crop": inputs.laz_crop}
+        if opts.point_store:
+            # The store keeps points grouped by class, which can change the point picked per voxel
+            points_params["store"] = True
+        points_key = self._key("points", {"laz": inputs.laz_id}, **points_params)
+        aligned_key = self._key("aligned", {"points": points_key}, target_crs=inputs.tif_crs.to_wkt(),
+                                target_origin=inputs.target_origin)
+        mesh_params = {"mesher": opts.mesher, "target_triangles": opts.target_triangles,
+                       "lod_ratios": opts.lod_ratios}
+        if opts.mesher == "grid":
+            mesh_params.update(grid_cell=opts.grid_cell, grid_z=opts.grid_z)
+        else:
+            mesh_params["normals"] = opts.normals
+            if opts.memory_budget:
+                mesh_params["memory_budget"] = opts.memory_budget
+            if opts.tile_size:
+                mesh_params.update(tile_size=opts.tile_size, tile_overlap=opts.tile_overlap)
+            if opts.tile_size or opts.memory_budget:
+                # Tiles are decimated in their workers, not once after stitching
+                mesh_params["tile_decimation"] = "tile"
+        mesh_key = self._key("mesh", {"aligned": aligned_key}, **mesh_params)
+        return {"points": points_key, "aligned": aligned_key, "mesh": mesh_key}
+
+    def _stage_graph(self, inputs, keys):
+        """The stages this run needs, wired into a StageGraph."""
+        opts = self.options
+        graph = StageGraph()
+        if opts.color_mode == "texture" and opts.texture_mode != "direct":
+            # Direct textures are cut once the mesh footprint is known
+            graph.add("texture", partial(self._bake_texture, inputs))
+
+        # Point stages only join the graph when the stages after them are not cached
+        build_mesh = partial(self._build_mesh, inputs, keys)
+        if self._contains(keys["mesh"]):
+            graph.add("mesh", build_mesh)
+        else:
+            align = partial(self._align, inputs, keys)
+            if self._contains(keys["aligned"]):
+                graph.add("align", align)
+            else:
+                graph.add("points", partial(self._read_points, inputs, keys["points"]))
+                graph.add("align", align, ["points"])
+            # The planner's measurements are per process, so a planned
+            # reconstruction runs alone to keep its calibration records clean
+            graph.add("mesh", build_mesh, ["align"],
+                      exclusive=bool(opts.mesher == "poisson" and opts.memory_budget))
+
+        if opts.color_mode == "vertex":
+            graph.add("texture", partial(self._vertex_colors, inputs, keys["mesh"]), ["mesh"])
+        elif opts.texture_tile_res:
+            graph.add("texture", partial(self._texture_tiles, inputs, keys["mesh"]), ["mesh"])
+        elif opts.texture_mode == "direct":
+            graph.add("texture", partial(self._direct_texture, inputs, keys["mesh"]), ["mesh"])
+        return graph
+
+    def _result(self, inputs, results):
+        opts = self.options
+        texture, texture_bounds = results["texture"]
+        if opts.color_mode == "vertex":
+            return PipelineResult(results.get("align"), results["mesh"], None, texture_bounds, inputs.origin,
+                                  inputs.tif_crs, colors=texture)
+        if opts.texture_tile_res:
+            return PipelineResult(results.get("align"), results["mesh"], None, texture_bounds, inputs.origin,
+                                  inputs.tif_crs, tiles=texture)
+        return PipelineResult(results.get("align"), results["mesh"], texture, texture_bounds, inputs.origin,
+                              inputs.tif_crs)
+
+    # --- Stages ---
+
+    def _read_points(self, inputs, points_key):
+        """The cropped points in the LAZ's CRS, relative to the source origin, and that CRS."""
+        opts = self.options
+        if inputs.laz_tiles is None:
+            # Pre-loaded points are only cropped and moved to the local
+            # origin; both copy, which keeps align_coordinates off the
+            # caller's array
+            points = inputs.points
+            cropped = points[points_in_aoi(points[:, 0], points[:, 1], inputs.laz_crop)]
+            if inputs.source_origin is None:
+                return cropped, inputs.laz_crs
+            return (cropped - inputs.source_origin).astype(np.float32), inputs.laz_crs
+
+        def compute():
+            if opts.point_store:
+                # Tiles are ingested one after the other, each on its own pool of chunk decoders
+                with stage(self.profiler, "ingest", tiles=len(inputs.laz_tiles)):
+                    for path, _ in inputs.laz_tiles:
+                        ensure_store(path, opts.point_store, opts.laz_workers)
+            return read_laz_tiles(inputs.laz_tiles, stream=opts.stream, chunk_size=opts.chunk_size,
+                                  origin=inputs.source_origin, spacing=opts.sample_spacing,
+                                  point_budget=opts.point_budget, workers=opts.laz_workers,
+                                  crop=inputs.laz_crop, store_dir=opts.point_store)
+
+        with stage(self.profiler, "points", input_bytes=sum(entry["size"] for _, entry in inputs.laz_tiles),
+                   tiles=len(inputs.laz_tiles)) as record:
+            result = self._cached("points", points_key, compute, _save_points, _load_points)
+            record["points"] = len(result[0])
+        return result
+
+    def _align(self, inputs, keys, points_and_crs=None):
+        """The points in the raster's CRS; read first when points_and_crs is not given."""
+        def compute():
+            cloud, crs = points_and_crs or self._read_points(inputs, keys["points"])
+            with stage(self.profiler, "align", points=len(cloud)):
+                return align_coordinates(cloud, crs, inputs.tif_crs, inputs.source_origin, inputs.target_origin)
+        return self._cached(
+            "aligned", keys["aligned"], compute,
+            lambda aligned, entry_dir: save_arrays(entry_dir, points=aligned),
+            lambda entry_dir: load_arrays(entry_dir, "points")[0],
+        )
+
+    def _reconstruct(self, aligned_points, mesher, depth, tile_size, workers, stats=None):
+        """Returns the LOD chain, LOD0 first; a single mesh when no LOD ratios are set."""
+        opts = self.options
+        if mesher == "grid":
+            if opts.lod_ratios:
+                lods = generate_grid_lods(aligned_points, opts.lod_ratios, cell_size=opts.grid_cell,
+                                          z_mode=opts.grid_z, target_triangles=opts.target_triangles)
+                print_lod_report(lods, opts.lod_ratios)
+                return [mesh for mesh, _ in lods]
+            return [generate_grid_mesh(aligned_points, cell_size=opts.grid_cell, z_mode=opts.grid_z,
+                                       target_triangles=opts.target_triangles)]
+        if tile_size:
+            mesh = generate_tiled_mesh(aligned_points, tile_size, opts.tile_overlap, workers=workers,
+                                       depth=depth, target_triangles=opts.target_triangles,
+                                       normals=opts.normals, stats=stats, normals_workers=opts.normals_workers)
+        else:
+            mesh = generate_mesh_from_points(aligned_points, depth=depth, target_triangles=opts.target_triangles,
+                                             profiler=self.profiler, normals=opts.normals,
+                                             normals_workers=opts.normals_workers)
+        if opts.lod_ratios:
+            lods = simplify_lod_chain(mesh, opts.lod_ratios)
+            print_lod_report(lods, opts.lod_ratios)
+            return [mesh for mesh, _ in lods]
+        return [mesh]
+
+    def _build_lods(self, aligned_points):
+        opts = self.options
+        if opts.mesher != "poisson" or not opts.memory_budget:
+            return self._reconstruct(aligned_points, opts.mesher, POISSON_DEPTH, opts.tile_size, opts.tile_workers)
+
+        # Let the planner pick depth, tiling or the grid mesher, then log
+        # its predictions against what the reconstruction really took
+        plan = plan_reconstruction(aligned_points, opts.memory_budget, opts.tile_size, opts.tile_overlap,
+                                   opts.tile_workers, opts.planner_log)
+        stats = {}
+        start = time.perf_counter()
+        with RssSampler() as memory:
+            lods = self._reconstruct(aligned_points, plan["mesher"], plan["depth"], plan["tile_size"],
+                                     plan["workers"], stats)
+        if plan["tile_size"]:
+            stitch_mb = stats.get("stitch_peak_mb")
+            if stitch_mb is not None and stitch_mb > plan["budget_mb"]:
+                print(f"WARNING: stitching the tiles took {stitch_mb:.0f} MiB in the parent, over the "
+                      f"{plan['budget_mb']:.0f} MiB budget; lower --target-triangles.")
+            peaks = [peak for peak in stats["tile_peak_mb"] if peak is not None]
+            log_outcome(plan, max(peaks) if peaks else None, float(np.mean(stats["tile_seconds"])),
+                        opts.planner_log)
+        else:
+            log_outcome(plan, memory.peak_mb, time.perf_counter() - start, opts.planner_log)
+        return lods
+
+    def _build_mesh(self, inputs, keys, aligned_points=None):
+        """The LOD chain, from the cache or reconstructed from the aligned points (aligned first when not given)."""
+        def compute():
+            return self._build_lods(aligned_points if aligned_points is not None else self._align(inputs, keys))
+
+        with stage(self.profiler, "mesh", mesher=self.options.mesher) as record:
+            lods = self._cached("mesh", keys["mesh"], compute, _save_lods, _load_lods)
+            record.update(vertices=len(lods[0].vertices), triangles=len(lods[0].triangles))
+            if len(lods) > 1:
+                record["lod_triangles"] = [len(lod.triangles) for lod in lods]
+        return lods
+
+    def _bake_texture(self, inputs):
+        """The raster over the AOI, read through a window; the UVs span the window's bounds."""
+        opts = self.options
+        if inputs.tif is None:
+            return crop_texture(inputs.image, inputs.tif_bounds, inputs.aoi["bounds"], opts.texture_res, margin=0)
+
+        def read():
+            image_data, _, image_bounds = read_geotiff_texture(inputs.tif, opts.texture_res, opts.texture_percentile,
+                                                               bounds=inputs.aoi["bounds"])
+            return image_data, image_bounds
+
+        texture_key = self._key("texture", {"tif": inputs.tif_id}, res=opts.texture_res,
+                                percentile=opts.texture_percentile, bounds=inputs.aoi["bounds"])
+        with stage(self.profiler, "texture", input_bytes=os.path.getsize(inputs.tif)) as record:
+            texture = self._cached("texture", texture_key, read, _save_texture, _load_texture)
+            record["pixels"] = texture[0].shape[0] * texture[0].shape[1]
+        return texture
+
+    def _direct_texture(self, inputs, mesh_key, lods):
+        """The raster cropped to the mesh footprint."""
+        opts = self.options
+        if inputs.tif is None:
+            texture = crop_texture(inputs.image, inputs.tif_bounds, _footprint(lods, inputs.origin), opts.texture_res)
+        else:
+            direct_key = self._key("direct_texture", {"tif": inputs.tif_id, "mesh": mesh_key}, res=opts.texture_res,
+                                   percentile=opts.texture_percentile)
+            with stage(self.profiler, "direct_texture") as record:
+                texture = self._cached(
+                    "direct_texture", direct_key,
+                    lambda: read_direct_texture(inputs.tif, _footprint(lods, inputs.origin),
+                                                max_res=opts.texture_res, percentile=opts.texture_percentile),
+                    _save_texture, _load_texture,
+                )
+                record["pixels"] = texture[0].shape[0] * texture[0].shape[1]
+        if opts.compare_baked:
+            # A bake covers the AOI as _bake_texture reads it
+            aoi_bounds = inputs.aoi["bounds"]
+            baked_bounds = snapped_bounds(inputs.tif, aoi_bounds) if inputs.tif is not None else aoi_bounds
+            texture_difference_report(texture[0], texture[1], opts.compare_baked, baked_bounds)
+        return texture
+
+    def _vertex_colors(self, inputs, mesh_key, lods):
+        """
+        Samples the raster under every vertex of every LOD level. The
+        raster is read over the mesh footprint at no more than texture_res
+        pixels, averaged down while reading; no texture image is kept.
+        """
+        opts = self.options
+
+        def sample():
+            if inputs.tif is None:
+                image_data, image_bounds = inputs.image, inputs.tif_bounds
+            else:
+                image_data, _, image_bounds = read_geotiff_texture(inputs.tif, opts.texture_res,
+                                                                   opts.texture_percentile,
+                                                                   bounds=_footprint(lods, inputs.origin))
+            local_bounds = _shift_bounds(image_bounds, inputs.origin)
+            colors = [sample_vertex_colors(image_data, local_bounds, np.asarray(lod.vertices)[:, :2])
+                      for lod in lods]
+            return colors, tuple(image_bounds)
+
+        colors_key = self._key("vertex_colors", {"tif": inputs.tif_id, "mesh": mesh_key}, res=opts.texture_res,
+                               percentile=opts.texture_percentile)
+        with stage(self.profiler, "vertex_colors", vertices=sum(len(lod.vertices) for lod in lods)):
+            return self._cached("vertex_colors", colors_key, sample, _save_colors, _load_colors)
+
+    def _texture_tiles(self, inputs, mesh_key, lods):
+        """
+        Splits the mesh footprint into texture tiles at texture_scale of
+        the GeoTIFF's resolution, cuts the mesh along the same lines and
+        writes one texture per tile into work_dir in parallel.
+        """
+        opts = self.options
+        origin, work_dir = inputs.origin, Path(inputs.work_dir)
+        vertices, triangles = np.asarray(lods[0].vertices), np.asarray(lods[0].triangles)
+        rows, cols, bounds = plan_texture_tiles(inputs.tif, _footprint(lods, origin), opts.texture_tile_res,
+                                                opts.texture_scale)
+        parts = partition_mesh(vertices, triangles, _shift_bounds(bounds, origin), rows, cols)
+        tiles = []
+        for row, col, tile_vertices, _ in parts:
+            # Each texture covers its tile's triangles, including any that spill over the tile lines
+            low = tile_vertices.min(axis=0) + origin
+            high = tile_vertices.max(axis=0) + origin
+            name = f"Tile_{row}_{col}"
+            tiles.append({"name": name,
+                          "footprint": [float(low[0]), float(low[1]), float(high[0]), float(high[1])],
+                          "texture": str((work_dir / f"{name}.png").resolve())})
+
+        tiles_key = self._key("texture_tiles", {"tif": inputs.tif_id, "mesh": mesh_key}, res=opts.texture_tile_res,
+                              scale=opts.texture_scale, percentile=opts.texture_percentile)
+        with stage(self.profiler, "texture_tiles", tiles=len(tiles)) as record:
+            tiles = self._cached(
+                "texture_tiles", tiles_key,
+                lambda: write_texture_tiles(inputs.tif, tiles, opts.texture_tile_res, opts.texture_scale,
+                                            opts.texture_percentile, opts.texture_workers),
+                _save_texture_tiles, partial(_load_texture_tiles, work_dir),
+            )
+            record["pixels"] = sum(_image_pixels(tile["texture"]) for tile in tiles)
+        for tile, (_, _, tile_vertices, tile_triangles) in zip(tiles, parts):
+            tile.update(vertices=tile_vertices, triangles=tile_triangles)
+        return tiles, bounds
+
+    # --- Sinks: the only stages that write output files ---
+
+    def write_fbx(self, result, fbx_path):
+        """
+        Writes result as an FBX with the native writer, textures embedded
+        (or vertex colours and no image), and its .geo.json.
+        """
+        print("\n--- STAGE 3: WRITING FBX WITHOUT BLENDER ---")
+        fbx_path = Path(fbx_path).resolve()
+        local_bounds = result.local_texture_bounds
+        with stage(self.profiler, "native_export") as record:
+            if result.colors is not None:
+                if len(result.lods) > 1:
+                    levels = [(np.asarray(lod.vertices), np.asarray(lod.triangles), None) for lod in result.lods]
+                    write_fbx_lods(str(fbx_path), levels, colors=result.colors)
+                else:
+                    write_fbx(str(fbx_path), np.asarray(result.mesh.vertices), np.asarray(result.mesh.triangles),
+                              colors=result.colors[0])
+            elif result.tiles:
+                meshes = []
+                for tile in result.tiles:
+                    tile_bounds = _shift_bounds(tile["texture_bounds"], result.origin)
+                    meshes.append((tile["name"], tile["vertices"], tile["triangles"],
+                                   compute_planar_uvs(tile["vertices"], tile_bounds), tile["texture"]))
+                write_fbx_tiles(str(fbx_path), meshes)
+            else:
+                texture = ("texture.png", _png_bytes(result.texture))
+                if len(result.lods) > 1:
+                    # Every level is projected against the same bounds, so they share one UV layout
+                    levels = [(np.asarray(lod.vertices), np.asarray(lod.triangles), result.uvs(level))
+                              for level, lod in enumerate(result.lods)]
+                    write_fbx_lods(str(fbx_path), levels, texture_path=texture)
+                else:
+                    write_fbx(str(fbx_path), np.asarray(result.mesh.vertices), np.asarray(result.mesh.triangles),
+                              uvs=compute_planar_uvs(np.asarray(result.mesh.vertices), local_bounds),
+                              texture_path=texture)
+            record["output_bytes"] = fbx_path.stat().st_size
+        write_geo_metadata(fbx_path, result.origin, result.crs, result.texture_bounds)
+
+    def write_blender_job(self, result, job_dir, fbx_path):
+        """
+        Writes the meshes and textures blender_processor.py reads into
+        job_dir, and the FBX's .geo.json, and returns the job description.
+        """
+        job_dir = Path(job_dir).resolve()
+        fbx_path = Path(fbx_path).resolve()
+        write_geo_metadata(fbx_path, result.origin, result.crs, result.texture_bounds)
+
+        if result.tiles:
+            listing = []
+            for tile in result.tiles:
+                mesh_path = job_dir / f"{tile['name']}.bin"
+                write_binary_mesh(str(mesh_path), tile["vertices"], tile["triangles"])
+                listing.append({"name": tile["name"], "mesh": str(mesh_path), "texture": tile["texture"],
+                                "bounds": [float(b) for b in _shift_bounds(tile["texture_bounds"], result.origin)]})
+            tiles_path = job_dir / "tiles.json"
+            with open(tiles_path, "w") as f:
+                json.dump(listing, f, indent=2)
+            return {"tiles": str(tiles_path), "fbx": str(fbx_path), "texture_mode": "direct"}
+
+        # One intermediate file per LOD level: mesh.bin, or mesh_lod0.bin .. mesh_lodN.bin
+        if len(result.lods) > 1:
+            mesh_paths = [job_dir / f"mesh_lod{level}.bin" for level in range(len(result.lods))]
+        else:
+            mesh_paths = [job_dir / "mesh.bin"]
+
+        if result.colors is not None:
+            # Vertex colours travel as one .npy per level next to the meshes; Blender writes no image
+            color_paths = [path.with_suffix(".colors.npy") for path in mesh_paths]
+            with stage(self.profiler, "save_mesh") as record:
+                for lod, colors, path, color_path in zip(result.lods, result.colors, mesh_paths, color_paths):
+                    save_intermediate_mesh(lod, str(path))
+                    np.save(color_path, colors)
+                record["output_bytes"] = sum(path.stat().st_size for path in mesh_paths + color_paths)
+            return {"mesh": [str(path) for path in mesh_paths], "colors": [str(path) for path in color_paths],
+                    "fbx": str(fbx_path)}
+
+        texture_path = job_dir / "texture.png"
+        with stage(self.profiler, "save_mesh") as record:
+            for lod, path in zip(result.lods, mesh_paths):
+                save_intermediate_mesh(lod, str(path))
+            Image.fromarray(result.texture).save(texture_path)
+            record["output_bytes"] = sum(path.stat().st_size for path in mesh_paths)
+        return {
+            "mesh": [str(path) for path in mesh_paths],
+            "texture": str(texture_path),
+            "baked_texture": str(job_dir / "baked_texture.png"),
+            "fbx": str(fbx_path),
+            "bounds": [float(b) for b in result.local_texture_bounds],
+            "texture_mode": self.options.texture_mode,
+        }
+
+    def write_debug_obj(self, result, obj_path):
+        """Writes LOD0 as an ASCII OBJ for inspection."""
+        o3d.io.write_triangle_mesh(str(obj_path), result.mesh, write_ascii=True)
+        print(f"Debug OBJ saved to {obj_path}")
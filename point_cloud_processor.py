@@ -1,25 +1,182 @@
 # point_cloud_processor.py
 
+import time
+
 import laspy
 import pdal
 import numpy as np
 
-def process_point_cloud(laz_path):
+from profiling import peak_rss_mb
+from aoi import aoi_pdal_crops, points_in_aoi
+from point_store import open_store, iter_class_chunks
+
+# Classifications kept by the pipeline: ground (2), high vegetation (5) and buildings (6).
+# Everything else, including noise (7), is dropped.
+KEEP_CLASSES = (2, 5, 6)
+
+# Default sampling voxel size in multiples of the header's mean point spacing;
+# on open ground this keeps roughly one point in four, like the old step
+# decimation, but thins dense canopy far more than sparse ground
+DEFAULT_SPACING_FACTOR = 2.0
+
+# Bits per voxel axis in the sampling keys: 2 x 21 Morton-interleaved XY bits
+# followed by 21 bits of Z layer fit in one uint64
+VOXEL_BITS = 21
+
+# Number of points decoded per chunk in streaming mode
+DEFAULT_CHUNK_SIZE = 1_000_000
+
+
+def _report_throughput(label, point_count, elapsed):
+    rate = point_count / elapsed if elapsed > 0 else float("inf")
+    rss = peak_rss_mb()
+    rss_text = f"{rss:.1f} MiB" if rss is not None else "n/a"
+    print(f"{label}: {point_count} points in {elapsed:.2f}s "
+          f"({rate:,.0f} points/sec), peak RSS {rss_text}")
+
+
+def header_density(header):
+    """Points per square CRS unit over the header's XY bounding box."""
+    area = max((header.maxs[0] - header.mins[0]) * (header.maxs[1] - header.mins[1]), 1e-12)
+    return header.point_count / area
+
+
+def sampling_spacing(header, spacing=None, point_budget=None):
+    """
+    Voxel size for sample_points. An explicit spacing wins; a point budget
+    is turned into the spacing that spreads that many points evenly over the
+    header's footprint; otherwise DEFAULT_SPACING_FACTOR times the mean
+    spacing implied by the header's point density. Raises ValueError when
+    the header has no points or no XY extent to derive a spacing from.
+    """
+    if spacing:
+        return float(spacing)
+    area = (header.maxs[0] - header.mins[0]) * (header.maxs[1] - header.mins[1])
+    if header.point_count == 0 or area <= 0:
+        raise ValueError(f"Cannot derive a sampling spacing from a header with {header.point_count} points "
+                         f"over {area} square units; pass an explicit spacing.")
+    if point_budget:
+        return float(np.sqrt(area / point_budget))
+    return DEFAULT_SPACING_FACTOR / float(np.sqrt(header_density(header)))
+
+
+def _spread_bits(values):
+    """Inserts a zero bit after each of the low 32 bits of a uint64 array (Morton interleaving)."""
+    values = values & np.uint64(0x00000000FFFFFFFF)
+    for shift, mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF), (4, 0x0F0F0F0F0F0F0F0F),
+                        (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        values = (values | (values << np.uint64(shift))) & np.uint64(mask)
+    return values
+
+
+def voxel_keys(columns, grid_origin, spacing):
+    """
+    One uint64 key per point naming its voxel of size `spacing`, counted from
+    grid_origin (the (x, y, z) minimum corner, in the same frame as the
+    x, y and z arrays in columns).
+    The XY cell indices are Morton interleaved in the high bits and the Z
+    layer fills the low bits, so sorting by key gives Z-order along XY with
+    the layers of each column kept together. Counting starts one voxel
+    below grid_origin so header bounds rounded slightly inwards still fit.
+    """
+    limit = (1 << VOXEL_BITS) - 1
+    cells = []
+    for axis in range(3):
+        cell = np.floor((columns[axis] - grid_origin[axis]) / spacing) + 1
+        if len(cell) and (cell.min() < 0 or cell.max() > limit):
+            raise ValueError(f"Sampling spacing {spacing} gives more than {limit + 1} voxels "
+                             f"along axis {axis}; use a larger spacing.")
+        cells.append(cell.astype(np.uint64))
+    morton = _spread_bits(cells[0]) | (_spread_bits(cells[1]) << np.uint64(1))
+    return (morton << np.uint64(VOXEL_BITS)) | cells[2]
+
+
+def sample_points(keys):
+    """
+    Indices of one point per voxel (the first one in input order), in
+    Morton order. Replaces both the old step decimation and the Z sort.
+    """
+    order = np.argsort(keys, kind="stable")
+    first = np.empty(len(order), dtype=bool)
+    if len(order):
+        sorted_keys = keys[order]
+        first[0] = True
+        np.not_equal(sorted_keys[1:], sorted_keys[:-1], out=first[1:])
+    return order[first]
+
+
+def _report_density(header, filtered, sampled, spacing):
+    """Prints the effective XY density of all returns, the kept classes and the sampled points."""
+    density = header_density(header)
+    area = header.point_count / density
+    print(f"Sampling at {spacing:.3f} spacing: {filtered} -> {sampled} points")
+    print(f"Density per square unit: header {density:.2f}, kept classes {filtered / area:.2f}, "
+          f"sampled {sampled / area:.2f}")
+
+
+def read_laz_metadata(laz_path):
+    """Returns the CRS and (min_x, min_y, max_x, max_y) bounds of a LAZ file from its header alone."""
+    with laspy.open(laz_path) as f:
+        mins, maxs = f.header.mins, f.header.maxs
+        return f.header.parse_crs(), (mins[0], mins[1], maxs[0], maxs[1])
+
+
+def process_point_cloud(laz_path, stream=False, chunk_size=DEFAULT_CHUNK_SIZE, origin=None,
+                        spacing=None, point_budget=None, grid_origin=None, crop=None, store_dir=None):
     """
     Reads a LAZ file, extracts its CRS, and uses a PDAL pipeline
-    to filter, downsample, and return the points as a NumPy array.
+    to filter the points. They are then thinned to one point per voxel (see
+    sampling_spacing for how spacing and point_budget set the voxel size)
+    and returned in Morton order as a NumPy array. The voxel grid starts at
+    grid_origin (absolute x, y, z), by default the header's minimum corner.
+
+    With stream=True the file is decoded chunk by chunk instead (see
+    stream_point_cloud), so peak memory no longer depends on the raw file size.
+
+    With origin=(x, y, z) the points are returned as float32 offsets from
+    that origin instead of float64 absolute coordinates.
+
+    crop is an area of interest (see aoi.py) in the LAZ's CRS; points
+    outside it are dropped inside the reader, before sampling.
+
+    With store_dir the points come from the file's columnar store there
+    (see point_store.py, which must be current) instead of the LAZ: the
+    kept classes are memory-mapped slices, read chunk by chunk like the
+    streaming path. Within a voxel the store prefers the lowest class over
+    file order.
     """
+    if store_dir is not None:
+        store = open_store(laz_path, store_dir)
+        header = store["header"]
+        print(f"LiDAR CRS found: {store['crs'].to_string()} (point store)")
+        spacing = sampling_spacing(header, spacing, point_budget)
+        if grid_origin is None:
+            grid_origin = header.mins
+        points = _sample_chunks(iter_class_chunks(store, KEEP_CLASSES, chunk_size), header, origin, spacing,
+                                grid_origin, crop, "Point store ingestion")
+        return points, store["crs"]
+
     # Step 1: Use laspy to read the header and extract CRS
     with laspy.open(laz_path) as f:
         laz_header = f.header
         # The CRS is stored in a VLR. We find it and convert to a pyproj.CRS object.
         laz_crs = laz_header.parse_crs()
         print(f"LiDAR CRS found: {laz_crs.to_string()}")
+        spacing = sampling_spacing(laz_header, spacing, point_budget)
+        if grid_origin is None:
+            grid_origin = laz_header.mins
+
+        if stream:
+            points = stream_point_cloud(f, chunk_size, origin, spacing, grid_origin, crop)
+            return points, laz_crs
+
+    start = time.perf_counter()
 
     # Step 2: Define a PDAL pipeline for processing
     # This pipeline reads the LAZ file, filters out noise (classification 7),
-    # keeps only ground (2), buildings (6), and high vegetation (5),
-    # and then decimates the point cloud to a manageable size.
+    # and keeps only ground (2), buildings (6), and high vegetation (5).
+    # Sampling and ordering happen afterwards in NumPy, shared with the
+    # streaming path.
     pdal_json = {
         "pipeline": [
             {
@@ -29,17 +186,11 @@ def process_point_cloud(laz_path):
             {
                 "type": "filters.range",
                 "limits": "Classification[2:2], Classification[5:6]"
-            },
-            {
-                "type": "filters.decimation",
-                "step": 4  # Keep one point for every 4
-            },
-            {
-                "type": "filters.sort",
-                "dimension": "Z"
             }
         ]
     }
+    if crop is not None:
+        pdal_json["pipeline"].extend(aoi_pdal_crops(crop))
 
     # Step 3: Execute the PDAL pipeline
     pipeline = pdal.Pipeline(str(pdal_json).replace("'", '"'))
@@ -53,8 +204,108 @@ def process_point_cloud(laz_path):
         raise ValueError("PDAL pipeline did not produce any points.")
 
     point_cloud_array = arrays[0]
+    # Voxel keys come from the absolute coordinates, so both paths and every
+    # origin pick the same points
+    keys = voxel_keys([point_cloud_array[dim] for dim in ("X", "Y", "Z")], grid_origin, spacing)
+    point_cloud_array = point_cloud_array[sample_points(keys)]
+    _report_density(laz_header, count, len(point_cloud_array), spacing)
 
     # Extract X, Y, Z coordinates into a simple (N, 3) NumPy array
-    points = np.vstack((point_cloud_array['X'], point_cloud_array['Y'], point_cloud_array['Z'])).transpose()
+    if origin is None:
+        points = np.vstack((point_cloud_array['X'], point_cloud_array['Y'], point_cloud_array['Z'])).transpose()
+    else:
+        # Subtract the origin straight into float32 columns; no float64 (N, 3) copy is built
+        points = np.empty((len(point_cloud_array), 3), dtype=np.float32)
+        for axis, dim in enumerate(("X", "Y", "Z")):
+            np.subtract(point_cloud_array[dim], origin[axis], out=points[:, axis], casting="unsafe")
+
+    _report_throughput("Point cloud ingestion", laz_header.point_count, time.perf_counter() - start)
+    return points, laz_crs
+
+
+def stream_point_cloud(laz_file, chunk_size, origin, spacing, grid_origin, crop=None):
+    """
+    Decodes an open laspy reader in fixed-size chunks, applying the same
+    classification filter, AOI crop and voxel sampling as the PDAL path.
+    Each chunk is thinned to one point per voxel as it arrives, so only the
+    sampled points are held; a final pass drops voxels that straddle chunk
+    boundaries.
+
+    Returns an (N, 3) float64 array, or float32 offsets from origin when one
+    is given, in Morton order. Peak memory is one decoded chunk plus the
+    sampled points.
+    """
+    def kept_chunks():
+        for chunk in laz_file.chunk_iterator(chunk_size):
+            keep = np.flatnonzero(np.isin(np.asarray(chunk.classification), KEEP_CLASSES))
+            yield tuple(np.asarray(chunk[dim])[keep] for dim in ("X", "Y", "Z"))
+
+    return _sample_chunks(kept_chunks(), laz_file.header, origin, spacing, grid_origin, crop,
+                          "Streaming ingestion")
+
+
+def _grow(buffer, capacity, used):
+    """A copy of buffer with room for capacity rows, keeping its first used rows."""
+    grown = np.empty((capacity,) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:used] = buffer[:used]
+    return grown
+
+
+def _sample_chunks(chunks, header, origin, spacing, grid_origin, crop, label):
+    """
+    Crops and voxel-samples (X, Y, Z) scaled-integer chunks of kept points
+    one at a time (see stream_point_cloud), using the header's scales and
+    offsets. Returns the sampled points in Morton order.
+
+    Each chunk's sampled points and keys are written straight into buffers
+    sized for one point per XY voxel of the header's footprint (at most the
+    header's point count), doubled whenever a chunk does not fit, so no
+    per-chunk arrays are kept and concatenated.
+    """
+    scales = header.scales
+    offsets = header.offsets
+    dtype = np.float64 if origin is None else np.float32
+    shift = np.zeros(3) if origin is None else np.asarray(origin, dtype=np.float64)
+
+    area = (header.maxs[0] - header.mins[0]) * (header.maxs[1] - header.mins[1])
+    capacity = int(max(1, min(header.point_count, area / spacing ** 2)))
+    point_buffer = np.empty((capacity, 3), dtype=dtype)
+    key_buffer = np.empty(capacity, dtype=np.uint64)
+    used = 0
+    passed = 0  # points that passed the class filter and crop, across chunks
+    start = time.perf_counter()
+    for chunk in chunks:
+        # Absolute float64 coordinates for this chunk only
+        columns = []
+        for axis in range(3):
+            column = chunk[axis] * scales[axis]
+            column += offsets[axis]
+            columns.append(column)
+        if crop is not None:
+            inside = points_in_aoi(columns[0], columns[1], crop)
+            columns = [column[inside] for column in columns]
+        passed += len(columns[0])
+        keys = voxel_keys(columns, grid_origin, spacing)
+        picked = sample_points(keys)
+
+        end = used + picked.size
+        if end > capacity:
+            capacity = max(end, 2 * capacity)
+            point_buffer = _grow(point_buffer, capacity, used)
+            key_buffer = _grow(key_buffer, capacity, used)
+        for axis in range(3):
+            # Subtract the origin in float64 before rounding to float32
+            point_buffer[used:end, axis] = columns[axis][picked] - shift[axis]
+        key_buffer[used:end] = keys[picked]
+        used = end
+
+    if passed == 0:
+        raise ValueError(f"{label} did not produce any points.")
+
+    # The stable sort keeps the earliest chunk's point for shared voxels,
+    # matching the PDAL path's choice of the first point in file order
+    points = point_buffer[:used][sample_points(key_buffer[:used])]
+    _report_density(header, passed, len(points), spacing)
 
-    return points, laz_crs
\ No newline at end of file
+    _report_throughput(label, header.point_count, time.perf_counter() - start)
+    return points
@@ -0,0 +1,241 @@
+# point_store.py
+#
+# A columnar on-disk copy of a LAZ file, ingested once so later runs skip
+# LAZ decompression. Every dimension (X, Y and Z as the header's scaled
+# integers, and Classification) is a .npy file that readers open memory-
+# mapped, without copying. Points are grouped by classification and
+# meta.json records the header, the CRS and the offset and count of each
+# class, so selecting classes means slicing rather than scanning.
+#
+# Ingestion decodes the LAZ in chunks on a pool of worker processes; a store
+# whose LAZ file changed size or mtime since it was built is rebuilt.
+#
+#   python point_store.py tiles/ --store-dir ./temp_geo_processing/point_store
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from types import SimpleNamespace
+
+import laspy
+import numpy as np
+from pyproj import CRS
+
+# Bumped whenever the layout changes, so older stores are rebuilt
+STORE_VERSION = 1
+
+DEFAULT_STORE_DIR = "./temp_geo_processing/point_store"
+
+# Stored dimensions and their on-disk types; X, Y and Z stay scaled integers
+DIMENSIONS = {"X": np.int32, "Y": np.int32, "Z": np.int32, "Classification": np.uint8}
+
+# Points decoded per ingestion task
+INGEST_CHUNK_SIZE = 2_000_000
+
+META_NAME = "meta.json"
+
+
+def store_path(laz_path, store_dir=DEFAULT_STORE_DIR):
+    """The store directory of laz_path: its name plus a hash of its absolute path."""
+    laz_path = os.path.abspath(laz_path)
+    digest = hashlib.sha1(laz_path.encode()).hexdigest()[:12]
+    return os.path.join(store_dir, f"{os.path.splitext(os.path.basename(laz_path))[0]}-{digest}")
+
+
+def load_store_meta(laz_path, store_dir=DEFAULT_STORE_DIR):
+    """The metadata of laz_path's store, or None when it is missing or the file changed since it was built."""
+    try:
+        with open(os.path.join(store_path(laz_path, store_dir), META_NAME)) as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    stat = os.stat(laz_path)
+    if (meta.get("version") != STORE_VERSION or meta["size"] != stat.st_size
+            or meta["mtime_ns"] != stat.st_mtime_ns):
+        return None
+    return meta
+
+
+def _decode_chunk(laz_path, start, count, part_prefix):
+    """
+    Worker: decodes count points from start, sorts them by classification
+    (stable, so file order holds within a class) and saves one .npy per
+    dimension under part_prefix. Returns {class: count}.
+    """
+    with laspy.open(laz_path) as f:
+        f.seek(start)
+        chunk = f.read_points(count)
+    classification = np.asarray(chunk.classification).astype(np.uint8)
+    order = np.argsort(classification, kind="stable")
+    for dim, dtype in DIMENSIONS.items():
+        values = classification if dim == "Classification" else np.asarray(chunk[dim])
+        np.save(f"{part_prefix}-{dim}.npy", values[order].astype(dtype, copy=False))
+    classes, counts = np.unique(classification, return_counts=True)
+    return {int(c): int(n) for c, n in zip(classes, counts)}
+
+
+def _scatter_chunk(path, part_prefix, segments):
+    """
+    Worker: copies the (source_start, target_start, count) segments of a
+    decoded chunk into the store's columns and deletes the chunk's files.
+    Segments of different chunks never overlap, so workers write side by side.
+    """
+    for dim in DIMENSIONS:
+        part_file = f"{part_prefix}-{dim}.npy"
+        source = np.load(part_file, mmap_mode="r")
+        target = np.load(os.path.join(path, f"{dim}.npy"), mmap_mode="r+")
+        for source_start, target_start, count in segments:
+            target[target_start:target_start + count] = source[source_start:source_start + count]
+        target.flush()
+        del source, target
+        os.remove(part_file)
+
+
+def build_store(laz_path, store_dir=DEFAULT_STORE_DIR, workers=None, chunk_size=INGEST_CHUNK_SIZE):
+    """
+    Ingests laz_path into its store under store_dir, replacing an existing
+    one, and returns the store's path. Chunks are decoded in parallel, then
+    each chunk's classes are copied to their place in the class-grouped
+    columns, again in parallel.
+    """
+    laz_path = os.path.abspath(laz_path)
+    path = store_path(laz_path, store_dir)
+    stat = os.stat(laz_path)
+    start = time.perf_counter()
+    with laspy.open(laz_path) as f:
+        header = f.header
+        crs = header.parse_crs()
+        meta = {"version": STORE_VERSION, "source": laz_path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                "point_format": header.point_format.id,
+                "scales": header.scales.tolist(), "offsets": header.offsets.tolist(),
+                "mins": header.mins.tolist(), "maxs": header.maxs.tolist(),
+                "crs": crs.to_wkt() if crs else None}
+        total = int(header.point_count)
+
+    # Built next to its final place and renamed, so readers never see half a store
+    os.makedirs(store_dir, exist_ok=True)
+    build_dir = f"{path}.tmp-{os.getpid()}"
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+    ranges = [(offset, min(chunk_size, total - offset)) for offset in range(0, total, chunk_size)]
+    prefixes = [os.path.join(build_dir, f"part{index}") for index in range(len(ranges))]
+
+    # Spawned workers: the LAZ decoder's thread pool does not survive a fork
+    context = multiprocessing.get_context("spawn")
+    workers = max(1, min(workers or os.cpu_count() or 1, len(ranges)))
+    try:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+            chunk_counts = list(pool.map(_decode_chunk, [laz_path] * len(ranges),
+                                         [offset for offset, _ in ranges], [count for _, count in ranges],
+                                         prefixes))
+
+            # Each class is one contiguous run; chunks fill it in file order
+            class_counts = {}
+            for counts in chunk_counts:
+                for cls, count in counts.items():
+                    class_counts[cls] = class_counts.get(cls, 0) + count
+            classes, cursor, offset = {}, {}, 0
+            for cls in sorted(class_counts):
+                classes[str(cls)] = [offset, class_counts[cls]]
+                cursor[cls] = offset
+                offset += class_counts[cls]
+
+            for dim, dtype in DIMENSIONS.items():
+                column = np.lib.format.open_memmap(os.path.join(build_dir, f"{dim}.npy"), mode="w+",
+                                                   dtype=dtype, shape=(offset,))
+                del column
+
+            futures = []
+            for prefix, counts in zip(prefixes, chunk_counts):
+                segments, source_start = [], 0
+                for cls in sorted(counts):
+                    segments.append((source_start, cursor[cls], counts[cls]))
+                    source_start += counts[cls]
+                    cursor[cls] += counts[cls]
+                futures.append(pool.submit(_scatter_chunk, build_dir, prefix, segments))
+            for future in futures:
+                future.result()
+
+        meta.update(point_count=offset, classes=classes,
+                    dimensions={dim: np.dtype(dtype).str for dim, dtype in DIMENSIONS.items()})
+        with open(os.path.join(build_dir, META_NAME), "w") as f:
+            json.dump(meta, f, indent=1)
+        shutil.rmtree(path, ignore_errors=True)
+        os.rename(build_dir, path)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"Point store: ingested {offset} points of {os.path.basename(laz_path)} in {elapsed:.2f}s "
+          f"({offset / max(elapsed, 1e-9):,.0f} points/sec) with {workers} workers")
+    return path
+
+
+def ensure_store(laz_path, store_dir=DEFAULT_STORE_DIR, workers=None):
+    """Returns the path of laz_path's store, ingesting the file first when the store is missing or outdated."""
+    if load_store_meta(laz_path, store_dir) is not None:
+        return store_path(laz_path, store_dir)
+    print(f"Point store for {os.path.basename(laz_path)} is missing or outdated; ingesting")
+    return build_store(laz_path, store_dir, workers)
+
+
+def open_store(laz_path, store_dir=DEFAULT_STORE_DIR):
+    """
+    Opens laz_path's store without reading it: a dict with the columns as
+    read-only memory maps under their dimension names, "header" (point_count,
+    mins, maxs, scales, offsets), "crs" and "classes" ({class: (start,
+    count)}). Raises ValueError when the store is missing or outdated.
+    """
+    meta = load_store_meta(laz_path, store_dir)
+    if meta is None:
+        raise ValueError(f"No current point store for {laz_path} in {store_dir}; run point_store.py first.")
+    path = store_path(laz_path, store_dir)
+    store = {dim: np.load(os.path.join(path, f"{dim}.npy"), mmap_mode="r") for dim in DIMENSIONS}
+    store["header"] = SimpleNamespace(point_count=meta["point_count"],
+                                      **{name: np.asarray(meta[name])
+                                         for name in ("mins", "maxs", "scales", "offsets")})
+    store["crs"] = CRS.from_wkt(meta["crs"]) if meta["crs"] else None
+    store["classes"] = {int(cls): tuple(span) for cls, span in meta["classes"].items()}
+    return store
+
+
+def iter_class_chunks(store, classes, chunk_size):
+    """
+    Yields (X, Y, Z) scaled-integer views of at most chunk_size points of
+    the given classes, one class after the other; nothing is copied.
+    """
+    for cls in sorted(classes):
+        start, count = store["classes"].get(cls, (0, 0))
+        for offset in range(start, start + count, chunk_size):
+            end = min(offset + chunk_size, start + count)
+            yield store["X"][offset:end], store["Y"][offset:end], store["Z"][offset:end]
+
+
+def main():
+    # laz_index reads through point_cloud_processor, which imports this module
+    from laz_index import resolve_laz_inputs
+
+    parser = argparse.ArgumentParser(description="Ingest LAZ files into columnar point stores.")
+    parser.add_argument("laz_input", type=str,
+                        help="A LAZ file, a directory of LAZ tiles or a glob such as 'tiles/*.laz'.")
+    parser.add_argument("--store-dir", type=str, default=DEFAULT_STORE_DIR, help="Directory of the point stores.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes decoding LAZ chunks "
+                                                                  "(default: CPU count).")
+    parser.add_argument("--chunk-size", type=int, default=INGEST_CHUNK_SIZE, help="Points decoded per task.")
+    parser.add_argument("--force", action="store_true", help="Rebuild stores that are still current.")
+    args = parser.parse_args()
+
+    for laz_path in resolve_laz_inputs(args.laz_input):
+        if not args.force and load_store_meta(laz_path, args.store_dir) is not None:
+            print(f"Point store for {os.path.basename(laz_path)} is current")
+            continue
+        build_store(laz_path, args.store_dir, args.workers, args.chunk_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+# profiling.py
+#
+# Per-stage metrics for the pipeline: wall time, CPU time of the stage's
+# thread, the process's RSS high-water mark and whatever sizes the stage
+# reports (points, vertices, triangles, pixels).
+# Used both by main.py and inside Blender by blender_processor.py, so it
+# only depends on the standard library.
+
+import cProfile
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+try:
+    import resource
+except ImportError:  # Windows has no resource module
+    resource = None
+
+# Prefix of the line blender_processor.py prints with its metrics as JSON;
+# main.py picks it out of Blender's stdout
+METRICS_PREFIX = "@@LTF_METRICS "
+
+# Prefix of the result line blender_processor.py writes after each job in
+# --serve mode; batch.py looks for it among Blender's own output
+RESULT_PREFIX = "@@LTF_RESULT "
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process in MiB, or None if unknown."""
+    # ru_maxrss survives exec on Linux, so a freshly spawned worker would
+    # report its parent's peak; VmHWM belongs to this process image only
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    # ru_maxrss is reported in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def current_rss_mb():
+    """Returns the current resident set size of this process in MiB, or None if unknown."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024.0
+    except OSError:
+        pass
+    return None
+
+
+class RssSampler:
+    """
+    Polls this process's RSS on a background thread for the duration of a
+    with-block. peak_mb is the highest reading above the RSS at entry, which
+    unlike peak_rss_mb() isolates one step of a long-running process. None
+    where the RSS cannot be read.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak_mb = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _poll(self, base):
+        peak = base
+        while not self._stop.wait(self.interval):
+            peak = max(peak, current_rss_mb())
+        self.peak_mb = max(peak, current_rss_mb()) - base
+
+    def __enter__(self):
+        base = current_rss_mb()
+        if base is not None:
+            self._thread = threading.Thread(target=self._poll, args=(base,), daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        return False
+
+
+def cpu_seconds():
+    """CPU time of this process plus any child processes it has reaped."""
+    if resource is None:
+        return time.process_time()
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
+
+
+class StageProfiler:
+    """
+    Collects one record per stage. Records are appended when a stage starts,
+    so nested stages follow their parent. Stages may overlap on other
+    threads, so cpu_s is the CPU time of the stage's own thread (work it
+    hands to worker threads or processes is not counted) and peak_rss_mb is
+    the whole process's RSS high-water mark when the stage ended, not the
+    stage's own footprint. With profile_dir set, every stage
+    also runs under cProfile and its stats are dumped to <profile_dir>/<name>.prof.
+    Only one cProfile runs at a time: stages nested in a profiled stage are
+    covered by its dump, and stages that overlap it on other threads record
+    its name under "profile_skipped".
+    """
+
+    def __init__(self, profile_dir=None):
+        self.stages = []
+        self.profile_dir = profile_dir
+        self.start = time.perf_counter()
+        # (stage name, thread id) of the stage running under cProfile
+        self._profiled = None
+        self._lock = threading.Lock()
+        if profile_dir:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name, **sizes):
+        """
+        Times the body of a with-block. Yields the stage's record so the body
+        can add sizes to it, e.g. record["points"] = len(points).
+        """
+        record = {"stage": name, **sizes}
+        profiler = None
+        with self._lock:
+            self.stages.append(record)
+            # cProfile cannot nest; inner stages are covered by the outer dump
+            if self.profile_dir and self._profiled is None:
+                self._profiled = (name, threading.get_ident())
+                profiler = cProfile.Profile()
+            elif self.profile_dir and self._profiled[1] != threading.get_ident():
+                record["profile_skipped"] = self._profiled[0]
+        if profiler:
+            profiler.enable()
+        wall, cpu = time.perf_counter(), time.thread_time()
+        # Stages may run concurrently (see stage_graph.py); the start offset
+        # places each record on the run's timeline
+        record["start_s"] = wall - self.start
+        try:
+            yield record
+        finally:
+            record["wall_s"] = time.perf_counter() - wall
+            record["cpu_s"] = time.thread_time() - cpu
+            record["peak_rss_mb"] = peak_rss_mb()
+            if profiler:
+                profiler.disable()
+                path = os.path.join(self.profile_dir, f"{name.replace('/', '_')}.prof")
+                profiler.dump_stats(path)
+                record["profile"] = path
+                with self._lock:
+                    self._profiled = None
+
+    def extend(self, records):
+        """Appends records collected by another process, e.g. inside Blender."""
+        with self._lock:
+            self.stages.extend(records)
+
+    def to_dict(self):
+        return {"total_wall_s": time.perf_counter() - self.start,
+                "peak_rss_mb": peak_rss_mb(),
+                "stages": self.stages}
+
+    def write_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        print(f"Metrics written to {path}")
+
+    def report(self):
+        """Prints one line per stage in run order."""
+        print("\n--- STAGE METRICS ---")
+        print(f"{'stage':<28}{'wall s':>9}{'cpu s':>9}{'HWM MiB':>10}  sizes")
+        timing_keys = {"stage", "start_s", "wall_s", "cpu_s", "peak_rss_mb", "profile", "profile_skipped"}
+        for record in self.stages:
+            rss = record.get("peak_rss_mb")
+            sizes = ", ".join(f"{k}={v}" for k, v in record.items() if k not in timing_keys)
+            print(f"{record['stage']:<28}{record.get('wall_s', 0.0):>9.2f}{record.get('cpu_s', 0.0):>9.2f}"
+                  f"{rss if rss is not None else float('nan'):>10.1f}  {sizes}")
+        print(f"{'total':<28}{time.perf_counter() - self.start:>9.2f}")
+        print("cpu s: the stage's own thread; HWM MiB: the process's peak RSS so far when the stage ended")
+        skipped = [f"{r['stage']} (overlapped {r['profile_skipped']})" for r in self.stages if "profile_skipped" in r]
+        if skipped:
+            print(f"Not profiled with cProfile: {', '.join(skipped)}")
+
+
+def stage(profiler, name, **sizes):
+    """profiler.stage(name) or, without a profiler, a no-op block yielding a scratch dict."""
+    if profiler is None:
+        return nullcontext({})
+    return profiler.stage(name, **sizes)
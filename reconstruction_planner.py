@@ -0,0 +1,251 @@
+# reconstruction_planner.py
+#
+# Picks how to reconstruct a point cloud within a memory budget. A small
+# cost model predicts Poisson's peak memory and runtime from the point
+# count, the occupied XY area and the octree depth: a terrain surface
+# occupies roughly (area / voxel size^2) finest-level octree nodes, and the
+# voxel size halves with every depth level. The planner takes the highest
+# depth that fits, up to the depth at which voxels reach the point spacing;
+# when no single reconstruction reaches that depth it tiles the extent, and
+# when tiling cannot fit either it falls back to the grid mesher.
+#
+# Every plan is logged with its predictions next to the measured peak memory
+# and runtime, one JSON line per run. Later plans scale the model by the
+# median measured/predicted ratio of the recent log records, so the
+# constants below only need to be in the right ballpark.
+
+import json
+import math
+import os
+import time
+
+import numpy as np
+
+from mesh_generator import POISSON_SCALE
+
+MIN_DEPTH = 6
+MAX_DEPTH = 12
+
+# A single reconstruction this many levels short of the point-spacing depth
+# still counts as a fit; further short, tiling keeps the resolution instead
+DEPTH_TOLERANCE = 1
+
+# Uncalibrated cost model. Points pay for the Open3D point cloud, normals and
+# KD-tree; nodes for the Poisson octree, solver and extracted mesh.
+BYTES_PER_POINT = 300
+BYTES_PER_NODE = 1500
+SECONDS_PER_POINT = 5e-6
+SECONDS_PER_NODE = 2e-5
+# Occupied finest-level nodes per voxel of XY footprint (terrain plus canopy and walls)
+SURFACE_ROUGHNESS = 1.5
+# RSS of a spawned tile worker before it loads any points
+WORKER_OVERHEAD_MB = 150.0
+GRID_BYTES_PER_POINT = 80
+GRID_SECONDS_PER_POINT = 1e-6
+
+# Cells per axis of the raster used to measure the occupied XY area
+FOOTPRINT_CELLS = 256
+
+# Tiles are never made smaller than this many times the tile overlap
+MIN_TILE_FACTOR = 4
+
+# Recent log records per model used for calibration, and the minimum before it applies
+CALIBRATION_RECORDS = 50
+MIN_CALIBRATION_RECORDS = 3
+
+DEFAULT_PLANNER_LOG = "./temp_geo_processing/planner_log.jsonl"
+
+
+def measure_footprint(points):
+    """
+    Returns (count, occupied XY area, largest bounding-box side, XY bounds)
+    for an (N, 3) array. The area counts only the cells of a
+    FOOTPRINT_CELLS-per-side raster that hold points, so gaps and irregular
+    outlines do not inflate it.
+    """
+    low, high = points.min(axis=0).astype(np.float64), points.max(axis=0).astype(np.float64)
+    size = np.maximum(high - low, 1e-9)
+    cell = max(size[0], size[1]) / FOOTPRINT_CELLS
+    cols = np.minimum(((points[:, 0] - low[0]) / cell).astype(np.int64), FOOTPRINT_CELLS - 1)
+    rows = np.minimum(((points[:, 1] - low[1]) / cell).astype(np.int64), FOOTPRINT_CELLS - 1)
+    occupied = len(np.unique(rows * FOOTPRINT_CELLS + cols))
+    return len(points), occupied * cell * cell, float(size.max()), (low[0], low[1], high[0], high[1])
+
+
+def target_depth(count, area, extent, scale=POISSON_SCALE):
+    """The depth at which Poisson voxels shrink to the mean point spacing, within MIN_DEPTH..MAX_DEPTH."""
+    spacing = math.sqrt(area / max(count, 1))
+    depth = math.ceil(math.log2(max(extent * scale / spacing, 1.0)))
+    return min(max(depth, MIN_DEPTH), MAX_DEPTH)
+
+
+def poisson_cost(count, area, extent, depth, scale=POISSON_SCALE):
+    """Uncalibrated (peak MiB, seconds) of one Poisson reconstruction."""
+    voxel = extent * scale / 2 ** depth
+    # The coarser octree levels add a third on top of the finest one
+    nodes = SURFACE_ROUGHNESS * area / voxel ** 2 * 4 / 3
+    return ((BYTES_PER_POINT * count + BYTES_PER_NODE * nodes) / 1024 ** 2,
+            SECONDS_PER_POINT * count + SECONDS_PER_NODE * nodes)
+
+
+def grid_cost(count):
+    """Uncalibrated (peak MiB, seconds) of the grid mesher."""
+    return GRID_BYTES_PER_POINT * count / 1024 ** 2, GRID_SECONDS_PER_POINT * count
+
+
+def load_calibration(log_path):
+    """
+    {model: (memory factor, time factor)} from the planner log: the median
+    measured/predicted ratio over each model's last CALIBRATION_RECORDS
+    records. Models with fewer than MIN_CALIBRATION_RECORDS records are left out.
+    """
+    if not log_path or not os.path.exists(log_path):
+        return {}
+    records = {}
+    with open(log_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("actual_mb") and record.get("actual_s") and record["model_mb"] and record["model_s"]:
+                records.setdefault(record["model"], []).append(record)
+
+    calibration = {}
+    for model, rows in records.items():
+        rows = rows[-CALIBRATION_RECORDS:]
+        if len(rows) >= MIN_CALIBRATION_RECORDS:
+            calibration[model] = (float(np.median([r["actual_mb"] / r["model_mb"] for r in rows])),
+                                  float(np.median([r["actual_s"] / r["model_s"] for r in rows])))
+    return calibration
+
+
+def _calibrated(calibration, model, cost):
+    mem_factor, time_factor = calibration.get(model, (1.0, 1.0))
+    return cost[0] * mem_factor, cost[1] * time_factor
+
+
+def _tile_shape(count, area, extent, bounds, tile_size, overlap):
+    """(tiles, points, occupied area, Poisson extent) of one tile of tile_size plus its overlap."""
+    tiles = (max(1, math.ceil((bounds[2] - bounds[0]) / tile_size)) *
+             max(1, math.ceil((bounds[3] - bounds[1]) / tile_size)))
+    span = tile_size + 2 * overlap
+    tile_area = min(area, span * span)
+    return tiles, count * tile_area / area, tile_area, min(extent, span) if tiles > 1 else extent
+
+
+def _tiled_candidate(shape, depth, budget_mb, workers, calibration):
+    """The tiled plan for a tile shape at depth, or None when not even one tile fits budget_mb."""
+    tiles, tile_count, tile_area, tile_extent = shape
+    model_mb, model_s = poisson_cost(tile_count, tile_area, tile_extent, depth)
+    tile_mb, tile_s = _calibrated(calibration, "poisson_tile", (model_mb, model_s))
+    fitting = int(budget_mb // (tile_mb + WORKER_OVERHEAD_MB))
+    if fitting < 1:
+        return None
+    workers = min(workers, fitting, tiles)
+    return {"mesher": "poisson", "depth": depth, "tiles": tiles, "workers": workers,
+            "model": "poisson_tile", "model_mb": model_mb, "model_s": model_s,
+            "predicted_mb": workers * (tile_mb + WORKER_OVERHEAD_MB),
+            "predicted_s": math.ceil(tiles / workers) * tile_s,
+            "predicted_tile_mb": tile_mb, "predicted_tile_s": tile_s}
+
+
+def plan_reconstruction(points, memory_budget_gb, tile_size=None, overlap=10.0, workers=None, log_path=None):
+    """
+    Chooses how to mesh points within memory_budget_gb. Returns a plan dict:
+    mesher ("poisson" or "grid"), depth, tile_size (None for one
+    reconstruction), workers, the predicted peak MiB and seconds, and the
+    raw model figures the log calibrates against. An explicit tile_size is
+    kept and only the tile depth is planned.
+    """
+    budget_mb = memory_budget_gb * 1024
+    workers = workers or os.cpu_count() or 1
+    calibration = load_calibration(log_path)
+    count, area, extent, bounds = measure_footprint(points)
+    wanted = target_depth(count, area, extent)
+    plan = None
+
+    if tile_size:
+        # Keep the requested tiling; step the depth down until one tile fits
+        shape = _tile_shape(count, area, extent, bounds, tile_size, overlap)
+        for depth in range(target_depth(*shape[1:]), MIN_DEPTH - 1, -1):
+            plan = _tiled_candidate(shape, depth, budget_mb, workers, calibration)
+            if plan:
+                plan.update(tile_size=tile_size, reason="requested tiling")
+                break
+    else:
+        single = None
+        for depth in range(wanted, MIN_DEPTH - 1, -1):
+            model_mb, model_s = poisson_cost(count, area, extent, depth)
+            predicted_mb, predicted_s = _calibrated(calibration, "poisson", (model_mb, model_s))
+            if predicted_mb <= budget_mb:
+                single = {"mesher": "poisson", "depth": depth, "tile_size": None, "tiles": 1, "workers": 1,
+                          "model": "poisson", "model_mb": model_mb, "model_s": model_s,
+                          "predicted_mb": predicted_mb, "predicted_s": predicted_s}
+                break
+
+        if single and single["depth"] >= wanted - DEPTH_TOLERANCE:
+            plan = dict(single, reason="fits in one reconstruction")
+        else:
+            # Halve the tile size until the tiles reach full resolution within
+            # the budget, and take the fastest such tiling
+            candidates = []
+            size = max(bounds[2] - bounds[0], bounds[3] - bounds[1]) / 2
+            while size >= MIN_TILE_FACTOR * overlap:
+                shape = _tile_shape(count, area, extent, bounds, size, overlap)
+                candidate = _tiled_candidate(shape, target_depth(*shape[1:]), budget_mb, workers, calibration)
+                if candidate:
+                    candidates.append(dict(candidate, tile_size=size))
+                size /= 2
+            if candidates:
+                plan = dict(min(candidates, key=lambda c: c["predicted_s"]),
+                            reason=f"one reconstruction only fits depth "
+                                   f"{single['depth'] if single else '<' + str(MIN_DEPTH)} of {wanted}")
+            elif single:
+                plan = dict(single, reason="no tiling fits; coarser single reconstruction")
+
+    if plan is None:
+        model_mb, model_s = grid_cost(count)
+        predicted_mb, predicted_s = _calibrated(calibration, "grid", (model_mb, model_s))
+        plan = {"mesher": "grid", "depth": None, "tile_size": None, "tiles": 1, "workers": 1,
+                "model": "grid", "model_mb": model_mb, "model_s": model_s,
+                "predicted_mb": predicted_mb, "predicted_s": predicted_s,
+                "reason": "no Poisson reconstruction fits"}
+        if predicted_mb > budget_mb:
+            print(f"Warning: even the grid mesher is predicted to need {predicted_mb:.0f} MiB "
+                  f"of the {budget_mb:.0f} MiB budget.")
+
+    plan.update(points=count, area=area, extent=extent, target_depth=wanted, budget_mb=budget_mb,
+                calibrated=plan["model"] in calibration)
+    tiling = f", {plan['tiles']} tiles of {plan['tile_size']:.1f} on {plan['workers']} workers" \
+        if plan["tile_size"] else ""
+    print(f"Reconstruction plan: {plan['mesher']}"
+          f"{'' if plan['depth'] is None else ' depth ' + str(plan['depth'])}{tiling} "
+          f"({plan['reason']}); predicted {plan['predicted_mb']:.0f} MiB of {budget_mb:.0f}, "
+          f"{plan['predicted_s']:.1f}s{'' if plan['calibrated'] else ' (uncalibrated)'}")
+    return plan
+
+
+def log_outcome(plan, actual_mb, actual_s, log_path=None):
+    """
+    Prints the plan's predictions next to the measured peak MiB and seconds
+    and, with log_path, appends both as one JSON line for calibration.
+    For tiled plans the measurements are per tile (the largest peak and the
+    mean seconds), matching the per-tile model figures.
+    """
+    if plan["tile_size"]:
+        predicted_mb, predicted_s = plan["predicted_tile_mb"], plan["predicted_tile_s"]
+    else:
+        predicted_mb, predicted_s = plan["predicted_mb"], plan["predicted_s"]
+    actual_text = f"{actual_mb:.0f} MiB" if actual_mb is not None else "n/a"
+    print(f"Reconstruction plan vs. actual{' (per tile)' if plan['tile_size'] else ''}: "
+          f"{predicted_mb:.0f} MiB / {predicted_s:.1f}s predicted, {actual_text} / {actual_s:.1f}s measured")
+    if not log_path:
+        return
+    record = {"time": time.time(), **plan, "actual_mb": actual_mb, "actual_s": actual_s}
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(log_path)), exist_ok=True)
+        with open(log_path, "a") as f:
+            f.write(json.dumps(record, default=float) + "\n")
+    except OSError as e:
+        print(f"Warning: could not append to the planner log {log_path}: {e}")
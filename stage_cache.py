@@ -0,0 +1,147 @@
+# stage_cache.py
+#
+# Content-addressed cache for pipeline stage outputs. Each entry is a directory
+# named after a hash of the stage name, the identity of its input files and its
+# parameters (including the keys of upstream stages), so a change anywhere
+# upstream produces a new key. Entries are evicted least-recently-used once the
+# cache grows past its size cap.
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+DEFAULT_CACHE_SIZE_GB = 20.0
+
+# Touched on every hit; its mtime is the entry's last use for LRU eviction
+_LAST_USED = ".last_used"
+
+
+def file_identity(path, content_hash=False):
+    """
+    Identifies an input file by absolute path, size and modification time,
+    or by the SHA-256 of its contents when content_hash is set.
+    """
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    if not content_hash:
+        return {"path": path, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return {"sha256": digest.hexdigest(), "size": stat.st_size}
+
+
+def save_arrays(entry_dir, **arrays):
+    for name, array in arrays.items():
+        np.save(os.path.join(entry_dir, f"{name}.npy"), array)
+
+
+def load_arrays(entry_dir, *names):
+    return [np.load(os.path.join(entry_dir, f"{name}.npy")) for name in names]
+
+
+def save_json(entry_dir, name, data):
+    with open(os.path.join(entry_dir, f"{name}.json"), "w") as f:
+        json.dump(data, f)
+
+
+def load_json(entry_dir, name):
+    with open(os.path.join(entry_dir, f"{name}.json")) as f:
+        return json.load(f)
+
+
+class StageCache:
+    """
+    Stores stage outputs under cache_dir/<key>/. With enabled=False every
+    stage is simply recomputed and nothing is written.
+    """
+
+    def __init__(self, cache_dir, max_size_gb=DEFAULT_CACHE_SIZE_GB, enabled=True):
+        self.cache_dir = os.path.abspath(cache_dir)
+        self.max_bytes = int(max_size_gb * 1024 ** 3)
+        self.enabled = enabled
+        if enabled:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def key(stage, **params):
+        """Hashes a stage name and its JSON-serialisable parameters into a cache key."""
+        blob = json.dumps({"stage": stage, **params}, sort_keys=True, default=str)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def contains(self, key):
+        """Whether key is cached right now; a later run() may still miss if it gets evicted meanwhile."""
+        return self.enabled and os.path.isdir(os.path.join(self.cache_dir, key))
+
+    def run(self, stage, key, compute, save, load):
+        """
+        Returns load(entry_dir) when the key is cached. Otherwise calls
+        compute(), stores its result with save(result, entry_dir) and returns it.
+        """
+        if not self.enabled:
+            return compute()
+
+        entry_dir = os.path.join(self.cache_dir, key)
+        if os.path.isdir(entry_dir):
+            try:
+                self._touch(entry_dir)
+                result = load(entry_dir)
+                print(f"[cache] {stage}: hit ({key[:12]})")
+                return result
+            except OSError:
+                # Evicted by a concurrent run between the check and the load
+                print(f"[cache] {stage}: entry {key[:12]} vanished, recomputing")
+
+        print(f"[cache] {stage}: miss ({key[:12]})")
+        result = compute()
+
+        # Build the entry in a scratch directory and rename it into place, so
+        # concurrent runs never see a half-written entry
+        scratch = tempfile.mkdtemp(prefix=".tmp-", dir=self.cache_dir)
+        try:
+            save(result, scratch)
+            save_json(scratch, "stage", {"stage": stage, "created": time.time()})
+            self._touch(scratch)
+            os.rename(scratch, entry_dir)
+        except OSError:
+            # Another run stored the same key first; keep theirs
+            shutil.rmtree(scratch, ignore_errors=True)
+        self.evict(keep=key)
+        return result
+
+    def evict(self, keep=None):
+        """Removes least-recently-used entries until the cache fits its size cap."""
+        entries = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(entry_dir):
+                continue
+            size = sum(os.path.getsize(os.path.join(root, f))
+                       for root, _, files in os.walk(entry_dir) for f in files)
+            last_used = os.path.getmtime(os.path.join(entry_dir, _LAST_USED)) \
+                if os.path.exists(os.path.join(entry_dir, _LAST_USED)) else 0.0
+            entries.append((last_used, size, name))
+            total += size
+
+        for last_used, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if name == keep:
+                continue
+            shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+            total -= size
+            print(f"[cache] evicted {name[:12]} ({size / 1024 ** 2:.1f} MiB)")
+
+    @staticmethod
+    def _touch(entry_dir):
+        path = os.path.join(entry_dir, _LAST_USED)
+        open(path, "a").close()
+        os.utime(path)
@@ -0,0 +1,116 @@
+# stage_graph.py
+#
+# A small dependency graph of pipeline stages. Each stage is a function of
+# its dependencies' results; a stage starts as soon as all of its
+# dependencies have finished, so independent branches (raster preparation
+# and point ingestion/meshing) run side by side on a thread pool. Results
+# are handed between stages in memory.
+#
+# Stages run on threads: the heavy work inside them is GDAL, PDAL, Open3D
+# and NumPy code that releases the GIL, and the stages that are CPU bound in
+# Python already fan out to their own process pools (tiled meshing, LAZ
+# tiles, texture tiles). A stage whose CPU time or memory is measured can be
+# added as exclusive: it runs alone, since both are only known per process.
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Width of the timeline bars in characters
+TIMELINE_WIDTH = 50
+
+
+class StageGraph:
+    """
+    Stages are added with add(name, func, deps) and executed by run(), which
+    returns {name: result}. Timings are kept for print_timeline().
+    """
+
+    def __init__(self, workers=None):
+        self.workers = workers
+        self.stages = {}
+        self.exclusive = set()
+        self.results = {}
+        self.timings = {}
+
+    def add(self, name, func, deps=(), exclusive=False):
+        """
+        Registers func(*results of deps) as stage name. deps must already be
+        added. An exclusive stage waits until no other stage is running, and
+        no other stage starts until it is done.
+        """
+        missing = [dep for dep in deps if dep not in self.stages]
+        if missing:
+            raise ValueError(f"Stage {name!r} depends on unknown stages {missing}")
+        self.stages[name] = (func, tuple(deps))
+        if exclusive:
+            self.exclusive.add(name)
+
+    def _run_stage(self, name):
+        func, deps = self.stages[name]
+        start = time.perf_counter()
+        try:
+            return func(*(self.results[dep] for dep in deps))
+        finally:
+            self.timings[name] = (start - self.start, time.perf_counter() - self.start,
+                                  threading.current_thread().name)
+
+    def run(self):
+        """
+        Runs every stage once its dependencies are done. The first failing
+        stage stops the graph: stages not yet started are skipped and the
+        exception is raised once the running ones finish.
+        """
+        self.start = time.perf_counter()
+        pending = dict(self.stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.workers or len(self.stages) or 1,
+                                thread_name_prefix="stage") as pool:
+            while pending or running:
+                for name, (_, deps) in list(pending.items()):
+                    if self.exclusive.intersection(running.values()):
+                        break
+                    if not all(dep in self.results for dep in deps) or (name in self.exclusive and running):
+                        continue
+                    running[pool.submit(self._run_stage, name)] = name
+                    del pending[name]
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        wait(running)
+                        raise error
+                    self.results[name] = future.result()
+        return self.results
+
+    def critical_path(self):
+        """
+        The chain of stages that determined the total run time: from the
+        stage that finished last, repeatedly the dependency that finished last.
+        """
+        if not self.timings:
+            return []
+        name = max(self.timings, key=lambda n: self.timings[n][1])
+        path = [name]
+        while self.stages[name][1]:
+            name = max(self.stages[name][1], key=lambda n: self.timings[n][1])
+            path.append(name)
+        return path[::-1]
+
+    def print_timeline(self):
+        """Prints one bar per stage on a shared time axis and marks the critical path."""
+        if not self.timings:
+            return
+        total = max(end for _, end, _ in self.timings.values()) or 1e-9
+        critical = set(self.critical_path())
+        busy = sum(end - start for start, end, _ in self.timings.values())
+        print("\n--- STAGE TIMELINE ---")
+        for name, (start, end, _) in sorted(self.timings.items(), key=lambda item: item[1][0]):
+            first = int(start / total * TIMELINE_WIDTH)
+            last = max(first + 1, int(round(end / total * TIMELINE_WIDTH)))
+            bar = " " * first + "#" * (last - first)
+            print(f"{name:<16}{start:>8.2f}{end:>8.2f}  |{bar:<{TIMELINE_WIDTH}}|"
+                  f"{'  *' if name in critical else ''}")
+        print(f"Critical path (*): {' -> '.join(self.critical_path())}, {total:.2f}s; "
+              f"{busy:.2f}s of stage time in {total:.2f}s wall ({busy / total:.2f}x overlap)")
@@ -0,0 +1,9 @@
+# conftest.py
+#
+# The modules are flat files at the repository root; make them importable
+# from the tests whichever directory pytest is started in.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+import re
+
+import numpy as np
+
+from aoi import aoi_pdal_crops, points_in_aoi, resolve_aoi
+
+CRS = "EPSG:32633"
+
+
+def _winding_inside(x, y, ring):
+    """Non-zero winding test, independent of points_in_aoi's crossing count."""
+    winding = np.zeros(len(x), dtype=np.int64)
+    for (x0, y0), (x1, y1) in zip(ring[:-1], ring[1:]):
+        side = (x1 - x0) * (y - y0) - (x - x0) * (y1 - y0)
+        winding += ((y0 <= y) & (y1 > y) & (side > 0)).astype(np.int64)
+        winding -= ((y0 > y) & (y1 <= y) & (side < 0)).astype(np.int64)
+    return winding != 0
+
+
+def _apply_pdal_crops(stages, x, y):
+    """Applies filters.crop stages the way PDAL does: every stage removes the points outside it."""
+    keep = np.ones(len(x), dtype=bool)
+    for stage in stages:
+        assert stage["type"] == "filters.crop"
+        if "bounds" in stage:
+            min_x, max_x, min_y, max_y = map(float, re.findall(r"[-+\d.eE]+", stage["bounds"]))
+            keep &= (x >= min_x) & (x <= max_x) & (y >= min_y) & (y <= max_y)
+        else:
+            pairs = re.match(r"POLYGON\(\((.*)\)\)", stage["polygon"]).group(1).split(",")
+            ring = np.array([[float(v) for v in pair.split()] for pair in pairs])
+            assert (ring[0] == ring[-1]).all()
+            keep &= _winding_inside(x, y, ring)
+    return keep
+
+
+def test_pdal_crops_match_points_in_aoi_for_a_polygon_past_the_raster():
+    # The user's polygon reaches well past the raster's east and north edges
+    polygon = {"bounds": [40.0, 20.0, 180.0, 170.0],
+               "polygon": [[40.0, 20.0], [180.0, 60.0], [150.0, 170.0], [60.0, 120.0]]}
+    aoi = resolve_aoi(CRS, (0.0, 0.0, 100.0, 100.0), CRS, (-10.0, -10.0, 200.0, 200.0), polygon)
+    assert aoi["bounds"] == [40.0, 20.0, 100.0, 100.0]
+
+    rng = np.random.default_rng(0)
+    x, y = rng.uniform(-10, 200, 50000), rng.uniform(-10, 200, 50000)
+    stages = aoi_pdal_crops(aoi)
+    assert len(stages) == 2
+    expected = points_in_aoi(x, y, aoi)
+    np.testing.assert_array_equal(_apply_pdal_crops(stages, x, y), expected)
+    # Points in the polygon but off the raster are dropped on both paths
+    off_raster = _apply_pdal_crops(stages[1:], x, y) & ~expected
+    assert off_raster.sum() > 1000
+
+
+def test_pdal_crops_without_a_polygon_are_the_bounds():
+    aoi = {"bounds": [1.5, 2.5, 7.0, 9.0], "polygon": None}
+    stages = aoi_pdal_crops(aoi)
+    assert stages == [{"type": "filters.crop", "bounds": "([1.5, 7.0], [2.5, 9.0])"}]
+    rng = np.random.default_rng(1)
+    x, y = rng.uniform(0, 10, 1000), rng.uniform(0, 10, 1000)
+    np.testing.assert_array_equal(_apply_pdal_crops(stages, x, y), points_in_aoi(x, y, aoi))
@@ -0,0 +1,63 @@
+import pytest
+
+pytest.importorskip("laspy")
+pytest.importorskip("rasterio")
+
+from benchmark_suite import (MIN_REGRESSION_MB, MIN_REGRESSION_S, REFERENCE_KEY, check_regressions,
+                             machine_scale)
+
+
+def _result(seconds, growth=100.0):
+    return {"seconds": seconds, "rss_growth_mb": growth}
+
+
+def _run(reference_s, **stages):
+    results = {stage: {"100000": _result(*values)} for stage, values in stages.items()}
+    results[REFERENCE_KEY] = _result(reference_s)
+    return results
+
+
+def test_slowdowns_beyond_the_tolerance_are_regressions():
+    baseline = _run(1.0, mesh=(2.0,), texture=(1.0,))
+    assert check_regressions(_run(1.0, mesh=(2.4,), texture=(1.2,)), baseline, 0.25) == []
+    regressions = check_regressions(_run(1.0, mesh=(2.6,), texture=(1.2,)), baseline, 0.25)
+    assert len(regressions) == 1 and regressions[0].startswith("mesh @ 100,000 points")
+
+
+def test_small_absolute_changes_are_ignored():
+    baseline = _run(1.0, align=(0.01, 10.0))
+    # Five times slower and over twice the memory, but within the absolute floors
+    results = _run(1.0, align=(0.01 + MIN_REGRESSION_S * 0.8, 10.0 + MIN_REGRESSION_MB * 0.8))
+    assert check_regressions(results, baseline, 0.25) == []
+    results = _run(1.0, align=(0.01, 10.0 + MIN_REGRESSION_MB * 2))
+    assert check_regressions(results, baseline, 0.25) == ["align @ 100,000 points: +42 MiB vs baseline +10 MiB"]
+
+
+def test_stages_and_sizes_missing_from_the_baseline_are_skipped():
+    baseline = _run(1.0, mesh=(2.0,))
+    results = _run(1.0, mesh=(2.0,), texture=(50.0,))
+    results["mesh"]["300000"] = _result(50.0)
+    assert check_regressions(results, baseline, 0.25) == []
+
+
+def test_relative_comparison_scales_by_the_reference_workload():
+    baseline = _run(1.0, mesh=(2.0,))
+    # A machine twice as slow: 3.9s is within 25% of the scaled 4.0s
+    slower_machine = _run(2.0, mesh=(3.9,))
+    assert machine_scale(slower_machine, baseline) == 2.0
+    assert check_regressions(slower_machine, baseline, 0.25)  # absolute: a regression
+    assert check_regressions(slower_machine, baseline, 0.25, relative=True) == []
+
+    # A faster machine still catches a real slowdown
+    faster_machine = _run(0.5, mesh=(1.5,))
+    assert check_regressions(faster_machine, baseline, 0.25) == []
+    (regression,) = check_regressions(faster_machine, baseline, 0.25, relative=True)
+    assert "vs baseline 1.000s (2.000s x 0.50 machine scale)" in regression
+
+
+def test_relative_comparison_needs_reference_timings():
+    baseline = _run(1.0, mesh=(2.0,))
+    del baseline[REFERENCE_KEY]
+    with pytest.raises(ValueError):
+        check_regressions(_run(1.0, mesh=(2.0,)), baseline, 0.25, relative=True)
+    assert check_regressions(_run(1.0, mesh=(2.0,)), baseline, 0.25) == []
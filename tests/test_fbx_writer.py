@@ -0,0 +1,321 @@
+import struct
+import zlib
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from fbx_writer import (FBX_VERSION, _FOOT_ID, _FOOT_MAGIC, _HEAD_MAGIC, write_fbx, write_fbx_lods,
+                        write_fbx_tiles)
+
+_SENTINEL = b"\x00" * 13
+_SCALARS = {b"C": "<?", b"I": "<i", b"D": "<d", b"L": "<q", b"F": "<f", b"Y": "<h"}
+_ARRAYS = {b"d": np.float64, b"f": np.float32, b"l": np.int64, b"i": np.int32, b"b": np.bool_}
+
+
+class Node:
+    def __init__(self, name, props, children):
+        self.name, self.props, self.children = name, props, children
+
+    def find(self, name):
+        return [child for child in self.children if child.name == name]
+
+    def first(self, name):
+        matches = self.find(name)
+        assert matches, f"{self.name} has no {name} node"
+        return matches[0]
+
+
+def _read_property(data, pos):
+    code = data[pos:pos + 1]
+    pos += 1
+    if code in _SCALARS:
+        fmt = _SCALARS[code]
+        return struct.unpack_from(fmt, data, pos)[0], pos + struct.calcsize(fmt)
+    if code in (b"S", b"R"):
+        (length,) = struct.unpack_from("<I", data, pos)
+        raw = data[pos + 4:pos + 4 + length]
+        return (raw.decode("utf-8") if code == b"S" else raw), pos + 4 + length
+    if code in _ARRAYS:
+        count, encoding, length = struct.unpack_from("<III", data, pos)
+        raw = data[pos + 12:pos + 12 + length]
+        if encoding == 1:
+            raw = zlib.decompress(raw)
+        else:
+            assert encoding == 0
+        values = np.frombuffer(raw, dtype=np.dtype(_ARRAYS[code]).newbyteorder("<"))
+        assert len(values) == count
+        return values, pos + 12 + length
+    raise AssertionError(f"unknown property type {code!r} at {pos - 1}")
+
+
+def _read_node(data, pos):
+    """Returns (node, end) for the record at pos, or (None, pos + 13) for a null sentinel."""
+    end, num_props, props_length, name_length = struct.unpack_from("<IIIB", data, pos)
+    if end == 0:
+        assert data[pos:pos + 13] == _SENTINEL
+        return None, pos + 13
+    pos += 13
+    name = data[pos:pos + name_length].decode("ascii")
+    pos += name_length
+    props_end = pos + props_length
+    props = []
+    for _ in range(num_props):
+        value, pos = _read_property(data, pos)
+        props.append(value)
+    assert pos == props_end
+
+    children = []
+    if pos < end:
+        while True:
+            child, pos = _read_node(data, pos)
+            if child is None:
+                break
+            children.append(child)
+    assert pos == end, f"{name} ends at {pos}, header says {end}"
+    # The writer closes every node with children or without properties
+    assert (pos > props_end) == (bool(children) or not props)
+    return Node(name, props, children), end
+
+
+def read_fbx(path):
+    """Parses an FBX 7.4 binary file into a root Node, checking the header and footer."""
+    with open(path, "rb") as f:
+        data = f.read()
+    assert data.startswith(_HEAD_MAGIC)
+    assert struct.unpack_from("<I", data, len(_HEAD_MAGIC))[0] == FBX_VERSION
+
+    pos, nodes = len(_HEAD_MAGIC) + 4, []
+    while True:
+        node, pos = _read_node(data, pos)
+        if node is None:
+            break
+        nodes.append(node)
+
+    # Footer: id, zero padding to a 16-byte boundary, version, 120 zeros, magic
+    assert data[pos:pos + 16] == _FOOT_ID
+    assert data.endswith(_FOOT_MAGIC)
+    version_at = len(data) - len(_FOOT_MAGIC) - 120 - 4
+    assert struct.unpack_from("<I", data, version_at)[0] == FBX_VERSION
+    assert (version_at % 16) == 0
+    assert not data[pos + 16:version_at].strip(b"\x00")
+    assert not data[version_at + 4:-len(_FOOT_MAGIC)].strip(b"\x00")
+    return Node("", [], nodes)
+
+
+def _properties(node):
+    return {p.props[0]: p.props[4:] for p in node.first("Properties70").find("P")}
+
+
+def _objects(root, kind):
+    return {node.props[0]: node for node in root.first("Objects").find(kind)}
+
+
+def _connections(root):
+    return [tuple(c.props) for c in root.first("Connections").find("C")]
+
+
+def _triangles(geometry):
+    indices = geometry.first("PolygonVertexIndex").props[0].reshape(-1, 3)
+    # Only the last index of every polygon is stored negated
+    assert (indices[:, :2] >= 0).all() and (indices[:, 2] < 0).all()
+    return np.column_stack([indices[:, :2], ~indices[:, 2]])
+
+
+def _mesh(size=12, seed=0):
+    """A jittered (size x size) grid: vertices, triangles and UVs."""
+    rng = np.random.default_rng(seed)
+    ys, xs = np.mgrid[0:size, 0:size].astype(np.float64)
+    vertices = np.column_stack([xs.ravel(), ys.ravel(), rng.normal(size=size * size)])
+    index = np.arange(size * size).reshape(size, size)
+    a, b, c, d = index[:-1, :-1].ravel(), index[:-1, 1:].ravel(), index[1:, :-1].ravel(), index[1:, 1:].ravel()
+    triangles = np.concatenate([np.column_stack([a, b, d]), np.column_stack([a, d, c])]).astype(np.int32)
+    uvs = vertices[:, :2] / (size - 1)
+    return vertices, triangles, uvs
+
+
+def _name(node):
+    return node.props[1].split("\x00\x01")[0]
+
+
+def test_write_fbx_geometry_settings_and_texture(tmp_path):
+    vertices, triangles, uvs = _mesh()
+    texture = tmp_path / "ortho.png"
+    texture.write_bytes(b"\x89PNG fake image bytes")
+    path = tmp_path / "mesh.fbx"
+    write_fbx(str(path), vertices, triangles, uvs, str(texture), name="Terrain")
+    root = read_fbx(path)
+
+    settings = _properties(root.first("GlobalSettings"))
+    assert settings["UpAxis"] == [2] and settings["UpAxisSign"] == [1]
+    assert settings["FrontAxis"] == [1] and settings["FrontAxisSign"] == [-1]
+    assert settings["CoordAxis"] == [0] and settings["CoordAxisSign"] == [1]
+    assert settings["UnitScaleFactor"] == [100.0]
+
+    (geometry,) = _objects(root, "Geometry").values()
+    np.testing.assert_array_equal(geometry.first("Vertices").props[0].reshape(-1, 3), vertices)
+    np.testing.assert_array_equal(_triangles(geometry), triangles)
+    uv_layer = geometry.first("LayerElementUV")
+    np.testing.assert_array_equal(uv_layer.first("UV").props[0].reshape(-1, 2), uvs)
+    np.testing.assert_array_equal(uv_layer.first("UVIndex").props[0], triangles.ravel())
+    assert not geometry.find("LayerElementColor")
+
+    models, materials = _objects(root, "Model"), _objects(root, "Material")
+    (textures,), (videos,) = _objects(root, "Texture"), _objects(root, "Video")
+    (model_id,), (material_id,) = models, materials
+    assert _name(models[model_id]) == "Terrain" and _name(materials[material_id]) == "TextureMat"
+    assert _objects(root, "Video")[videos].first("Content").props[0] == texture.read_bytes()
+
+    connections = _connections(root)
+    assert ("OO", model_id, 0) in connections
+    assert ("OO", next(iter(_objects(root, "Geometry"))), model_id) in connections
+    assert ("OO", material_id, model_id) in connections
+    assert ("OP", textures, material_id, "DiffuseColor") in connections
+    assert ("OO", videos, textures) in connections
+
+
+def test_write_fbx_vertex_colors(tmp_path):
+    vertices, triangles, _ = _mesh(seed=1)
+    colors = np.random.default_rng(1).integers(0, 256, size=(len(vertices), 3)).astype(np.uint8)
+    path = tmp_path / "colored.fbx"
+    write_fbx(str(path), vertices, triangles, colors=colors)
+    root = read_fbx(path)
+
+    (geometry,) = _objects(root, "Geometry").values()
+    assert not geometry.find("LayerElementUV")
+    color_layer = geometry.first("LayerElementColor")
+    assert color_layer.first("MappingInformationType").props == ["ByPolygonVertex"]
+    rgba = color_layer.first("Colors").props[0].reshape(-1, 4)
+    np.testing.assert_allclose(rgba[:, :3] * 255.0, colors)
+    assert (rgba[:, 3] == 1.0).all()
+    np.testing.assert_array_equal(color_layer.first("ColorIndex").props[0], triangles.ravel())
+    layer_types = [e.first("Type").props[0] for e in geometry.first("Layer").find("LayerElement")]
+    assert layer_types == ["LayerElementColor", "LayerElementMaterial"]
+    assert not root.first("Objects").find("Video")
+
+
+def test_write_fbx_lods_share_one_material_under_a_lod_group(tmp_path):
+    levels = [_mesh(size) for size in (16, 8, 4)]
+    path = tmp_path / "lods.fbx"
+    write_fbx_lods(str(path), levels, ("ortho.png", b"png bytes"), name="Terrain")
+    root = read_fbx(path)
+
+    models = _objects(root, "Model")
+    (group_id,) = [i for i, m in models.items() if m.props[2] == "LodGroup"]
+    assert _name(models[group_id]) == "Terrain"
+    (attribute_id,) = _objects(root, "NodeAttribute")
+    connections = _connections(root)
+    assert ("OO", group_id, 0) in connections and ("OO", attribute_id, group_id) in connections
+
+    geometries = _objects(root, "Geometry")
+    (material_id,) = _objects(root, "Material")
+    for level, (vertices, triangles, uvs) in enumerate(levels):
+        (model_id,) = [i for i, m in models.items() if _name(m) == f"Terrain_LOD{level}"]
+        assert ("OO", model_id, group_id) in connections
+        assert ("OO", material_id, model_id) in connections
+        (geometry_id,) = [c[1] for c in connections if c[0] == "OO" and c[2] == model_id and c[1] in geometries]
+        geometry = geometries[geometry_id]
+        np.testing.assert_array_equal(geometry.first("Vertices").props[0].reshape(-1, 3), vertices)
+        np.testing.assert_array_equal(_triangles(geometry), triangles)
+        np.testing.assert_array_equal(geometry.first("LayerElementUV").first("UV").props[0].reshape(-1, 2), uvs)
+    (video,) = _objects(root, "Video").values()
+    assert video.first("Content").props[0] == b"png bytes"
+
+
+@pytest.mark.parametrize("count", [2, 3])
+def test_write_fbx_tiles_one_material_per_tile(tmp_path, count):
+    tiles = [(f"Tile_{i}", *_mesh(6, seed=i), (f"tile_{i}.png", f"png {i}".encode())) for i in range(count)]
+    path = tmp_path / "tiles.fbx"
+    write_fbx_tiles(str(path), tiles)
+    root = read_fbx(path)
+
+    models, geometries = _objects(root, "Model"), _objects(root, "Geometry")
+    materials, textures, videos = _objects(root, "Material"), _objects(root, "Texture"), _objects(root, "Video")
+    assert sorted(_name(m) for m in materials.values()) == [f"TextureMat{i}" for i in range(count)]
+    assert len(textures) == len(videos) == count
+    connections = _connections(root)
+
+    for name, vertices, triangles, uvs, (file_name, content) in tiles:
+        (model_id,) = [i for i, m in models.items() if _name(m) == name]
+        assert ("OO", model_id, 0) in connections
+        (geometry_id,) = [c[1] for c in connections if c[0] == "OO" and c[2] == model_id and c[1] in geometries]
+        np.testing.assert_array_equal(geometries[geometry_id].first("Vertices").props[0].reshape(-1, 3), vertices)
+        np.testing.assert_array_equal(_triangles(geometries[geometry_id]), triangles)
+
+        # Follow model → material → texture → video to this tile's image
+        (material_id,) = [c[1] for c in connections if c[0] == "OO" and c[2] == model_id and c[1] in materials]
+        (texture_id,) = [c[1] for c in connections if c[0] == "OP" and c[2] == material_id]
+        assert _name(textures[texture_id]) == file_name
+        (video_id,) = [c[1] for c in connections if c[0] == "OO" and c[2] == texture_id]
+        assert videos[video_id].first("Content").props[0] == content
+
+
+# Exported by Blender 4.2.0's FBX add-on with export_to_fbx's options (-Y forward,
+# Z up, unit scale applied): one triangle (0, 0, 0), (1, 0, 0), (0, 1, 0.5) in metres
+_BLENDER_REFERENCE = Path(__file__).parent / "data" / "blender_triangle.fbx"
+_REFERENCE_TRIANGLE = (np.array([[0.0, 0.0, 0.0], [1.0, 0.0, 0.0], [0.0, 1.0, 0.5]]),
+                       np.array([[0, 1, 2]], dtype=np.int32))
+
+
+def _euler_xyz(degrees):
+    """FBX's default eEulerXYZ rotation: X first, then Y, then Z."""
+    matrix = np.eye(3)
+    for axis, angle in enumerate(np.radians(degrees)):
+        c, s = np.cos(angle), np.sin(angle)
+        i, j = [k for k in range(3) if k != axis]
+        rotation = np.eye(3)
+        rotation[i, i], rotation[i, j], rotation[j, i], rotation[j, j] = c, -s, s, c
+        matrix = rotation @ matrix
+    return matrix
+
+
+def _scene_metres(root):
+    """The single model's vertices as (right, forward, up) metres, per the file's own axes and units."""
+    (model,) = _objects(root, "Model").values()
+    (geometry,) = _objects(root, "Geometry").values()
+    transform = _properties(model)
+    points = geometry.first("Vertices").props[0].reshape(-1, 3) * transform.get("Lcl Scaling", [1.0] * 3)
+    points = points @ _euler_xyz(transform.get("Lcl Rotation", [0.0] * 3)).T
+    points = points + transform.get("Lcl Translation", [0.0] * 3)
+    settings = _properties(root.first("GlobalSettings"))
+    axes = [(settings[f"{kind}Axis"][0], settings[f"{kind}AxisSign"][0]) for kind in ("Coord", "Front", "Up")]
+    scene = np.column_stack([points[:, axis] * sign for axis, sign in axes])
+    return scene * settings["UnitScaleFactor"][0] / 100.0
+
+
+def test_write_fbx_header_and_footer_match_blender(tmp_path):
+    reference = _BLENDER_REFERENCE.read_bytes()
+    path = tmp_path / "triangle.fbx"
+    write_fbx(str(path), *_REFERENCE_TRIANGLE)
+    data = path.read_bytes()
+
+    # Magic and version, then the version, 120 zeros and magic closing the footer
+    assert data[:len(_HEAD_MAGIC) + 4] == reference[:len(_HEAD_MAGIC) + 4]
+    assert data[-140:] == reference[-140:]
+    root, blender = read_fbx(path), read_fbx(_BLENDER_REFERENCE)
+    for name in ("FileId", "CreationTime"):
+        assert root.first(name).props == blender.first(name).props
+    assert ([c.name for c in root.first("FBXHeaderExtension").children] ==
+            [c.name for c in blender.first("FBXHeaderExtension").children])
+
+
+def test_write_fbx_global_settings_match_blender(tmp_path):
+    path = tmp_path / "triangle.fbx"
+    write_fbx(str(path), *_REFERENCE_TRIANGLE)
+    ours = read_fbx(path).first("GlobalSettings").first("Properties70").find("P")
+    blender = read_fbx(_BLENDER_REFERENCE).first("GlobalSettings").first("Properties70").find("P")
+    # Same entries with the same type, label and flags; the axis and unit
+    # values may differ, as Blender bakes part of them into the model transform
+    assert [p.props[:4] for p in ours] == [p.props[:4] for p in blender]
+    frame = {"UpAxis", "UpAxisSign", "FrontAxis", "FrontAxisSign", "CoordAxis", "CoordAxisSign",
+             "OriginalUpAxis", "OriginalUpAxisSign", "UnitScaleFactor", "OriginalUnitScaleFactor"}
+    assert ({p.props[0]: p.props[4:] for p in ours if p.props[0] not in frame} ==
+            {p.props[0]: p.props[4:] for p in blender if p.props[0] not in frame})
+
+
+def test_write_fbx_places_the_mesh_where_blender_does(tmp_path):
+    path = tmp_path / "triangle.fbx"
+    write_fbx(str(path), *_REFERENCE_TRIANGLE)
+    root, blender = read_fbx(path), read_fbx(_BLENDER_REFERENCE)
+    np.testing.assert_allclose(_scene_metres(root), _scene_metres(blender), atol=1e-6)
+    np.testing.assert_array_equal(_triangles(_objects(root, "Geometry").popitem()[1]), _REFERENCE_TRIANGLE[1])
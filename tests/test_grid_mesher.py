@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+from grid_mesher import _rtin_terrain, simplify_rtin, simplify_rtin_levels
+
+
+def _heights(rows, cols, seed=0):
+    return np.random.default_rng(seed).normal(size=(rows, cols)).cumsum(axis=0).cumsum(axis=1)
+
+
+def _interior_open_edges(vx, vy, triangles, shape):
+    """Edges used by one triangle that do not lie on the terrain's outline: cracks."""
+    edges = np.sort(np.concatenate((triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]])), axis=1)
+    edges, counts = np.unique(edges, axis=0, return_counts=True)
+    assert counts.max() <= 2
+    x, y = vx[edges[counts == 1]], vy[edges[counts == 1]]
+    rows, cols = shape
+    outline = (((x == 0) | (x == cols - 1)).all(axis=1) & (x[:, 0] == x[:, 1])) | \
+              (((y == 0) | (y == rows - 1)).all(axis=1) & (y[:, 0] == y[:, 1]))
+    return np.count_nonzero(~outline)
+
+
+@pytest.mark.parametrize("shape", [(20, 300), (300, 20), (33, 97), (50, 50)])
+@pytest.mark.parametrize("budget", [60, 600])
+def test_rtin_blocks_leave_no_cracks(shape, budget):
+    (vx, vy), triangles, terrain = simplify_rtin(_heights(*shape), budget)
+    assert len(triangles) <= budget
+    assert _interior_open_edges(vx, vy, triangles, terrain.shape) == 0
+
+    # Triangles tile the resampled extent exactly
+    p = np.column_stack((vx, vy)).astype(np.float64)[triangles]
+    cross = ((p[:, 1, 0] - p[:, 0, 0]) * (p[:, 2, 1] - p[:, 0, 1]) -
+             (p[:, 1, 1] - p[:, 0, 1]) * (p[:, 2, 0] - p[:, 0, 0]))
+    assert (cross > 0).all()
+    assert cross.sum() / 2 == (terrain.shape[0] - 1) * (terrain.shape[1] - 1)
+
+
+def test_rtin_terrain_follows_the_grid_shape():
+    # The short side sets the block size; the long side is covered by blocks
+    terrain, block = _rtin_terrain(_heights(10, 1000))
+    assert block == 16
+    assert terrain.shape == (17, 63 * 16 + 1)
+
+    # A grid that already fits whole blocks is not resampled
+    heights = _heights(33, 97)
+    terrain, block = _rtin_terrain(heights)
+    assert block == 32
+    np.testing.assert_allclose(terrain, heights)
+
+
+def test_rtin_levels_reach_the_full_grid():
+    heights = _heights(17, 49)
+    levels, terrain = simplify_rtin_levels(heights, [10 ** 9, 100])
+    (vx, vy), triangles = levels[0]
+    assert len(triangles) == 2 * 16 * 48
+    assert len(vx) == heights.size
+    assert len(levels[1][1]) <= 100
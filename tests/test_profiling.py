@@ -0,0 +1,55 @@
+import os
+import threading
+import time
+
+from profiling import StageProfiler
+
+
+def test_only_one_stage_is_profiled_and_overlaps_are_recorded(tmp_path):
+    profiler = StageProfiler(str(tmp_path))
+    inside, release = threading.Event(), threading.Event()
+
+    def outer():
+        with profiler.stage("mesh"):
+            with profiler.stage("mesh.normals"):
+                inside.set()
+                release.wait(5)
+
+    thread = threading.Thread(target=outer)
+    thread.start()
+    inside.wait(5)
+    with profiler.stage("texture"):
+        pass
+    release.set()
+    thread.join()
+    with profiler.stage("export"):
+        pass
+
+    records = {r["stage"]: r for r in profiler.stages}
+    assert os.path.exists(records["mesh"]["profile"])
+    # Nested stages are covered by the outer dump, overlapping ones are skipped
+    assert "profile" not in records["mesh.normals"] and "profile_skipped" not in records["mesh.normals"]
+    assert records["texture"]["profile_skipped"] == "mesh" and "profile" not in records["texture"]
+    # Profiling is free again once the profiled stage ends
+    assert os.path.exists(records["export"]["profile"])
+
+
+def test_cpu_time_is_the_stage_threads_own():
+    profiler = StageProfiler()
+    done = threading.Event()
+
+    def spin():
+        while not done.is_set():
+            pass
+
+    spinner = threading.Thread(target=spin)
+    spinner.start()
+    try:
+        with profiler.stage("idle"):
+            time.sleep(0.3)
+    finally:
+        done.set()
+        spinner.join()
+    (record,) = profiler.stages
+    # The busy thread's CPU is not charged to the sleeping stage
+    assert record["cpu_s"] < 0.1
@@ -0,0 +1,36 @@
+import time
+
+from stage_graph import StageGraph
+
+
+def _sleep(seconds):
+    def stage(*_):
+        time.sleep(seconds)
+        return seconds
+    return stage
+
+
+def _overlaps(timings, name):
+    start, end, _ = timings[name]
+    return [other for other, (s, e, _) in timings.items() if other != name and s < end and start < e]
+
+
+def test_independent_stages_overlap():
+    graph = StageGraph()
+    graph.add("texture", _sleep(0.2))
+    graph.add("points", _sleep(0.05))
+    graph.add("mesh", _sleep(0.05), ["points"])
+    graph.run()
+    assert _overlaps(graph.timings, "mesh") == ["texture"]
+
+
+def test_exclusive_stage_runs_alone():
+    graph = StageGraph()
+    graph.add("texture", _sleep(0.2))
+    graph.add("points", _sleep(0.05))
+    graph.add("mesh", _sleep(0.05), ["points"], exclusive=True)
+    graph.add("colors", _sleep(0.01))
+    graph.add("export", _sleep(0.01), ["mesh", "texture"])
+    results = graph.run()
+    assert set(results) == {"texture", "points", "mesh", "colors", "export"}
+    assert _overlaps(graph.timings, "mesh") == []
@@ -0,0 +1,116 @@
+# test_tiled_seams.py
+#
+# Tiled reconstruction clips every tile to its core area and stitches the
+# tiles along the tile lines (mesh_generator.stitch_tiles). These tests feed
+# it synthetic tiles that, like independent Poisson reconstructions, have
+# unrelated triangulations and slightly different surfaces, and check that
+# the stitched mesh has no cracks along the seams.
+
+import numpy as np
+import pytest
+
+from mesh_generator import clip_mesh, stitch_tiles, merge_seam_vertices, seam_edge_report, _compact
+
+TILE = 10.0
+OVERLAP = 2.0
+
+
+def _surface(x, y):
+    return np.sin(x / 3.0) + 0.5 * np.cos(y / 4.0)
+
+
+def _tile_mesh(bounds, spacing, rng, offset):
+    """A jittered grid triangulation of the surface (plus offset) over bounds."""
+    min_x, min_y, max_x, max_y = bounds
+    xs = np.linspace(min_x, max_x, int(round((max_x - min_x) / spacing)) + 1)
+    ys = np.linspace(min_y, max_y, int(round((max_y - min_y) / spacing)) + 1)
+    gx, gy = np.meshgrid(xs, ys)
+    jitter = rng.uniform(-0.3, 0.3, size=(2,) + gx.shape) * spacing
+    jitter[:, [0, -1], :] = 0
+    jitter[:, :, [0, -1]] = 0
+    gx, gy = gx + jitter[0], gy + jitter[1]
+    vertices = np.column_stack([gx.ravel(), gy.ravel(), _surface(gx, gy).ravel() + offset])
+    cols = len(xs)
+    r, c = np.meshgrid(np.arange(len(ys) - 1), np.arange(cols - 1), indexing="ij")
+    a = (r * cols + c).ravel()
+    b, d, e = a + 1, a + cols, a + cols + 1
+    triangles = np.concatenate([np.stack([a, b, e], axis=1), np.stack([a, e, d], axis=1)])
+    return vertices, triangles
+
+
+def _stitched(nx, ny, seed=0):
+    rng = np.random.default_rng(seed)
+    edges_x = np.concatenate([TILE * np.arange(nx), [np.inf]])
+    edges_y = np.concatenate([TILE * np.arange(ny), [np.inf]])
+    extent_x, extent_y = nx * TILE, ny * TILE
+    tiles = {}
+    for j in range(ny):
+        for i in range(nx):
+            core = (edges_x[i], edges_y[j], min(edges_x[i + 1], extent_x), min(edges_y[j + 1], extent_y))
+            bounds = (max(core[0] - OVERLAP, 0), max(core[1] - OVERLAP, 0),
+                      min(core[2] + OVERLAP, extent_x), min(core[3] + OVERLAP, extent_y))
+            vertices, triangles = _tile_mesh(bounds, rng.uniform(0.4, 0.9), rng, rng.uniform(-0.05, 0.05))
+            for axis, value, keep_below in ((0, edges_x[i], False), (0, edges_x[i + 1], True),
+                                            (1, edges_y[j], False), (1, edges_y[j + 1], True)):
+                if np.isfinite(value):
+                    vertices, triangles = clip_mesh(vertices, triangles, axis, value, keep_below)
+            tiles[(i, j)] = _compact(vertices, triangles)
+    vertices, triangles = stitch_tiles(tiles, edges_x, edges_y)
+    return vertices, triangles, edges_x[1:-1], edges_y[1:-1], (extent_x, extent_y)
+
+
+def _edge_counts(triangles):
+    edges = np.sort(np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]]), axis=1)
+    return np.unique(edges, axis=0, return_counts=True)
+
+
+def test_clip_mesh_keeps_exact_core():
+    rng = np.random.default_rng(1)
+    vertices, triangles = _tile_mesh((0, 0, 10, 10), 0.7, rng, 0.0)
+    vertices, triangles = clip_mesh(vertices, triangles, 0, 4.3, True)
+    vertices, triangles = _compact(vertices, triangles)
+    assert vertices[:, 0].max() == 4.3
+    # The cut keeps the whole area on the kept side
+    xy = vertices[triangles][:, :, :2]
+    u, v = xy[:, 1] - xy[:, 0], xy[:, 2] - xy[:, 0]
+    area = 0.5 * np.abs(u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]).sum()
+    assert area == pytest.approx(43.0)
+    # Cut points are shared, so the clipped mesh has no internal cracks
+    edges, counts = _edge_counts(triangles)
+    open_edges = edges[counts == 1]
+    ends = vertices[open_edges]
+    on_outline = ((ends[:, :, 0] == 0).all(1) | (ends[:, :, 0] == 4.3).all(1) |
+                  np.isclose(ends[:, :, 1], 0).all(1) | np.isclose(ends[:, :, 1], 10).all(1))
+    assert on_outline.all()
+
+
+@pytest.mark.parametrize("nx, ny", [(2, 1), (1, 3), (3, 3)])
+def test_stitched_tiles_have_no_seam_cracks(nx, ny):
+    vertices, triangles, seams_x, seams_y, (extent_x, extent_y) = _stitched(nx, ny)
+    report = seam_edge_report(vertices, triangles, seams_x, seams_y)
+    assert report == {"open": 0, "non_manifold": 0}
+
+    # The only open edges left are on the outline of the whole extent
+    edges, counts = _edge_counts(triangles)
+    ends = vertices[edges[counts == 1]]
+    on_outline = (np.isclose(ends[:, :, 0], 0).all(1) | np.isclose(ends[:, :, 0], extent_x).all(1) |
+                  np.isclose(ends[:, :, 1], 0).all(1) | np.isclose(ends[:, :, 1], extent_y).all(1))
+    assert on_outline.all()
+
+
+def test_stitched_triangles_keep_upward_winding():
+    vertices, triangles, _, _, _ = _stitched(3, 2, seed=3)
+    corners = vertices[triangles]
+    normals_z = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])[:, 2]
+    assert (normals_z > 0).all()
+
+
+def test_seam_edge_report_counts_a_crack():
+    # Two tiles whose seam vertices do not line up, merged without stitching
+    left = (np.array([[0, 0, 0], [1, 0, 0], [1, 1, 0], [0, 1, 0]], float), np.array([[0, 1, 2], [0, 2, 3]]))
+    right = (np.array([[1, 0, 0], [2, 0, 0], [2, 1, 0], [1, 0.5, 0], [1, 1, 0]], float),
+             np.array([[0, 1, 3], [3, 1, 2], [3, 2, 4]]))
+    vertices = np.concatenate([left[0], right[0]])
+    triangles = np.concatenate([left[1], right[1] + 4])
+    vertices, triangles = merge_seam_vertices(vertices, triangles, np.array([1.0]), np.array([]))
+    assert seam_edge_report(vertices, triangles, np.array([1.0]), np.array([]))["open"] == 3
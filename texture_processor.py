@@ -1,35 +1,384 @@
+import math
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window, bounds as window_bounds, from_bounds
 from PIL import Image
 import numpy as np
 
-def process_geotiff(tif_path, output_texture_path):
+
+# Rows converted to 8-bit per block
+BLOCK_ROWS = 512
+
+# Default cap on texture size; Blender bakes at no more than this anyway
+MAX_TEXTURE_RES = 4096
+
+# Pixels of edge colour padded around direct textures, like the bake margin
+TEXTURE_MARGIN = 4
+
+# Vertices sampled per chunk by sample_vertex_colors
+VERTEX_COLOR_CHUNK = 1_000_000
+
+
+def _stretch_limits(image_data, percentile=None):
+    """
+    Returns the (low, high) input values mapped to 0 and 255. By default this
+    is (0, max) like the original full-range stretch; with percentile=(lo, hi)
+    the limits are taken from those percentiles of the data.
+    """
+    if percentile is None:
+        return 0, (image_data.max() or 1)
+
+    if image_data.dtype.kind in "iu" and image_data.dtype.itemsize <= 2:
+        # Exact percentiles from a histogram, accumulated block by block
+        info = np.iinfo(image_data.dtype)
+        hist = np.zeros(info.max - info.min + 1, dtype=np.int64)
+        for r0 in range(0, image_data.shape[1], BLOCK_ROWS):
+            block = image_data[:, r0:r0 + BLOCK_ROWS].ravel().astype(np.int32) - info.min
+            hist += np.bincount(block, minlength=len(hist))
+        cdf = np.cumsum(hist) / hist.sum()
+        low, high = (np.searchsorted(cdf, q / 100.0) + info.min for q in percentile)
+    else:
+        # Float or wide integer data: estimate from a strided sample
+        sample = image_data[:, ::4, ::4]
+        low, high = np.nanpercentile(sample, percentile)
+    if high <= low:
+        high = low + 1
+    return low, high
+
+
+def _to_uint8(image_data, percentile=None, limits=None):
+    """
+    Converts a (bands, H, W) array to (H, W, bands) uint8, or (H, W) for a
+    single band, block by block so no full-size float temporary is built.
+    16-bit and smaller integer inputs go through a lookup table. limits=(low,
+    high) fixes the stretch instead of deriving it from image_data.
+    """
+    bands, height, width = image_data.shape
+    out = np.empty((height, width, bands), dtype=np.uint8)
+
+    if image_data.dtype == np.uint8 and percentile is None and limits is None:
+        for r0 in range(0, height, BLOCK_ROWS):
+            out[r0:r0 + BLOCK_ROWS] = np.moveaxis(image_data[:, r0:r0 + BLOCK_ROWS], 0, -1)
+        return out[:, :, 0] if bands == 1 else out
+
+    low, high = limits if limits is not None else _stretch_limits(image_data, percentile)
+    scale = 255.0 / (high - low)
+
+    if image_data.dtype.kind in "iu" and image_data.dtype.itemsize <= 2:
+        info = np.iinfo(image_data.dtype)
+        values = np.arange(info.min, info.max + 1, dtype=np.float64)
+        lut = np.clip(255 * ((values - low) / (high - low)), 0, 255).astype(np.uint8)
+        for r0 in range(0, height, BLOCK_ROWS):
+            block = image_data[:, r0:r0 + BLOCK_ROWS]
+            index = block if info.min == 0 else block.astype(np.int32) - info.min
+            out[r0:r0 + BLOCK_ROWS] = np.moveaxis(lut[index], 0, -1)
+    else:
+        for r0 in range(0, height, BLOCK_ROWS):
+            block = image_data[:, r0:r0 + BLOCK_ROWS].astype(np.float32)
+            block -= low
+            block *= scale
+            np.clip(block, 0, 255, out=block)
+            out[r0:r0 + BLOCK_ROWS] = np.moveaxis(block, 0, -1)
+
+    return out[:, :, 0] if bands == 1 else out
+
+
+def _read_texture(dataset, out_size=None, percentile=None, limits=None, **read_kwargs):
+    """
+    Reads the dataset (or a window of it) as 8-bit pixels: (H, W, 3) for
+    inputs with three or more bands, (H, W) grayscale otherwise.
+    out_size=(height, width) resamples during the read, using overviews
+    when the file has them.
+    """
+    # Read only the first three bands if available, otherwise the first band
+    bands = [1, 2, 3] if dataset.count >= 3 else [1]
+    if out_size:
+        read_kwargs["out_shape"] = (len(bands), *out_size)
+    image_data = dataset.read(bands, **read_kwargs)     # shape (bands, H, W)
+    return _to_uint8(image_data, percentile, limits)
+
+
+def _texture_size(width, height, max_res):
+    """Output (height, width) that fits within max_res without upsampling."""
+    scale = min(1.0, max_res / max(width, height))
+    return max(1, round(height * scale)), max(1, round(width * scale))
+
+
+def _footprint_window(dataset, footprint_bounds):
+    """The footprint as a window snapped outwards to whole source pixels and clipped to the raster."""
+    window = from_bounds(*footprint_bounds, transform=dataset.transform)
+    col_off = max(0, math.floor(window.col_off))
+    row_off = max(0, math.floor(window.row_off))
+    col_end = min(dataset.width, math.ceil(window.col_off + window.width))
+    row_end = min(dataset.height, math.ceil(window.row_off + window.height))
+    if col_end <= col_off or row_end <= row_off:
+        raise ValueError("Mesh footprint does not overlap the GeoTIFF.")
+    return Window(col_off, row_off, col_end - col_off, row_end - row_off)
+
+
+def snapped_bounds(tif_path, bounds):
+    """The bounds of the window of whole GeoTIFF pixels that covers bounds, clipped to the raster."""
     with rasterio.open(tif_path) as dataset:
-        # … extract CRS and bounds as before …
-
-        # 1) Read only the first three bands if available,
-        #    or replicate a single band into RGB
-        if dataset.count >= 3:
-            bands = [1, 2, 3]
-            image_data = dataset.read(bands)                # shape (3, H, W)
-        elif dataset.count == 1:
-            band1 = dataset.read(1)                         # shape (H, W)
-            # stack into three identical channels
-            image_data = np.stack([band1, band1, band1], 0) # shape (3, H, W)
-        else:
-            # fallback: read whatever is there
-            image_data = dataset.read()
-
-        # 2) Move band axis last → (H, W, 3)
-        image_data_rgb = np.moveaxis(image_data, 0, -1)
-
-        # 3) Ensure 8-bit unsigned
-        if image_data_rgb.dtype != np.uint8:
-            maxval = image_data_rgb.max() or 1
-            image_data_rgb = (255 * (image_data_rgb / maxval)).astype(np.uint8)
-
-        # 4) Now PIL can handle it as a true RGB image
-        img = Image.fromarray(image_data_rgb)
-        img.save(output_texture_path)
-        print(f"Texture saved to {output_texture_path}")
+        return window_bounds(_footprint_window(dataset, bounds), dataset.transform)
+
 
+def read_geotiff_metadata(tif_path):
+    """Returns the CRS and bounds of a GeoTIFF without reading any pixels."""
+    with rasterio.open(tif_path) as dataset:
         return dataset.crs, dataset.bounds
+
+
+def read_geotiff_texture(tif_path, max_res=MAX_TEXTURE_RES, percentile=None, bounds=None):
+    """
+    Reads the GeoTIFF as an 8-bit texture of at most max_res pixels per
+    side, resampled during the read so memory scales with the texture rather
+    than the source raster. Single-band rasters come back as (H, W)
+    grayscale. percentile=(low, high) stretches between those percentiles
+    instead of 0..max. With bounds (min_x, min_y, max_x, max_y) only the
+    window of whole pixels covering them is read.
+
+    Returns (image, crs, image_bounds), image_bounds being the raster's or
+    the window's bounds.
+    """
+    with rasterio.open(tif_path) as dataset:
+        window = _footprint_window(dataset, bounds) if bounds is not None else None
+        width, height = (window.width, window.height) if window else (dataset.width, dataset.height)
+        out_size = _texture_size(width, height, max_res)
+        image_data = _read_texture(dataset, out_size, percentile, window=window, resampling=Resampling.average)
+        print(f"Texture {out_size[1]}x{out_size[0]} read from {tif_path} "
+              f"(source {width}x{height} of {dataset.width}x{dataset.height})")
+        image_bounds = window_bounds(window, dataset.transform) if window else dataset.bounds
+        return image_data, dataset.crs, image_bounds
+
+
+def process_geotiff(tif_path, output_texture_path, max_res=MAX_TEXTURE_RES, percentile=None):
+    """
+    Writes the GeoTIFF as a PNG texture (see read_geotiff_texture). Returns
+    the raster's CRS and bounds.
+    """
+    image_data, crs, bounds = read_geotiff_texture(tif_path, max_res, percentile)
+    Image.fromarray(image_data).save(output_texture_path)
+    print(f"Texture saved to {output_texture_path}")
+    return crs, bounds
+
+
+def resize_texture(image, max_res=MAX_TEXTURE_RES):
+    """Downsamples an in-memory (H, W[, 3]) uint8 image to fit within max_res; smaller images are returned as-is."""
+    height, width = _texture_size(image.shape[1], image.shape[0], max_res)
+    if (height, width) == image.shape[:2]:
+        return image
+    return np.asarray(Image.fromarray(image).resize((width, height), resample=Image.BOX))
+
+
+def _pad_texture(image_data, left, bottom, right, top, margin):
+    """Pads margin pixels of edge colour around image_data and returns it with its grown bounds."""
+    height, width = image_data.shape[:2]
+    pad = ((margin, margin), (margin, margin)) + ((0, 0),) * (image_data.ndim - 2)
+    image_data = np.pad(image_data, pad, mode="edge")
+
+    # The margin extends the image by whole output pixels on every side
+    pixel_x = (right - left) / width
+    pixel_y = (top - bottom) / height
+    return image_data, (left - margin * pixel_x, bottom - margin * pixel_y,
+                        right + margin * pixel_x, top + margin * pixel_y)
+
+
+def read_direct_texture(tif_path, footprint_bounds, max_res=MAX_TEXTURE_RES, margin=TEXTURE_MARGIN,
+                        percentile=None, scale=1.0, limits=None):
+    """
+    Crops the GeoTIFF to the mesh footprint (min_x, min_y, max_x, max_y),
+    resamples it to at most max_res pixels per side and pads `margin` pixels
+    of edge colour around it, like the bake margin. This replaces the Cycles
+    bake in --texture-mode direct. scale < 1 reads below the source
+    resolution; limits fixes the 8-bit stretch (see texture_stretch_limits).
+
+    Returns (image, texture_bounds): the bounds covered by the image,
+    including the margin, which are the bounds the UVs must be projected
+    against.
+    """
+    with rasterio.open(tif_path) as dataset:
+        window = _footprint_window(dataset, footprint_bounds)
+
+        # Never upsample; keep the padded image within max_res
+        height, width = _texture_size(max(1, round(window.width * scale)), max(1, round(window.height * scale)),
+                                      max_res - 2 * margin)
+        image_data = _read_texture(dataset, (height, width), percentile, limits, window=window,
+                                   resampling=Resampling.bilinear)
+        left, bottom, right, top = window_bounds(window, dataset.transform)
+
+    return _pad_texture(image_data, left, bottom, right, top, margin)
+
+
+def prepare_direct_texture(tif_path, footprint_bounds, output_texture_path, max_res=MAX_TEXTURE_RES,
+                           margin=TEXTURE_MARGIN, percentile=None, scale=1.0, limits=None):
+    """Writes read_direct_texture's image as a PNG and returns its texture bounds."""
+    image_data, texture_bounds = read_direct_texture(tif_path, footprint_bounds, max_res, margin,
+                                                     percentile, scale, limits)
+    Image.fromarray(image_data).save(output_texture_path)
+    print(f"Direct texture {image_data.shape[1]}x{image_data.shape[0]} saved to {output_texture_path}")
+    return texture_bounds
+
+
+def crop_texture(image, image_bounds, footprint_bounds, max_res=MAX_TEXTURE_RES, margin=TEXTURE_MARGIN):
+    """
+    read_direct_texture for an in-memory (H, W[, 3]) uint8 image covering
+    image_bounds (row 0 at max Y). Returns (image, texture_bounds).
+    """
+    left, bottom, right, top = image_bounds
+    height, width = image.shape[:2]
+    pixel_x, pixel_y = (right - left) / width, (top - bottom) / height
+    # Snap the footprint outwards to whole pixels, clipped to the image
+    c0 = max(0, math.floor((footprint_bounds[0] - left) / pixel_x))
+    c1 = min(width, math.ceil((footprint_bounds[2] - left) / pixel_x))
+    r0 = max(0, math.floor((top - footprint_bounds[3]) / pixel_y))
+    r1 = min(height, math.ceil((top - footprint_bounds[1]) / pixel_y))
+    if c1 <= c0 or r1 <= r0:
+        raise ValueError("Mesh footprint does not overlap the image.")
+
+    image_data = resize_texture(image[r0:r1, c0:c1], max_res - 2 * margin)
+    return _pad_texture(image_data, left + c0 * pixel_x, top - r1 * pixel_y,
+                        left + c1 * pixel_x, top - r0 * pixel_y, margin)
+
+
+def sample_vertex_colors(image, image_bounds, xy, chunk_size=VERTEX_COLOR_CHUNK):
+    """
+    Bilinear samples of an (H, W[, 3]) uint8 image covering image_bounds
+    (row 0 at max Y) at the (N, 2) positions xy, as (N, 3) uint8 RGB.
+    Pixel values sit at pixel centres and positions past the outer centres
+    take the edge pixels. Works through chunk_size positions at a time, so
+    the float temporaries stay bounded however many vertices there are.
+    """
+    left, bottom, right, top = image_bounds
+    height, width = image.shape[:2]
+    pixels = image if image.ndim == 3 else image[:, :, np.newaxis]
+    colors = np.empty((len(xy), 3), dtype=np.uint8)
+    for start in range(0, len(xy), chunk_size):
+        chunk = xy[start:start + chunk_size]
+        # Continuous pixel coordinates with integers at pixel centres
+        col = np.clip((chunk[:, 0] - left) / (right - left) * width - 0.5, 0, width - 1)
+        row = np.clip((top - chunk[:, 1]) / (top - bottom) * height - 0.5, 0, height - 1)
+        c0 = np.minimum(col.astype(np.intp), width - 2) if width > 1 else np.zeros(len(col), dtype=np.intp)
+        r0 = np.minimum(row.astype(np.intp), height - 2) if height > 1 else np.zeros(len(row), dtype=np.intp)
+        c1, r1 = np.minimum(c0 + 1, width - 1), np.minimum(r0 + 1, height - 1)
+        fx, fy = (col - c0)[:, np.newaxis], (row - r0)[:, np.newaxis]
+        top_row = pixels[r0, c0] * (1 - fx) + pixels[r0, c1] * fx
+        bottom_row = pixels[r1, c0] * (1 - fx) + pixels[r1, c1] * fx
+        sampled = top_row * (1 - fy) + bottom_row * fy
+        colors[start:start + chunk_size] = np.rint(sampled).astype(np.uint8)
+    print(f"Sampled colours for {len(xy)} vertices from a {width}x{height} texture")
+    return colors
+
+
+def texture_stretch_limits(tif_path, percentile=None, sample_res=MAX_TEXTURE_RES):
+    """
+    The (low, high) 8-bit stretch for the whole raster, estimated from a
+    read at sample_res, so that textures cut from it separately share one
+    stretch. None for 8-bit rasters without a percentile stretch, which
+    are copied as-is.
+    """
+    with rasterio.open(tif_path) as dataset:
+        if dataset.dtypes[0] == "uint8" and percentile is None:
+            return None
+        bands = [1, 2, 3] if dataset.count >= 3 else [1]
+        out_size = _texture_size(dataset.width, dataset.height, sample_res)
+        sample = dataset.read(bands, out_shape=(len(bands), *out_size), resampling=Resampling.nearest)
+    return _stretch_limits(sample, percentile)
+
+
+def plan_texture_tiles(tif_path, footprint_bounds, tile_res, scale=1.0, margin=TEXTURE_MARGIN):
+    """
+    Splits the footprint into the fewest rows x columns of texture tiles
+    that keep the GeoTIFF at `scale` times its native resolution with no
+    tile over tile_res pixels per side (including the margin). Returns
+    (rows, cols, bounds): bounds is the footprint snapped outwards to whole
+    source pixels, which the tile grid divides evenly.
+    """
+    with rasterio.open(tif_path) as dataset:
+        window = _footprint_window(dataset, footprint_bounds)
+        bounds = window_bounds(window, dataset.transform)
+
+    # Leave room for the margin and for triangles that spill over a tile line
+    usable = (tile_res - 2 * margin) * 0.95
+    cols = max(1, math.ceil(window.width * scale / usable))
+    rows = max(1, math.ceil(window.height * scale / usable))
+    print(f"Texture tiles: {rows}x{cols} over {window.width}x{window.height} source pixels "
+          f"at scale {scale}")
+    return rows, cols, bounds
+
+
+def _write_texture_tile(tif_path, tile, tile_res, scale, percentile, limits):
+    texture_bounds = prepare_direct_texture(tif_path, tile["footprint"], tile["texture"], max_res=tile_res,
+                                            percentile=percentile, scale=scale, limits=limits)
+    return {**tile, "texture_bounds": texture_bounds}
+
+
+def write_texture_tiles(tif_path, tiles, tile_res, scale=1.0, percentile=None, workers=None):
+    """
+    Writes one direct texture per tile, each covering tile["footprint"], to
+    tile["texture"]. Tiles are cut in parallel worker processes that each
+    hold one tile's pixels at a time; all tiles share one 8-bit stretch.
+    Returns the tiles with their "texture_bounds" added.
+    """
+    limits = texture_stretch_limits(tif_path, percentile)
+    context = multiprocessing.get_context("spawn")
+    workers = min(workers or os.cpu_count() or 1, len(tiles))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        futures = [pool.submit(_write_texture_tile, tif_path, tile, tile_res, scale, percentile, limits)
+                   for tile in tiles]
+        return [future.result() for future in futures]
+
+
+def texture_difference_report(direct, direct_bounds, baked_path, baked_bounds):
+    """
+    Compares a direct texture (a PNG path or a uint8 image array) with a
+    Cycles-baked one. The baked image is cropped to the direct texture's
+    bounds and resampled to its size; only pixels the bake actually covered
+    (non-black) are compared.
+    """
+    direct = (Image.fromarray(direct) if isinstance(direct, np.ndarray) else Image.open(direct)).convert("RGB")
+    baked = Image.open(baked_path).convert("RGB")
+
+    # Only compare the direct pixels that fall inside the baked image's bounds
+    b_left, b_bottom, b_right, b_top = baked_bounds
+    d_left, d_bottom, d_right, d_top = direct_bounds
+    pixel_x = (d_right - d_left) / direct.width
+    pixel_y = (d_top - d_bottom) / direct.height
+    c0 = max(0, math.ceil((b_left - d_left) / pixel_x))
+    c1 = min(direct.width, math.floor((b_right - d_left) / pixel_x))
+    r0 = max(0, math.ceil((d_top - b_top) / pixel_y))
+    r1 = min(direct.height, math.floor((d_top - b_bottom) / pixel_y))
+    if c1 <= c0 or r1 <= r0:
+        raise ValueError("The baked texture does not cover the direct texture's bounds.")
+    direct = direct.crop((c0, r0, c1, r1))
+
+    # Same area as a pixel box in the baked image (row 0 is the top/max-Y edge)
+    sx = baked.width / (b_right - b_left)
+    sy = baked.height / (b_top - b_bottom)
+    box = ((d_left + c0 * pixel_x - b_left) * sx, (b_top - (d_top - r0 * pixel_y)) * sy,
+           (d_left + c1 * pixel_x - b_left) * sx, (b_top - (d_top - r1 * pixel_y)) * sy)
+    box = (max(0.0, box[0]), max(0.0, box[1]), min(baked.width, box[2]), min(baked.height, box[3]))
+    baked = baked.resize(direct.size, resample=Image.BILINEAR, box=box)
+
+    direct_px = np.asarray(direct, dtype=np.int16)
+    baked_px = np.asarray(baked, dtype=np.int16)
+    covered = baked_px.any(axis=2)
+    diff = np.abs(direct_px - baked_px)[covered]
+    if diff.size == 0:
+        raise ValueError("The baked texture does not cover the direct texture's bounds.")
+
+    mse = np.mean(diff.astype(np.float64) ** 2)
+    report = {
+        "compared_pixels": int(covered.sum()),
+        "mean_abs_diff": float(diff.mean()),
+        "max_abs_diff": int(diff.max()),
+        "pct_pixels_over_8": float(100.0 * np.mean(diff.max(axis=1) > 8)),
+        "psnr_db": float("inf") if mse == 0 else float(10 * np.log10(255.0 ** 2 / mse)),
+    }
+    print("Texture difference (direct vs. baked):")
+    for key, value in report.items():
+        print(f"  {key}: {value}")
+    return report